@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Headless batch processing of recorded footage.
+
+Finds the videos in the given files, directories or globs, splits long ones into chunks
+that start at keyframes, and processes the chunks on a pool of worker processes, each
+with its own model. Every chunk after the first starts overlap_seconds early, so ByteTrack
+and the speed estimator are warmed up by the time it reaches its own frames; tracks are
+stitched across chunks by matching their boxes over those shared frames. Each video gets
+a <name>.violations.json report (and, with --annotate, annotated .mp4 parts) in --output.
+
+    python batch_process.py recordings/ --output reports --workers 4
+    python batch_process.py "recordings/2024-06-*/*.mp4" --chunk-seconds 120 --annotate
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from box_batch import box_iou, boxes_to_arrays
+from calibration import CameraCalibration
+from detector_backend import DETECTOR_BACKENDS, load_detector
+from pipeline import FramePacket
+from speed_estimator import make_estimator
+from traffic_processor import TrafficProcessor
+from vehicle_store import VehicleStore
+from video_capture import open_capture
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".m4v", ".ts")
+IMAGE_WIDTH = 1280
+IMAGE_HEIGHT = 720
+MIN_STITCH_IOU = 0.5  # mean box IoU over the shared frames for two chunks' tracks to be one vehicle
+
+# The model and settings of this worker process, set once by _init_worker
+_worker = {}
+
+
+def find_videos(inputs: list) -> list:
+    """Video files named by inputs (files, directories or glob patterns), sorted, without duplicates"""
+    videos = set()
+    for pattern in inputs:
+        for path in glob.glob(pattern) or [pattern]:
+            if os.path.isdir(path):
+                videos.update(os.path.join(path, name) for name in os.listdir(path)
+                              if name.lower().endswith(VIDEO_EXTENSIONS))
+            elif os.path.isfile(path):
+                videos.add(path)
+    return sorted(videos)
+
+
+def keyframes(path: str):
+    """(frame numbers of the keyframes, frame count), read from the packets without decoding"""
+    cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    found, frames = [], 0
+    while cap.grab():
+        if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            found.append(frames)
+        frames += 1
+    cap.release()
+    return found, frames
+
+
+def plan_chunks(path: str, chunk_seconds: float, overlap_seconds: float) -> list:
+    """
+    Chunks of path, each owning the frames [start, end). A chunk is read from read_start,
+    the last keyframe at least overlap_seconds before start, so seeking there is exact and
+    cheap and the frames before start only warm up its tracker.
+    """
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    cap.release()
+    key_frames, frame_count = keyframes(path)
+    chunk_frames = max(int(chunk_seconds * fps), 1) if chunk_seconds else frame_count
+    overlap_frames = int(overlap_seconds * fps)
+    if not key_frames:
+        # No keyframe information: seeking would not be exact, so do not split
+        chunk_frames = frame_count
+    chunks = []
+    for start in range(0, max(frame_count, 1), max(chunk_frames, 1)):
+        earlier = [frame for frame in key_frames if frame <= start - overlap_frames]
+        chunks.append({
+            "path": path,
+            "index": len(chunks),
+            "fps": fps,
+            "read_start": earlier[-1] if start and earlier else 0,
+            "start": start,
+            "end": min(start + chunk_frames, frame_count),
+            "overlap_frames": overlap_frames,
+        })
+    return chunks
+
+
+def load_model(settings: dict):
+    """Default detector factory: the configured model, see detector_backend.load_detector"""
+    return load_detector(settings["model"], settings["backend"], settings["device"],
+                         threads=settings["threads"], cache_dir=settings["model_cache_dir"])
+
+
+def _init_worker(detector_factory, settings: dict):
+    if settings["threads"]:
+        cv2.setNumThreads(settings["threads"])
+    _worker["model"] = detector_factory(settings)
+    _worker["settings"] = settings
+    # run_batch compiled the profile first, so this reads its cache
+    _worker["calibration"] = CameraCalibration.load(settings["profile"], IMAGE_WIDTH, IMAGE_HEIGHT)
+
+
+def process_chunk(chunk: dict) -> dict:
+    """
+    Track one chunk on this worker's model. Returns the violations on the frames the chunk
+    owns, plus the tracked boxes of its first (warm-up) and last overlap frames for stitching.
+    """
+    model, settings, calibration = _worker["model"], _worker["settings"], _worker["calibration"]
+    started = time.perf_counter()
+    fps = chunk["fps"]
+    cap = open_capture(chunk["path"], IMAGE_WIDTH, IMAGE_HEIGHT, settings["decode_backend"])
+    if chunk["read_start"]:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, chunk["read_start"])
+    store = VehicleStore(settings["max_tracked_vehicles"],
+                         speed_estimator=make_estimator(settings["speed_estimator"], settings["max_tracked_vehicles"],
+                                                        scaling_factor=calibration.scaling_factor),
+                         scaling_factor=calibration.scaling_factor)
+    processor = TrafficProcessor(calibration.region_points, calibration.source_points, calibration.target_points,
+                                 IMAGE_WIDTH, IMAGE_HEIGHT, calibration.speed_limit, calibration.fine_speed_limit, store,
+                                 transformer=calibration.road_plane_map, region_mask=calibration.region_mask)
+    writer = None
+    video_path = None
+    if settings["annotate"]:
+        name = os.path.splitext(os.path.basename(chunk["path"]))[0]
+        video_path = os.path.join(settings["output"], f"{name}.annotated.{chunk['index']:03d}.mp4")
+        writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (IMAGE_WIDTH, IMAGE_HEIGHT))
+
+    violations, head, tail = [], {}, {}
+    tail_from = chunk["end"] - chunk["overlap_frames"]
+    frames = 0
+    for frame_number in range(chunk["read_start"], chunk["end"]):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames += 1
+        # Frame-number time stamps are the same in every chunk, wherever it was seeked to
+        packet = FramePacket(frame, frame_number / fps, frame_number)
+        result = model.track(frame, persist=frame_number != chunk["read_start"], tracker=settings["tracking_model"],
+                             verbose=False)[0]
+        xyxy, tracker_ids, confs = boxes_to_arrays(result.boxes)
+        processor.track(packet, xyxy, tracker_ids, confs)
+        if frame_number < chunk["start"]:
+            head[frame_number] = (tracker_ids.tolist(), xyxy.tolist())
+            continue
+        if frame_number >= tail_from:
+            tail[frame_number] = (tracker_ids.tolist(), xyxy.tolist())
+        for tracker_id, speed in packet.data["violations"]:
+            violations.append({"tracker_id": tracker_id, "speed": speed, "frame_number": frame_number,
+                               "time_stamp": packet.time_stamp})
+        if writer is not None:
+            processor.annotate(packet)
+            writer.write(packet.frame)
+    cap.release()
+    if writer is not None:
+        writer.release()
+    return {
+        "path": chunk["path"],
+        "index": chunk["index"],
+        "frames": frames,
+        "owned_frames": max(min(chunk["end"], chunk["read_start"] + frames) - chunk["start"], 0),
+        "seconds": time.perf_counter() - started,
+        "violations": violations,
+        "head": head,
+        "tail": tail,
+        "video": video_path,
+    }
+
+
+def stitch_tracks(tail: dict, head: dict, min_iou: float = MIN_STITCH_IOU) -> dict:
+    """
+    {next chunk's tracker id: previous chunk's tracker id} for tracks whose boxes overlap
+    by min_iou on average over the frames both chunks tracked; best matches first.
+    """
+    common = sorted(set(tail) & set(head))
+    if not common:
+        return {}
+    totals = {}
+    for frame_number in common:
+        previous_ids, previous_boxes = tail[frame_number]
+        next_ids, next_boxes = head[frame_number]
+        if not previous_ids or not next_ids:
+            continue
+        iou = box_iou(previous_boxes, next_boxes)
+        for i, j in zip(*np.nonzero(iou)):
+            key = (previous_ids[i], next_ids[j])
+            totals[key] = totals.get(key, 0.0) + iou[i, j]
+    matches, used = {}, set()
+    for (previous_id, next_id), total in sorted(totals.items(), key=lambda item: -item[1]):
+        if total / len(common) < min_iou:
+            break
+        if next_id in matches or previous_id in used:
+            continue
+        matches[next_id] = previous_id
+        used.add(previous_id)
+    return matches
+
+
+def build_report(path: str, chunks: list, results: list, calibration: CameraCalibration) -> dict:
+    """One vehicle per stitched track with its violations, from the chunk results of one video"""
+    results = sorted(results, key=lambda result: result["index"])
+    vehicles = {}
+    next_vehicle = 0
+    previous = {}
+    for result in results:
+        matches = stitch_tracks(results[result["index"] - 1]["tail"], result["head"]) if result["index"] else {}
+        current = {}
+        for event in result["violations"]:
+            tracker_id = event["tracker_id"]
+            if tracker_id not in current:
+                if tracker_id in matches and matches[tracker_id] in previous:
+                    current[tracker_id] = previous[matches[tracker_id]]
+                else:
+                    current[tracker_id] = next_vehicle
+                    next_vehicle += 1
+            vehicle = vehicles.setdefault(current[tracker_id], {
+                "vehicle": current[tracker_id], "max_speed": 0.0, "first_frame": event["frame_number"],
+                "first_time_stamp": event["time_stamp"], "events": 0, "tracker_ids": []})
+            vehicle["max_speed"] = max(vehicle["max_speed"], event["speed"])
+            vehicle["last_frame"] = event["frame_number"]
+            vehicle["events"] += 1
+            if [result["index"], tracker_id] not in vehicle["tracker_ids"]:
+                vehicle["tracker_ids"].append([result["index"], tracker_id])
+        # Tracks that had no violation yet in this chunk can still carry a vehicle number forward
+        for next_id, previous_id in matches.items():
+            if next_id not in current and previous_id in previous:
+                current[next_id] = previous[previous_id]
+        previous = current
+    return {
+        "video": path,
+        "fps": chunks[0]["fps"],
+        "frames": sum(result["owned_frames"] for result in results),
+        "chunks": [{key: chunk[key] for key in ("read_start", "start", "end")} for chunk in chunks],
+        "speed_limit": calibration.speed_limit,
+        "fine_speed_limit": calibration.fine_speed_limit,
+        "processing_seconds": sum(result["seconds"] for result in results),
+        "violations": sorted(vehicles.values(), key=lambda vehicle: vehicle["first_frame"]),
+        "annotated_videos": [result["video"] for result in results if result["video"]],
+    }
+
+
+def run_batch(videos: list, settings: dict, workers: int = None, chunk_seconds: float = 300,
+              overlap_seconds: float = 4, detector_factory=load_model, write_reports: bool = True) -> list:
+    """Process every video on `workers` processes; returns one report per video, in input order"""
+    workers = workers or os.cpu_count() or 1
+    if settings["threads"] is None:
+        # Share the cores between the workers instead of every worker using all of them
+        settings = {**settings, "threads": max((os.cpu_count() or 1) // workers, 1)}
+    os.makedirs(settings["output"], exist_ok=True)
+    # Compiled once here so the workers only read its cache; also where the report's speed limits come from
+    calibration = CameraCalibration.load(settings["profile"], IMAGE_WIDTH, IMAGE_HEIGHT)
+    plans = {path: plan_chunks(path, chunk_seconds, overlap_seconds) for path in videos}
+    # Longest chunks first, so one long file does not finish alone at the end
+    chunks = sorted((chunk for plan in plans.values() for chunk in plan),
+                    key=lambda chunk: chunk["read_start"] - chunk["end"])
+    results = {path: [] for path in videos}
+    reports = {}
+    with multiprocessing.Pool(workers, _init_worker, (detector_factory, settings)) as pool:
+        for result in pool.imap_unordered(process_chunk, chunks):
+            path = result["path"]
+            results[path].append(result)
+            if len(results[path]) < len(plans[path]):
+                continue
+            reports[path] = build_report(path, plans[path], results[path], calibration)
+            if write_reports:
+                name = os.path.splitext(os.path.basename(path))[0]
+                with open(os.path.join(settings["output"], f"{name}.violations.json"), "w") as f:
+                    json.dump(reports[path], f, indent=2)
+            print(f"{path}: {reports[path]['frames']} frames, {len(reports[path]['violations'])} violations")
+    return [reports[path] for path in videos]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="Video files, directories or glob patterns")
+    parser.add_argument("--output", default="batch_output", help="Directory for the reports and annotated videos")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    parser.add_argument("--chunk-seconds", type=float, default=300, help="Split videos longer than this (0: never)")
+    parser.add_argument("--overlap-seconds", type=float, default=4, help="Warm-up before each chunk, for stitching")
+    parser.add_argument("--annotate", action="store_true", help="Also write annotated video")
+    parser.add_argument("--profile", default="camera_profile.json",
+                        help="Calibration profile: region, source/target points, scale and speed limits")
+    parser.add_argument("--model", default="yolov8x.pt")
+    parser.add_argument("--backend", default="auto", choices=DETECTOR_BACKENDS)
+    parser.add_argument("--device", default=None, help="Default: cuda:0 if PyTorch sees a GPU, else cpu")
+    parser.add_argument("--threads", type=int, default=None, help="Inference threads per worker")
+    parser.add_argument("--decode-backend", default="opencv", choices=("opencv", "ffmpeg"))
+    args = parser.parse_args()
+
+    videos = find_videos(args.inputs)
+    if not videos:
+        parser.error(f"No videos found in {args.inputs}")
+    settings = {
+        "output": args.output,
+        "profile": args.profile,
+        "model": args.model,
+        "backend": args.backend,
+        "device": args.device,
+        "threads": args.threads,
+        "model_cache_dir": "models",
+        "tracking_model": "bytetrack.yaml",
+        "decode_backend": args.decode_backend,
+        "speed_estimator": "least_squares",
+        "max_tracked_vehicles": 256,
+        "annotate": args.annotate,
+    }
+    start = time.perf_counter()
+    reports = run_batch(videos, settings, args.workers, args.chunk_seconds, args.overlap_seconds)
+    elapsed = time.perf_counter() - start
+    frames = sum(report["frames"] for report in reports)
+    footage = sum(report["frames"] / report["fps"] for report in reports)
+    print(f"{len(reports)} videos, {frames} frames in {elapsed:.1f} s: {frames / elapsed:.1f} fps, "
+          f"{footage / elapsed:.1f}x real time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Throughput of batch_process.py against worker count, and chunked against whole-file results.
+
+Writes synthetic clips (lossless FFV1, so the stub detector can read the vehicle ids back
+from the pixels) and runs batch_process.run_batch on them with a stub detector that burns
+CPU like a real model. Reports frames per second and speed-up per worker count. It also
+checks that every worker count, and splitting the clips into chunks with stitched tracks,
+finds the same speeding vehicles as processing each clip whole on one worker.
+
+    python bench/bench_batch_process.py --clips 4 --seconds 30 --workers 1 2 4 --chunk-seconds 10
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_process import run_batch
+from calibration import load_profile
+from synthetic import FPS, StubModel, SyntheticTraffic
+
+PROFILE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "camera_profile.json")
+
+
+def stub_detector(settings):
+    """Detector factory for the worker processes"""
+    return StubModel(cpu_seconds=settings["stub_detector_ms"] / 1000)
+
+
+def speeding_vehicles(reports):
+    """Per video, the set of speeding vehicles, each as the set of synthetic ids its tracks carried"""
+    return [sorted(sorted({tracker_id for _, tracker_id in vehicle["tracker_ids"]}) for vehicle in report["violations"])
+            for report in reports]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clips", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=30, help="Length of each clip")
+    parser.add_argument("--vehicles", type=int, default=15)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chunk-seconds", type=float, default=10, help="Chunk length of the chunked run")
+    parser.add_argument("--overlap-seconds", type=float, default=4)
+    parser.add_argument("--detector-ms", type=float, default=20, help="Simulated CPU inference time per frame")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        videos = [SyntheticTraffic(args.vehicles, seed=seed).write_video(
+                  os.path.join(root, f"clip_{seed}.mkv"), int(args.seconds * FPS), "FFV1") for seed in range(args.clips)]
+        # The repo's profile with its region inlined, so that its calibration cache lands in root
+        profile = load_profile(PROFILE_FILE)
+        with open(os.path.join(root, "camera_profile.json"), "w") as f:
+            json.dump(profile, f)
+        settings = {
+            "output": os.path.join(root, "output"),
+            "profile": os.path.join(root, "camera_profile.json"),
+            "threads": 1,
+            "tracking_model": "bytetrack.yaml",
+            "decode_backend": "opencv",
+            "speed_estimator": "least_squares",
+            "max_tracked_vehicles": 256,
+            "annotate": False,
+            "stub_detector_ms": args.detector_ms,
+        }
+        runs = [(workers, 0) for workers in args.workers] + [(max(args.workers), args.chunk_seconds)]
+        reference = None
+        print(f"{'workers':>8} {'chunks':>7} {'wall s':>7} {'fps':>7} {'speed-up':>9} {'violators':>10} {'same':>5}")
+        for workers, chunk_seconds in runs:
+            start = time.perf_counter()
+            reports = run_batch(videos, settings, workers, chunk_seconds, args.overlap_seconds, stub_detector,
+                                write_reports=False)
+            elapsed = time.perf_counter() - start
+            frames = sum(report["frames"] for report in reports)
+            vehicles = speeding_vehicles(reports)
+            reference = reference if reference is not None else vehicles
+            row = {
+                "workers": workers,
+                "chunks": sum(len(report["chunks"]) for report in reports),
+                "wall_s": elapsed,
+                "fps": frames / elapsed,
+                "violators": sum(len(video) for video in vehicles),
+                "same_as_first": vehicles == reference,
+            }
+            row["speed_up"] = row["fps"] / results[0]["fps"] if results else 1.0
+            results.append(row)
+            print(f"{workers:>8} {row['chunks']:>7} {elapsed:>7.1f} {row['fps']:>7.1f} {row['speed_up']:>8.2f}x "
+                  f"{row['violators']:>10} {'yes' if row['same_as_first'] else 'NO':>5}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
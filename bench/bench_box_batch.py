@@ -0,0 +1,126 @@
+"""
+Micro-benchmark: per-box Python loop vs the batched box stage, per frame, against box count.
+
+    python bench/bench_box_batch.py --counts 1 10 40 100 200 --frames 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_batch import boxes_to_arrays, bottom_centres, speed_classes, SPEED_CLASS_COLOURS
+from mask import mask
+from vehicle_class import ViewTransformer, scale_coordinates
+
+IMAGE_WIDTH = 1280
+IMAGE_HEIGHT = 720
+SPEED_LIMIT = 120
+FINE_SPEED_LIMIT = 130
+SOURCE_0 = scale_coordinates(np.array([[1252, 787], [2298, 803], [5039, 2159], [-550, 2159]]))
+TARGET = np.array([[0, 0], [24, 0], [24, 249], [0, 249]])
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+
+
+class FakeBoxes:
+    """Stands in for ultralytics Boxes: whole-frame arrays plus per-box iteration"""
+    def __init__(self, xyxy, ids, conf):
+        self.xyxy = xyxy
+        self.id = ids
+        self.conf = conf
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    def __iter__(self):
+        for i in range(len(self.xyxy)):
+            yield FakeBoxes(self.xyxy[i:i + 1], self.id[i:i + 1], self.conf[i:i + 1])
+
+
+def random_boxes(rng, count):
+    x1 = rng.uniform(0, IMAGE_WIDTH - 120, count)
+    y1 = rng.uniform(250, IMAGE_HEIGHT - 80, count)
+    w = rng.uniform(40, 120, count)
+    h = rng.uniform(30, 80, count)
+    xyxy = np.stack([x1, y1, x1 + w, y1 + h], axis=1).astype(np.float32)
+    ids = np.arange(1, count + 1, dtype=np.float32)
+    conf = rng.uniform(0.3, 1.0, count).astype(np.float32)
+    return FakeBoxes(xyxy, ids, conf)
+
+
+def per_box(boxes, region_mask, transformer, speeds):
+    """The original main.py loop body, minus the vehicle_class call and drawing"""
+    colors = []
+    for box in boxes:
+        if box.id is None:
+            continue
+        conf = box.conf[0]
+        tracker_id = int(box.id[0].item()) if hasattr(box.id[0], 'item') else int(box.id[0])
+        x1, y1, x2, y2 = box.xyxy[0].tolist()
+        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+        center_x = (x1 + x2) // 2
+        center_y = y2
+        region_mask.point_is_inside(center_x, center_y)
+        transformer.transform_points(np.array([x1, y1, x2, y2])).astype(int)
+        speed = speeds[tracker_id % len(speeds)]
+        if region_mask.point_is_inside(center_x, center_y):
+            if speed > FINE_SPEED_LIMIT:
+                color = (0, 0, 255)
+            elif speed > SPEED_LIMIT:
+                color = (0, 255, 255)
+            else:
+                color = (0, 255, 0)
+            colors.append((conf, color))
+    return colors
+
+
+def batched(boxes, region_mask, transformer, speeds):
+    xyxy, tracker_ids, confs = boxes_to_arrays(boxes)
+    points = bottom_centres(xyxy)
+    is_inside = region_mask.points_are_inside(points[:, 0], points[:, 1])
+    transformer.transform_points(points)
+    classes = speed_classes(speeds[tracker_ids % len(speeds)], SPEED_LIMIT, FINE_SPEED_LIMIT)
+    return [SPEED_CLASS_COLOURS[c] for c in classes[is_inside]]
+
+
+def time_per_frame(fn, frames, *args):
+    start = time.perf_counter()
+    for boxes in frames:
+        fn(boxes, *args)
+    return (time.perf_counter() - start) / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 10, 40, 100, 200])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    region_mask = mask(IMAGE_WIDTH, IMAGE_HEIGHT, region_points)
+    transformer = ViewTransformer(SOURCE_0, TARGET)
+    rng = np.random.default_rng(0)
+    speeds = rng.uniform(60, 160, 1024).astype(np.float32)
+
+    results = []
+    print(f"{'boxes':>6} {'per-box us':>12} {'batched us':>12} {'speed-up':>9}")
+    for count in args.counts:
+        frames = [random_boxes(rng, count) for _ in range(args.frames)]
+        loop_t = time_per_frame(per_box, frames, region_mask, transformer, speeds)
+        batch_t = time_per_frame(batched, frames, region_mask, transformer, speeds)
+        results.append({"boxes": count, "per_box_us": loop_t * 1e6, "batched_us": batch_t * 1e6})
+        print(f"{count:>6} {loop_t * 1e6:>12.1f} {batch_t * 1e6:>12.1f} {loop_t / batch_t:>8.1f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
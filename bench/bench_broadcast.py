@@ -0,0 +1,179 @@
+"""
+MJPEG load test: producer cost against the number of concurrent /video_feed viewers.
+
+Serves a synthetic processed stream over real HTTP the way stream_server.py does (one
+BroadcastProducer into a RenditionBroadcaster, mjpeg_stream per client, ?size= picks the
+rendition) and connects 1..50 viewers spread over the requested sizes. A share of the
+viewers read slowly; they should skip frames while the producer's frame rate, detector
+calls, CPU per frame and JPEG encodes per rendition stay flat.
+
+    python bench/bench_broadcast.py --viewers 1 10 50 --sizes full half thumb --seconds 5
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_batch import boxes_to_arrays
+from broadcast import BroadcastProducer, RenditionBroadcaster, mjpeg_stream
+from pipeline import FramePacket
+from traffic_processor import TrafficProcessor
+from synthetic import IMAGE_HEIGHT, IMAGE_WIDTH, FPS, SOURCE_0, TARGET, StubModel, SyntheticTraffic
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+BOUNDARY = b"--frame\r\n"
+
+
+class ProducerMeter:
+    """CPU seconds spent on the producer thread, sampled from inside its generator"""
+    def __init__(self):
+        self.cpu_seconds = 0.0
+        self.frames = 0
+
+
+def make_producer(args, model, meter):
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    scene = SyntheticTraffic(args.vehicles, IMAGE_WIDTH, IMAGE_HEIGHT)
+
+    def process_video():
+        processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT)
+        frame_number = 0
+        next_frame = time.perf_counter()
+        while True:
+            cpu_start = time.thread_time()
+            frame = scene.frame(frame_number)
+            packet = FramePacket(frame, frame_number / FPS, frame_number)
+            result = model.track(frame)[0]
+            processor.process(packet, *boxes_to_arrays(result.boxes))
+            meter.cpu_seconds += time.thread_time() - cpu_start
+            meter.frames += 1
+            frame_number += 1
+            yield packet.frame
+            next_frame += 1 / FPS
+            time.sleep(max(next_frame - time.perf_counter(), 0))
+
+    return BroadcastProducer("bench", process_video, RenditionBroadcaster())
+
+
+class Viewer(threading.Thread):
+    """Reads the MJPEG stream and counts frame boundaries; slow viewers pause between reads"""
+    def __init__(self, port, size, delay):
+        super().__init__(daemon=True)
+        self.port = port
+        self.size = size
+        self.delay = delay
+        self.frames = 0
+        self.bytes = 0
+        self.running = True
+
+    def run(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        connection.request("GET", f"/video_feed?size={self.size}")
+        response = connection.getresponse()
+        tail = b""
+        while self.running:
+            chunk = response.read1(65536)
+            if not chunk:
+                break
+            self.bytes += len(chunk)
+            data = tail + chunk
+            self.frames += data.count(BOUNDARY)
+            tail = data[-len(BOUNDARY) + 1:]
+            if self.delay:
+                time.sleep(self.delay)
+        connection.close()
+
+
+def run(viewers, broadcaster, model, meter, producer, args, port):
+    slow = int(viewers * args.slow_share)
+    clients = [Viewer(port, args.sizes[i % len(args.sizes)], args.slow_delay_ms / 1000 if i < slow else 0)
+               for i in range(viewers)]
+    for client in clients:
+        client.start()
+    time.sleep(args.warmup)
+    start_calls, start_frames, start_cpu = model.calls, meter.frames, meter.cpu_seconds
+    start_process_cpu = time.process_time()
+    start_received = [client.frames for client in clients]
+    start_produced = producer.produced
+    start_encoded = {name: r["encoded"] for name, r in broadcaster.stats().items()}
+    start = time.perf_counter()
+    time.sleep(args.seconds)
+    elapsed = time.perf_counter() - start
+    received = [(client.frames - before) / elapsed for client, before in zip(clients, start_received)]
+    frames = meter.frames - start_frames
+    encoded = {name: (r["encoded"] - start_encoded[name]) / elapsed for name, r in broadcaster.stats().items()}
+    row = {
+        "viewers": viewers,
+        "subscribers": {name: r.subscribers for name, r in broadcaster.renditions.items()},
+        "encodes_per_s": encoded,
+        "produced_fps": (producer.produced - start_produced) / elapsed,
+        "detector_calls_per_s": (model.calls - start_calls) / elapsed,
+        "producer_cpu_ms_per_frame": (meter.cpu_seconds - start_cpu) / max(frames, 1) * 1000,
+        "process_cpu_percent": (time.process_time() - start_process_cpu) / elapsed * 100,
+        "fast_viewer_fps": min((fps for fps, c in zip(received, clients) if not c.delay), default=0.0),
+        "slow_viewer_fps": min((fps for fps, c in zip(received, clients) if c.delay), default=0.0),
+    }
+    for client in clients:
+        client.running = False
+    for client in clients:
+        client.join(2)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1, 5, 10, 25, 50])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--warmup", type=float, default=1)
+    parser.add_argument("--vehicles", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=10, help="Simulated inference time per frame")
+    parser.add_argument("--sizes", nargs="+", default=["full", "half", "thumb"], help="Renditions the viewers use")
+    parser.add_argument("--slow-share", type=float, default=0.2, help="Fraction of viewers that read slowly")
+    parser.add_argument("--slow-delay-ms", type=float, default=200, help="Pause of a slow viewer after every read")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    model = StubModel(latency=args.latency_ms / 1000)
+    meter = ProducerMeter()
+    producer = make_producer(args, model, meter)
+    producer.start()
+
+    app = Flask(__name__)
+    app.add_url_rule("/video_feed", "video_feed",
+                     lambda: Response(mjpeg_stream(producer.broadcaster.view(request.args.get("size"))),
+                                      mimetype="multipart/x-mixed-replace; boundary=frame"))
+    server = make_server("127.0.0.1", args.port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = []
+    print(f"{'viewers':>8} {'produced fps':>13} {'detector/s':>11} {'cpu ms/frame':>13} {'process cpu %':>14} "
+          f"{'fast fps':>9} {'slow fps':>9}  encodes/s per rendition")
+    for viewers in args.viewers:
+        row = run(viewers, producer.broadcaster, model, meter, producer, args, args.port)
+        results.append(row)
+        print(f"{viewers:>8} {row['produced_fps']:>13.1f} {row['detector_calls_per_s']:>11.1f} "
+              f"{row['producer_cpu_ms_per_frame']:>13.2f} {row['process_cpu_percent']:>14.1f} "
+              f"{row['fast_viewer_fps']:>9.1f} {row['slow_viewer_fps']:>9.1f}  "
+              + " ".join(f"{name}={fps:.1f}" for name, fps in row["encodes_per_s"].items()))
+
+    producer.stop()
+    server.shutdown()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
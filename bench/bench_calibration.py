@@ -0,0 +1,156 @@
+"""
+Speed and accuracy of calibration.RoadPlaneMap against ViewTransformer's exact homography.
+
+Times transform_points for batches of bottom-centre points with ViewTransformer, and with
+RoadPlaneMap's "homography" and "grid" methods on one segment (main.py's SOURCE_0/TARGET)
+and on three (the same plus two lane polygons with their own, slightly different,
+calibrations). Measures each grid step's error against the exact per-segment homography
+over every pixel inside region_points, and the error it adds to speeds measured over one
+second on synthetic traffic, plus the time CameraCalibration takes to compile a
+three-segment profile against loading it back from its cache. Exits non-zero if "homography" differs from the exact mapping or the default grid
+step's speed error exceeds --max-speed-error.
+
+    python bench/bench_calibration.py --batch 15 100 1000 --steps 4 8 16
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_batch import bottom_centres
+from calibration import CALIBRATION_GRID_STEP, CameraCalibration, RoadPlaneMap
+from mask import mask
+from synthetic import FPS, IMAGE_HEIGHT, IMAGE_WIDTH, SOURCE_0, TARGET, SyntheticTraffic
+from vehicle_class import SCALING_FACTOR, ViewTransformer
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+
+
+def segments(count):
+    """SOURCE_0/TARGET, then lane polygons (left and right half of the road) with perturbed source points"""
+    result = [{"source": SOURCE_0, "target": TARGET}]
+    top_middle = (SOURCE_0[0] + SOURCE_0[1]) // 2
+    bottom_middle = (SOURCE_0[2] + SOURCE_0[3]) // 2
+    lanes = [[SOURCE_0[0], top_middle, bottom_middle, SOURCE_0[3]],
+             [top_middle, SOURCE_0[1], SOURCE_0[2], bottom_middle]]
+    for index, polygon in enumerate(lanes[:count - 1], start=1):
+        result.append({"source": SOURCE_0 + [[index, 0], [0, index], [-index, 0], [0, -index]], "target": TARGET,
+                       "polygon": np.array(polygon).tolist()})
+    return result
+
+
+def time_call(function, points, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(points)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def speeds(transform, traffic, frames):
+    """Speeds over one second (FPS frames) of every car seen at both ends, from the mapped bottom centres"""
+    positions = {}
+    for frame_number in range(frames):
+        xyxy, ids, _ = traffic.truth(frame_number)
+        mapped = transform(bottom_centres(xyxy).astype(np.float32))
+        for tracker_id, point in zip(ids.tolist(), mapped):
+            positions[(tracker_id, frame_number)] = point
+    result = []
+    for (tracker_id, frame_number), point in sorted(positions.items()):
+        earlier = positions.get((tracker_id, frame_number - FPS))
+        if earlier is not None:
+            result.append(np.linalg.norm(point - earlier) * SCALING_FACTOR)
+    return np.array(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch", type=int, nargs="+", default=[15, 100, 1000], help="Points per call")
+    parser.add_argument("--steps", type=int, nargs="+", default=[4, 8, 16], help="Grid steps to check")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--frames", type=int, default=250, help="Synthetic frames for the speed error")
+    parser.add_argument("--max-speed-error", type=float, default=0.5, help="km/h, at the default grid step")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    ys, xs = np.nonzero(mask(IMAGE_WIDTH, IMAGE_HEIGHT, region_points).populated_mask)
+    pixels = np.stack([xs, ys], axis=1).astype(np.float32) + 0.5
+    rng = np.random.default_rng(0)
+    failures = []
+
+    print(f"{'mapping':>22} " + " ".join(f"{f'{n} pts us':>11}" for n in args.batch))
+    view_transformer = ViewTransformer(SOURCE_0, TARGET)
+    mappings = [("ViewTransformer", view_transformer)]
+    for count in (1, 3):
+        for method in ("homography", "grid"):
+            mappings.append((f"{method}, {count} segment{'s' if count > 1 else ''}",
+                             RoadPlaneMap(segments(count), IMAGE_WIDTH, IMAGE_HEIGHT, method)))
+    timings = []
+    for name, mapping in mappings:
+        row = {"mapping": name}
+        for n in args.batch:
+            row[n] = time_call(mapping.transform_points, pixels[rng.integers(0, len(pixels), n)], args.repeat)
+        timings.append(row)
+        print(f"{name:>22} " + " ".join(f"{row[n]:>11.1f}" for n in args.batch))
+
+    for count in (1, 3):
+        exact_map = RoadPlaneMap(segments(count), IMAGE_WIDTH, IMAGE_HEIGHT, "homography")
+        exact = exact_map.exact(pixels, exact_map.segment_of(pixels))
+        reference = exact_map.transform_points(pixels) if count > 1 else view_transformer.transform_points(pixels)
+        if np.abs(reference - exact).max() > 1e-3:
+            failures.append(f"homography method differs from the exact mapping ({count} segments)")
+
+    traffic = SyntheticTraffic(15)
+    exact_speeds = speeds(view_transformer.transform_points, traffic, args.frames)
+    accuracy = []
+    print(f"\n{'grid step':>10} {'grid KB':>8} {'max m':>7} {'mean m':>7} {'max km/h':>9} {'mean km/h':>10}")
+    for step in args.steps:
+        grid_map = RoadPlaneMap.single(SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT, method="grid", step=step)
+        error = np.linalg.norm(grid_map.transform_points(pixels) - view_transformer.transform_points(pixels), axis=1)
+        speed_error = np.abs(speeds(grid_map.transform_points, traffic, args.frames) - exact_speeds)
+        row = {"step": step, "grid_kb": grid_map.grid.nbytes / 1e3, "max_m": float(error.max()),
+               "mean_m": float(error.mean()), "max_speed_error": float(speed_error.max()),
+               "mean_speed_error": float(speed_error.mean())}
+        accuracy.append(row)
+        print(f"{step:>10} {row['grid_kb']:>8.0f} {row['max_m']:>7.3f} {row['mean_m']:>7.3f} "
+              f"{row['max_speed_error']:>9.2f} {row['mean_speed_error']:>10.3f}")
+        if step == CALIBRATION_GRID_STEP and row["max_speed_error"] > args.max_speed_error:
+            failures.append(f"grid speed error {row['max_speed_error']:.2f} km/h at step {step}")
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "camera_profile.json")
+        first, *lanes = segments(3)
+        with open(path, "w") as f:
+            json.dump({"region_points": region_points, "source_points": first["source"].tolist(),
+                       "target_points": first["target"].tolist(),
+                       "segments": [dict(lane, source=lane["source"].tolist(), target=lane["target"].tolist())
+                                    for lane in lanes]}, f)
+        start = time.perf_counter()
+        built_calibration = CameraCalibration.load(path, IMAGE_WIDTH, IMAGE_HEIGHT)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded_calibration = CameraCalibration.load(path, IMAGE_WIDTH, IMAGE_HEIGHT)
+        loaded = time.perf_counter() - start
+    if built_calibration.cache_hit or not loaded_calibration.cache_hit or \
+            not np.array_equal(built_calibration.road_plane_map.labels, loaded_calibration.road_plane_map.labels):
+        failures.append("a compiled profile is read back from its cache")
+    print(f"\n3-segment profile: compiled and cached in {built * 1000:.1f} ms, loaded in {loaded * 1000:.1f} ms")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"timings": timings, "accuracy": accuracy, "build_ms": built * 1000,
+                       "load_ms": loaded * 1000, "failures": failures}, f, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Cold start to the first processed frame, phase by phase, with and without the calibration cache.
+
+Each run is a fresh Python process that starts up the way main.py does: imports, the
+detector loading in the background (LazyDetector; here a stub that sleeps --model-seconds
+in place of the weights), the capture and its first frame, the camera's calibration
+profile (CameraCalibration; "cold" deletes its cache first, "warm" reuses it), the vehicle
+store and processor, then the pipeline up to its first processed frame. "process" is the
+time from launching the interpreter; "ready" leaves out the time spent waiting for the
+model, which is what the 1 s target (--target) is about. Exits non-zero when the median
+ready time of any configuration misses it.
+
+    python bench/bench_cold_start.py --runs 5 --model-seconds 0 2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTED = time.perf_counter()
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REGION_POINTS_FILE = os.path.join(ROOT, "region_points.json")
+PROFILE_FILE = os.path.join(ROOT, "camera_profile.json")
+PHASES = ("imports", "capture", "calibration", "setup", "first_frame")
+
+
+def child(video, profile, model_seconds):
+    """One start-up, as main.py does it; prints the phase times as JSON"""
+    marks = {}
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from calibration import CameraCalibration
+    from detector_backend import LazyDetector
+    from frame_scheduler import CaptureClock, FrameScheduler, read_scheduled
+    from pipeline import FramePacket, Pipeline, Stage
+    from roi_inference import RegionDetector
+    from speed_estimator import make_estimator
+    from synthetic import IMAGE_HEIGHT, IMAGE_WIDTH, StubModel
+    from track_predictor import TrackPredictor
+    from traffic_processor import TrafficProcessor
+    from video_capture import open_capture
+    from vehicle_store import VehicleStore
+    marks["imports"] = time.perf_counter()
+
+    def load_stub():
+        time.sleep(model_seconds)
+        return StubModel()
+
+    model = LazyDetector(loader=load_stub)
+    cap = open_capture(video, IMAGE_WIDTH, IMAGE_HEIGHT)
+    capture_clock = CaptureClock(cap)
+    scheduler = FrameScheduler(0.1)
+    read_scheduled(cap, capture_clock, scheduler)
+    marks["capture"] = time.perf_counter()
+
+    calibration = CameraCalibration.load(profile, IMAGE_WIDTH, IMAGE_HEIGHT)
+    marks["calibration"] = time.perf_counter()
+
+    store = VehicleStore(256, speed_estimator=make_estimator("least_squares", 256,
+                                                             scaling_factor=calibration.scaling_factor),
+                         scaling_factor=calibration.scaling_factor)
+    processor = TrafficProcessor(calibration.region_points, calibration.source_points, calibration.target_points,
+                                 IMAGE_WIDTH, IMAGE_HEIGHT, calibration.speed_limit, calibration.fine_speed_limit,
+                                 store, transformer=calibration.road_plane_map, region_mask=calibration.region_mask)
+    predictor = TrackPredictor()
+    detector = RegionDetector(model, calibration.region_points, IMAGE_WIDTH, IMAGE_HEIGHT)
+
+    def read_frame():
+        frame, time_stamp = read_scheduled(cap, capture_clock, scheduler)
+        return None if frame is None else FramePacket(frame, time_stamp, capture_clock.frames)
+
+    def track_frame(packet):
+        xyxy, tracker_ids, confs = predictor.update(*detector(packet.frame), packet.time_stamp)
+        processor.track(packet, xyxy, tracker_ids, confs)
+
+    pipeline = Pipeline(read_frame, track_frame, [Stage("annotate", processor.annotate)])
+    marks["setup"] = time.perf_counter()
+    pipeline.start()
+    next(iter(pipeline.results()))
+    marks["first_frame"] = time.perf_counter()
+    pipeline.stop()
+    pipeline.join()
+    cap.release()
+
+    phases, previous = {}, STARTED
+    for phase in PHASES:
+        phases[phase] = marks[phase] - previous
+        previous = marks[phase]
+    print(json.dumps({"phases": phases, "total": marks["first_frame"] - STARTED, "waited": model.waited_seconds,
+                      "cache_hit": calibration.cache_hit}))
+
+
+def run(video, profile, model_seconds, cold):
+    if cold and os.path.exists(os.path.splitext(profile)[0] + ".calibration.npz"):
+        os.remove(os.path.splitext(profile)[0] + ".calibration.npz")
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", video, profile, str(model_seconds)],
+                            capture_output=True, text=True, check=True, cwd=ROOT).stdout
+    elapsed = time.perf_counter() - start
+    result = json.loads(output.strip().splitlines()[-1])
+    # Interpreter start-up comes before STARTED, so "process" is measured from the launch
+    result["process"] = elapsed
+    result["ready"] = result["total"] - result["waited"]
+    return result
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3], float(sys.argv[4]))
+        return
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Runs per configuration (medians are reported)")
+    parser.add_argument("--model-seconds", type=float, nargs="+", default=[0, 2],
+                        help="Simulated weights load time")
+    parser.add_argument("--target", type=float, default=1.0, help="Seconds to the first frame, model wait excluded")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from synthetic import SyntheticTraffic
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        video = SyntheticTraffic(15).write_video(os.path.join(root, "clip.mkv"), 50, "FFV1")
+        with open(PROFILE_FILE, "r") as f:
+            profile = json.load(f)
+        profile["region_points"] = REGION_POINTS_FILE
+        profile_path = os.path.join(root, "camera_profile.json")
+        with open(profile_path, "w") as f:
+            json.dump(profile, f)
+
+        print(f"{'model s':>8} {'cache':>6} " + " ".join(f"{phase:>12}" for phase in PHASES) +
+              f" {'waited':>7} {'ready':>7} {'process':>8}")
+        for model_seconds in args.model_seconds:
+            for cold in (True, False):
+                runs = [run(video, profile_path, model_seconds, cold) for _ in range(args.runs)]
+                row = {"model_seconds": model_seconds, "cache": "cold" if cold else "warm",
+                       "phases": {phase: median([r["phases"][phase] for r in runs]) for phase in PHASES},
+                       "waited": median([r["waited"] for r in runs]), "ready": median([r["ready"] for r in runs]),
+                       "process": median([r["process"] for r in runs]),
+                       "cache_hits": sum(r["cache_hit"] for r in runs)}
+                results.append(row)
+                print(f"{model_seconds:>8g} {row['cache']:>6} " +
+                      " ".join(f"{row['phases'][phase] * 1000:>10.0f}ms" for phase in PHASES) +
+                      f" {row['waited']:>6.2f}s {row['ready']:>6.2f}s {row['process']:>7.2f}s"
+                      f"  ({row['cache_hits']}/{args.runs} cache hits)")
+
+    slowest = max(row["ready"] for row in results)
+    print(f"\nslowest ready: {slowest:.2f} s (target {args.target:g} s): {'PASS' if slowest <= args.target else 'FAIL'}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if slowest <= args.target else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Decode throughput of a 4K source delivered at 1280x720: decode-then-resize against video_capture.py.
+
+"read+resize" is the old loop (cap.read(), then cv2.resize). "opencv" is ScaledCapture
+(size hints, one reused native buffer, resize fallback). "opencv skip N" retrieves only
+every Nth frame and just grabs the rest, as read_scheduled does for frames the scheduler
+skips. "ffmpeg" is FfmpegCapture (scale filter in the decoder process), run only if ffmpeg
+is on PATH; its CPU time includes the ffmpeg process. Without --source, a synthetic 4K clip
+is written to a temporary file first.
+
+    python bench/bench_decode.py --frames 150 --skip 2 4
+    python bench/bench_decode.py --source demo_videos/video_0.mp4
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from video_capture import FfmpegCapture, ScaledCapture
+from synthetic import SyntheticTraffic
+
+IMAGE_WIDTH = 1280
+IMAGE_HEIGHT = 720
+
+
+def cpu_seconds() -> float:
+    """CPU time of this process and of the child processes that have exited"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run(mode, source, skip, max_frames):
+    if mode == "read+resize":
+        cap = cv2.VideoCapture(source)
+    elif mode == "ffmpeg":
+        cap = FfmpegCapture(source, IMAGE_WIDTH, IMAGE_HEIGHT)
+    else:
+        cap = ScaledCapture(source, IMAGE_WIDTH, IMAGE_HEIGHT)
+    grabbed = delivered = 0
+    start, start_cpu = time.perf_counter(), cpu_seconds()
+    while grabbed < max_frames:
+        if mode == "read+resize":
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = cv2.resize(frame, (IMAGE_WIDTH, IMAGE_HEIGHT))
+            delivered += 1
+        else:
+            if not cap.grab():
+                break
+            if grabbed % skip == 0:
+                ret, frame = cap.retrieve()
+                delivered += 1
+        grabbed += 1
+    cap.release()
+    elapsed, cpu = time.perf_counter() - start, cpu_seconds() - start_cpu
+    return {
+        "mode": mode if skip == 1 else f"{mode} skip {skip}",
+        "frames": grabbed,
+        "delivered": delivered,
+        "fps": grabbed / elapsed,
+        "ms_per_frame": elapsed / grabbed * 1000,
+        "cpu_ms_per_frame": cpu / grabbed * 1000,
+        "frame_shape": list(frame.shape) if grabbed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", help="4K video file (default: a synthetic 3840x2160 clip)")
+    parser.add_argument("--frames", type=int, default=150)
+    parser.add_argument("--skip", type=int, nargs="*", default=[2, 4], help="Retrieve every Nth frame")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        source = args.source
+        if source is None:
+            source = SyntheticTraffic(20, 3840, 2160).write_video(os.path.join(root, "clip_4k.mp4"), args.frames)
+        probe = cv2.VideoCapture(source)
+        print(f"source: {int(probe.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT))}, "
+              f"delivered at {IMAGE_WIDTH}x{IMAGE_HEIGHT}")
+        probe.release()
+
+        configurations = [("read+resize", 1), ("opencv", 1)] + [("opencv", skip) for skip in args.skip]
+        if shutil.which("ffmpeg") is not None:
+            configurations.append(("ffmpeg", 1))
+        else:
+            print("ffmpeg not on PATH: skipping the ffmpeg backend")
+        results = []
+        print(f"{'mode':>16} {'frames':>7} {'fps':>7} {'ms/frame':>9} {'cpu ms/frame':>13}")
+        for mode, skip in configurations:
+            row = run(mode, source, skip, args.frames)
+            results.append(row)
+            print(f"{row['mode']:>16} {row['frames']:>7} {row['fps']:>7.1f} {row['ms_per_frame']:>9.1f} "
+                  f"{row['cpu_ms_per_frame']:>13.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+CPU throughput and latency of the detector backends (detector_backend.py) per YOLOv8 model size.
+
+Loads every model size with every backend on the CPU (exporting ONNX/OpenVINO models into the
+cache on first use, which is timed separately), then runs single-frame predict calls, as
+main.py does, on synthetic 1280x720 frames. Reports frames per second and latency
+percentiles. Backends whose package is not installed are skipped.
+
+    python bench/bench_detector_backends.py --sizes n s m x --backends pytorch onnx openvino --threads 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from detector_backend import DEFAULT_INPUT_SIZE, load_detector
+from synthetic import IMAGE_HEIGHT, IMAGE_WIDTH, SyntheticTraffic
+
+
+def run(model_name, backend, int8, frames, args):
+    start = time.perf_counter()
+    model = load_detector(model_name, backend, "cpu", tuple(args.input_size), args.threads, int8, args.cache_dir)
+    load_seconds = time.perf_counter() - start
+    for frame in frames[:args.warmup]:
+        model.predict(frame, verbose=False)
+    latencies, boxes = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        result = model.predict(frame, verbose=False)[0]
+        latencies.append(time.perf_counter() - start)
+        boxes.append(len(result.boxes))
+    latencies = np.array(latencies) * 1000
+    return {
+        "model": model_name,
+        "backend": backend + (" int8" if int8 else ""),
+        "load_s": load_seconds,
+        "fps": len(frames) / latencies.sum() * 1000,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_boxes": float(np.mean(boxes)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=["n", "s", "m", "x"], help="YOLOv8 model sizes")
+    parser.add_argument("--backends", nargs="+", default=["pytorch", "onnx", "openvino"])
+    parser.add_argument("--int8", action="store_true", help="Also run the INT8-quantized ONNX/OpenVINO exports")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=None, help="Inference threads (default: all cores)")
+    parser.add_argument("--input-size", type=int, nargs=2, default=list(DEFAULT_INPUT_SIZE), metavar=("H", "W"))
+    parser.add_argument("--cache-dir", default="models")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    scene = SyntheticTraffic(20, IMAGE_WIDTH, IMAGE_HEIGHT)
+    frames = [scene.frame(frame_number) for frame_number in range(args.frames)]
+    configurations = [(backend, False) for backend in args.backends]
+    if args.int8:
+        configurations += [(backend, True) for backend in args.backends if backend != "pytorch"]
+
+    results = []
+    print(f"{'model':>12} {'backend':>14} {'load s':>7} {'fps':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}")
+    for size in args.sizes:
+        for backend, int8 in configurations:
+            try:
+                row = run(f"yolov8{size}.pt", backend, int8, frames, args)
+            except ImportError as error:
+                print(f"{'yolov8' + size:>12} {backend:>14} skipped: {error}")
+                continue
+            results.append(row)
+            print(f"{'yolov8' + size:>12} {row['backend']:>14} {row['load_s']:>7.1f} {row['fps']:>7.1f} "
+                  f"{row['p50_ms']:>7.1f} {row['p95_ms']:>7.1f} {row['p99_ms']:>7.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Capture-loop frame time during a burst of violations: synchronous cv2.imwrite (the old
+main.py behaviour) against the background EvidenceWriter, reading clips from the ring
+and with copy_on_submit. The writer stats show how many frames reading from the ring lost.
+
+The loop simulates waiting on the detector with a sleep, writes each frame into a
+FrameRingBuffer and fires a burst of violations part way through.
+
+    python bench/bench_evidence_writer.py --frames 300 --burst-at 150 --burst 6
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evidence_buffer import FrameRingBuffer
+from evidence_writer import EvidenceWriter
+
+IMAGE_WIDTH = 1280
+IMAGE_HEIGHT = 720
+FPS = 25
+
+
+def synthetic_frame(rng, frame_number):
+    frame = np.full((IMAGE_HEIGHT, IMAGE_WIDTH, 3), 90, dtype=np.uint8)
+    frame[::8] = rng.integers(0, 255, (IMAGE_HEIGHT // 8, IMAGE_WIDTH, 3), dtype=np.uint8)
+    x = (frame_number * 7) % (IMAGE_WIDTH - 100)
+    cv2.rectangle(frame, (x, 400), (x + 100, 460), (0, 0, 255), -1)
+    return frame
+
+
+def capture_loop(args, root, writer=None):
+    rng = np.random.default_rng(0)
+    frames = [synthetic_frame(rng, i) for i in range(16)]
+    evidence_buffer = FrameRingBuffer(args.ring, IMAGE_WIDTH, IMAGE_HEIGHT)
+    frame_times = np.zeros(args.frames)
+    for frame_number in range(args.frames):
+        start = time.perf_counter()
+        time_stamp = frame_number / FPS
+        time.sleep(args.inference_ms / 1000)  # the detector, which does not hold the GIL
+        evidence_buffer.write(frames[frame_number % len(frames)], time_stamp, frame_number)
+
+        if args.burst_at <= frame_number < args.burst_at + args.burst:
+            tracker_id = frame_number
+            if writer is not None:
+                writer.submit(tracker_id, 150.0, time_stamp, evidence_buffer)
+            else:
+                evidence_frames, _, frame_numbers = evidence_buffer.snapshot()
+                for img, img_number in zip(evidence_frames, frame_numbers.tolist()):
+                    if not os.path.exists(f"{root}/{tracker_id}"):
+                        os.makedirs(f"{root}/{tracker_id}")
+                    cv2.imwrite(f"{root}/{tracker_id}/{img_number}_150.00.jpg", img)
+        frame_times[frame_number] = time.perf_counter() - start
+    return frame_times
+
+
+def summarise(name, frame_times, args):
+    burst = frame_times[args.burst_at:args.burst_at + args.burst + args.ring // 4]
+    row = {"mode": name, "p50_ms": float(np.median(frame_times) * 1e3),
+           "p99_ms": float(np.percentile(frame_times, 99) * 1e3), "max_ms": float(frame_times.max() * 1e3),
+           "burst_mean_ms": float(burst.mean() * 1e3)}
+    print(f"{name:>10} {row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f} {row['burst_mean_ms']:>11.1f}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--ring", type=int, default=50, help="Evidence ring size in frames")
+    parser.add_argument("--burst-at", type=int, default=150)
+    parser.add_argument("--burst", type=int, default=6, help="Violations fired on consecutive frames")
+    parser.add_argument("--inference-ms", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--format", default="jpg", choices=["jpg", "mp4"])
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    print(f"{'mode':>10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'burst ms':>11}")
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        results.append(summarise("sync", capture_loop(args, os.path.join(root, "sync")), args))
+
+        for name, copy_on_submit in (("async", False), ("copied", True)):
+            writer = EvidenceWriter(os.path.join(root, name), args.workers, max_pending=args.burst,
+                                    format=args.format, fps=FPS, copy_on_submit=copy_on_submit)
+            results.append(summarise(name, capture_loop(args, root, writer), args))
+            writer.close()
+            stats = writer.stats()
+            print(f"writer: {stats}")
+            results[-1]["writer"] = stats
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Load test of the 2x2 grid's frame delivery: re-requesting the MJPEG URL every 100 ms against push.
+
+A child process serves a synthetic processed stream (pre-rendered frames published at the
+source frame rate with their vehicle metadata, through a RenditionBroadcaster) with the
+frame_delivery routes stream_server.py uses. Four tiles then watch it the way
+VideoStream.jsx can:
+
+- poll: the old grid, which set the <img> to a fresh MJPEG URL every 100 ms; the browser
+  drops the previous request, so every tick is a new request on a new connection (whose
+  first frame is the one the tile already has, so its frames/s count repeats);
+- mjpeg: one multipart connection per tile, kept open;
+- long-poll: snapshot.jpg?after=<sequence>&wait=..., one request per frame (werkzeug's
+  server closes every connection, so also one connection per frame);
+- sse: one server-sent event connection per tile, frames pushed with their metadata.
+
+Reports requests/s, connections opened, frames/s per tile, bytes/s, the server's CPU (from
+/proc, so the clients' own work is left out) and its thread count at the end.
+
+    python bench/bench_frame_delivery.py --modes poll mjpeg long-poll sse --seconds 10
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("poll", "mjpeg", "long-poll", "sse")
+TILES = 4
+POLL_SECONDS = 0.1  # the old VideoStream.jsx interval
+LONG_POLL_WAIT = 5
+BOUNDARY = b"--frame\r\n"
+EVENT = b"event: frame\n"
+
+
+def serve(port, vehicles, fps, frames):
+    """Child: the synthetic stream behind the frame_delivery routes, until killed"""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from flask import Flask
+    from werkzeug.serving import make_server
+    from broadcast import BroadcastProducer, RenditionBroadcaster
+    from frame_delivery import rendition_response, snapshot_response, sse_response
+    from synthetic import SyntheticTraffic
+
+    scene = SyntheticTraffic(vehicles)
+    rendered = []
+    for frame_number in range(frames):
+        xyxy, ids, speeds = scene.truth(frame_number)
+        metadata = {"frame_number": frame_number, "time_stamp": frame_number / fps,
+                    "vehicles": [{"id": tracker_id, "box": box, "speed": round(speed, 1)}
+                                 for tracker_id, box, speed in zip(ids.tolist(), xyxy.tolist(), speeds.tolist())],
+                    "violations": []}
+        rendered.append((scene.frame(frame_number), metadata))
+
+    def process_video():
+        next_frame = time.perf_counter()
+        frame_number = 0
+        while True:
+            # A new array per frame, as the real pipeline hands over
+            frame, metadata = rendered[frame_number % frames]
+            yield frame.copy(), metadata
+            frame_number += 1
+            next_frame += 1 / fps
+            time.sleep(max(next_frame - time.perf_counter(), 0))
+
+    producer = BroadcastProducer("bench", process_video, RenditionBroadcaster())
+    producer.start()
+    app = Flask(__name__)
+    app.add_url_rule("/video_feed", "video_feed", lambda: rendition_response(producer.broadcaster))
+    app.add_url_rule("/video_feed/snapshot.jpg", "snapshot", lambda: snapshot_response(producer.broadcaster))
+    app.add_url_rule("/video_feed/sse", "sse", lambda: sse_response(producer.broadcaster))
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    print("ready", flush=True)
+    server.serve_forever()
+
+
+class CountingConnection(http.client.HTTPConnection):
+    """HTTPConnection that counts the TCP connections it opens (it reopens one the server closed)"""
+    def __init__(self, tile, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tile = tile
+
+    def connect(self):
+        super().connect()
+        self.tile.connections += 1
+
+
+class Tile(threading.Thread):
+    """One grid tile watching the stream in the given mode"""
+    def __init__(self, port, mode, size):
+        super().__init__(daemon=True)
+        self.port = port
+        self.mode = mode
+        self.size = size
+        self.requests = 0
+        self.connections = 0
+        self.frames = 0
+        self.bytes = 0
+        self.errors = 0
+        self.running = True
+
+    def run(self):
+        try:
+            getattr(self, self.mode.replace("-", "_"))()
+        except (OSError, http.client.HTTPException):
+            self.errors += 1
+
+    def stream(self, connection, path, marker, deadline=None):
+        """Count the marker in a streaming response until stopped (or the deadline passes)"""
+        connection.connect()
+        # The connection lets go of its socket once a response without a length starts
+        sock = connection.sock
+        connection.request("GET", path)
+        self.requests += 1
+        response = connection.getresponse()
+        tail = b""
+        while self.running:
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+            try:
+                chunk = response.read1(65536)
+            except socket.timeout:
+                break
+            if not chunk:
+                break
+            self.bytes += len(chunk)
+            data = tail + chunk
+            self.frames += data.count(marker)
+            tail = data[-len(marker) + 1:]
+        connection.close()
+
+    def poll(self):
+        next_tick = time.perf_counter()
+        while self.running:
+            next_tick += POLL_SECONDS
+            connection = CountingConnection(self, "127.0.0.1", self.port)
+            self.stream(connection, f"/video_feed?size={self.size}&t={int(time.time() * 1000)}", BOUNDARY,
+                        deadline=next_tick)
+
+    def mjpeg(self):
+        self.stream(CountingConnection(self, "127.0.0.1", self.port), f"/video_feed?size={self.size}", BOUNDARY)
+
+    def sse(self):
+        self.stream(CountingConnection(self, "127.0.0.1", self.port), f"/video_feed/sse?size={self.size}", EVENT)
+
+    def long_poll(self):
+        connection = CountingConnection(self, "127.0.0.1", self.port)
+        sequence = None
+        while self.running:
+            query = f"size={self.size}" if sequence is None else \
+                f"size={self.size}&after={sequence}&wait={LONG_POLL_WAIT}"
+            connection.request("GET", f"/video_feed/snapshot.jpg?{query}")
+            self.requests += 1
+            response = connection.getresponse()
+            body = response.read()
+            if response.will_close:
+                connection.close()
+            if response.status == 200:
+                sequence = int(response.getheader("X-Frame-Sequence"))
+                self.frames += 1
+                self.bytes += len(body)
+        connection.close()
+
+
+def process_stats(pid):
+    """(CPU seconds, threads) of a process, from /proc"""
+    with open(f"/proc/{pid}/stat", "r") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/status", "r") as f:
+        threads = next(int(line.split()[1]) for line in f if line.startswith("Threads:"))
+    return cpu, threads
+
+
+def run(mode, args):
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", str(args.port),
+                               str(args.vehicles), str(args.fps), str(args.frames)],
+                              stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    try:
+        if server.stdout.readline().strip() != "ready":
+            raise RuntimeError("bench server did not start")
+        tiles = [Tile(args.port, mode, args.size) for _ in range(TILES)]
+        for tile in tiles:
+            tile.start()
+        time.sleep(args.warmup)
+        before = [(tile.requests, tile.connections, tile.frames, tile.bytes) for tile in tiles]
+        cpu_before, _ = process_stats(server.pid)
+        start = time.perf_counter()
+        time.sleep(args.seconds)
+        elapsed = time.perf_counter() - start
+        cpu_after, threads = process_stats(server.pid)
+        totals = [sum(getattr(tile, name) - b[i] for tile, b in zip(tiles, before))
+                  for i, name in enumerate(("requests", "connections", "frames", "bytes"))]
+        for tile in tiles:
+            tile.running = False
+        return {
+            "mode": mode,
+            "requests_per_s": totals[0] / elapsed,
+            "connections_opened": totals[1],
+            "connections_per_s": totals[1] / elapsed,
+            "fps_per_tile": totals[2] / elapsed / TILES,
+            "kbytes_per_s": totals[3] / elapsed / 1e3,
+            "server_cpu_percent": (cpu_after - cpu_before) / elapsed * 100,
+            "server_threads": threads,
+            "errors": sum(tile.errors for tile in tiles),
+        }
+    finally:
+        server.kill()
+        server.wait()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        serve(int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]), int(sys.argv[5]))
+        return
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--size", default="half", help="Rendition every tile requests, as the grid does")
+    parser.add_argument("--fps", type=float, default=25, help="Frame rate the server publishes at")
+    parser.add_argument("--vehicles", type=int, default=15)
+    parser.add_argument("--frames", type=int, default=25, help="Distinct frames pre-rendered by the server")
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    print(f"{TILES} tiles, '{args.size}' rendition, {args.fps:g} fps source")
+    print(f"{'mode':>10} {'requests/s':>11} {'connections':>12} {'conn/s':>7} {'fps/tile':>9} {'KB/s':>8} "
+          f"{'server cpu %':>13} {'threads':>8}")
+    results = []
+    for mode in args.modes:
+        row = run(mode, args)
+        results.append(row)
+        print(f"{mode:>10} {row['requests_per_s']:>11.1f} {row['connections_opened']:>12} "
+              f"{row['connections_per_s']:>7.1f} {row['fps_per_tile']:>9.1f} {row['kbytes_per_s']:>8.0f} "
+              f"{row['server_cpu_percent']:>13.1f} {row['server_threads']:>8}"
+              + (f"  ({row['errors']} tile errors)" if row["errors"] else ""))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
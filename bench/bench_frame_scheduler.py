@@ -0,0 +1,111 @@
+"""
+Fixed time.sleep(0.033) pacing against the FrameScheduler when processing is slower than the source.
+
+Plays a synthetic clip as if it were live, with a stub detector that takes longer than
+one frame interval. "sleep" is the old stream_server loop (read, process, sleep 33 ms,
+wall-clock time stamps); "scheduler" paces by PTS, skips late frames and stamps frames
+with their capture time. Reports how far behind the source each loop ends up, how many
+frames it skipped, and the speed error against the scene's ground truth.
+
+    python bench/bench_frame_scheduler.py --seconds 10 --latency-ms 50
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame_scheduler import CaptureClock, FrameScheduler, read_scheduled
+from pipeline import FramePacket
+from traffic_processor import TrafficProcessor
+from synthetic import IMAGE_HEIGHT, IMAGE_WIDTH, FPS, SOURCE_0, TARGET, StubModel, SyntheticTraffic
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+
+
+def speed_errors(scene, packet, errors):
+    """Absolute speed errors (km/h) of the vehicles that have a speed on this frame"""
+    data = packet.data
+    measured = data["is_inside"] & (data["speeds"] > 0)
+    for tracker_id, speed in zip(data["tracker_ids"][measured].tolist(), data["speeds"][measured].tolist()):
+        errors.append(abs(speed - scene.speeds[(tracker_id - 1) % scene.vehicles]))
+
+
+def run(mode, path, scene, region_points, args):
+    cap = cv2.VideoCapture(path)
+    model = StubModel(latency=args.latency_ms / 1000)
+    processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT)
+    capture_clock = CaptureClock(cap)
+    scheduler = FrameScheduler(args.max_lag_ms / 1000)
+    errors = []
+    processed = 0
+    start = time.perf_counter()
+    position = 0.0
+    while True:
+        if mode == "sleep":
+            ret, frame = cap.read()
+            if not ret:
+                break
+            position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            time_stamp = time.time()
+        else:
+            frame, time_stamp = read_scheduled(cap, capture_clock, scheduler)
+            if frame is None:
+                break
+            position = time_stamp
+        packet = FramePacket(frame, time_stamp, processed)
+        model.track(frame)
+        # Video compression blurs the id colours, so take the boxes of this frame from the scene itself
+        xyxy, ids, _ = scene.truth(int(round(position * FPS)))
+        processor.track(packet, xyxy, ids, np.full(len(ids), 0.9, dtype=np.float32))
+        speed_errors(scene, packet, errors)
+        processed += 1
+        if mode == "sleep":
+            time.sleep(0.033)
+    elapsed = time.perf_counter() - start
+    cap.release()
+    return {
+        "mode": mode,
+        "processed": processed,
+        "skipped": scheduler.dropped if mode == "scheduler" else 0,
+        "final_lag_s": elapsed - position,
+        "wall_s": elapsed,
+        "speed_mae_kmh": float(np.mean(errors)) if errors else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10, help="Length of the synthetic clip")
+    parser.add_argument("--vehicles", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Simulated inference time per frame")
+    parser.add_argument("--max-lag-ms", type=float, default=100)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    scene = SyntheticTraffic(args.vehicles, IMAGE_WIDTH, IMAGE_HEIGHT)
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        path = scene.write_video(os.path.join(root, "clip.mp4"), int(args.seconds * FPS))
+        print(f"{'mode':>10} {'processed':>10} {'skipped':>8} {'final lag s':>12} {'wall s':>7} {'speed MAE':>10}")
+        for mode in ("sleep", "scheduler"):
+            row = run(mode, path, scene, region_points, args)
+            results.append(row)
+            print(f"{mode:>10} {row['processed']:>10} {row['skipped']:>8} {row['final_lag_s']:>12.2f} "
+                  f"{row['wall_s']:>7.1f} {row['speed_mae_kmh']:>10.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Overhead of the metrics.py instrumentation on the processing time of a frame.
+
+Runs a synthetic clip through the instrumented hot path, one frame at a time on one
+thread: grab/retrieve (video_capture), detection (StubModel without simulated latency, so
+the whole frame time is CPU work the timers could slow down), TrafficProcessor
+track/annotate/record into an evidence ring, and the JPEG encode of the half rendition.
+Rounds alternate between timers on, timers off (metrics.registry.enabled = False) and
+timers on with a trace recording, and the median frame time of each is reported.
+
+A 1% difference is within the run-to-run noise of a shared box, so the cost of one span
+is also timed on its own; spans per frame times that cost, as a share of the frame
+time, is the overhead checked against --max-overhead (exits non-zero above it).
+
+    python bench/bench_metrics.py --frames 200 --rounds 3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_batch import boxes_to_arrays
+from broadcast import RenditionBroadcaster
+from evidence_buffer import FrameRingBuffer
+from metrics import STAGE_SECONDS, registry, stage_timer
+from pipeline import FramePacket
+from synthetic import IMAGE_HEIGHT, IMAGE_WIDTH, SOURCE_0, TARGET, StubModel, SyntheticTraffic
+from traffic_processor import TrafficProcessor
+from video_capture import open_capture
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+MODES = ("on", "off", "trace")
+
+
+def spans_recorded() -> int:
+    return sum(snapshot["count"] for snapshot in registry.stats().get(STAGE_SECONDS, {}).values())
+
+
+def run_round(mode, video, region_points, args):
+    """Frame times (seconds) of one pass over the clip, and the spans recorded per frame"""
+    registry.enabled = mode != "off"
+    if mode == "trace":
+        registry.start_trace()
+    model = StubModel()
+    detect_timer = stage_timer("detect")
+    cap = open_capture(video, IMAGE_WIDTH, IMAGE_HEIGHT)
+    processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT,
+                                 evidence_buffer=FrameRingBuffer(args.evidence_frames, IMAGE_WIDTH, IMAGE_HEIGHT))
+    broadcaster = RenditionBroadcaster()
+    view = broadcaster.view("half")
+    spans_before = spans_recorded()
+    times = []
+    for frame_number in range(args.frames):
+        start = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            break
+        packet = FramePacket(frame, frame_number / 25, frame_number + 1)
+        with detect_timer.time():
+            result = model.track(frame)[0]
+        processor.process(packet, *boxes_to_arrays(result.boxes))
+        broadcaster.publish(packet.frame, processor.frame_metadata(packet))
+        view.latest()
+        times.append(time.perf_counter() - start)
+    cap.release()
+    if mode == "trace":
+        registry.stop_trace()
+    registry.enabled = True
+    return times, (spans_recorded() - spans_before) / max(len(times), 1)
+
+
+def span_cost(repeat, trace=False):
+    """Seconds one timed block adds, net of the loop"""
+    histogram = stage_timer("bench_span")
+    if trace:
+        registry.start_trace()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with histogram.time():
+            pass
+    timed = time.perf_counter() - start
+    if trace:
+        registry.stop_trace()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        pass
+    return (timed - (time.perf_counter() - start)) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200, help="Frames per round")
+    parser.add_argument("--rounds", type=int, default=3, help="Rounds per mode, interleaved")
+    parser.add_argument("--vehicles", type=int, default=15)
+    parser.add_argument("--evidence-frames", type=int, default=50)
+    parser.add_argument("--span-repeat", type=int, default=200000)
+    parser.add_argument("--max-overhead", type=float, default=1.0, help="Percent of the frame time")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    times = {mode: [] for mode in MODES}
+    spans_per_frame = 0.0
+    with tempfile.TemporaryDirectory() as root:
+        video = SyntheticTraffic(args.vehicles).write_video(os.path.join(root, "clip.mkv"), args.frames, "FFV1")
+        # One warm-up pass, then the modes take turns so drift on the box hits them alike
+        run_round("on", video, region_points, args)
+        for _ in range(args.rounds):
+            for mode in MODES:
+                round_times, spans = run_round(mode, video, region_points, args)
+                times[mode].extend(round_times)
+                if mode == "on":
+                    spans_per_frame = spans
+
+    medians = {mode: float(np.median(values)) for mode, values in times.items()}
+    print(f"{args.frames} frames x {args.rounds} rounds per mode, {args.vehicles} vehicles")
+    print(f"{'timers':>8} {'median ms/frame':>16} {'p90 ms/frame':>13} {'vs off':>8}")
+    for mode in MODES:
+        change = (medians[mode] / medians["off"] - 1) * 100
+        print(f"{mode:>8} {medians[mode] * 1000:>16.3f} {np.percentile(times[mode], 90) * 1000:>13.3f} "
+              f"{change:>+7.2f}%")
+
+    cost = span_cost(args.span_repeat)
+    trace_cost = span_cost(args.span_repeat, trace=True)
+    overhead = spans_per_frame * cost / medians["off"] * 100
+    trace_overhead = spans_per_frame * trace_cost / medians["off"] * 100
+    print(f"\n{spans_per_frame:.1f} spans per frame, {cost * 1e9:.0f} ns each ({trace_cost * 1e9:.0f} ns tracing): "
+          f"{overhead:.3f}% of the frame time ({trace_overhead:.3f}% tracing), limit {args.max_overhead:g}%: "
+          f"{'PASS' if overhead <= args.max_overhead else 'FAIL'}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"median_frame_seconds": medians, "spans_per_frame": spans_per_frame,
+                       "span_seconds": cost, "trace_span_seconds": trace_cost, "overhead_percent": overhead,
+                       "trace_overhead_percent": trace_overhead}, f, indent=2)
+    sys.exit(0 if overhead <= args.max_overhead else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+MultiCameraEngine throughput against batch size, with local video files in place of RTSP.
+
+Writes one synthetic clip per camera plus matching camera configs to a temporary directory,
+then runs the engine with a stub detector whose cost is a fixed per-call overhead plus a
+smaller per-frame cost (the shape of a GPU batch).
+
+    python bench/bench_multi_camera.py --cameras 4 --batch-sizes 1 2 4 --seconds 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multi_camera import MultiCameraEngine, ResultTracker, default_processor_factory
+from synthetic import SOURCE_0, TARGET, StubModel, write_cameras
+
+
+def run(cameras, batch_size, args):
+    model = StubModel(latency=args.frame_ms / 1000, batch_latency=args.call_ms / 1000)
+    engine = MultiCameraEngine(cameras, model, ResultTracker, batch_size,
+                               processor_factory=default_processor_factory(SOURCE_0, TARGET)).start()
+    time.sleep(args.warmup)
+    start_frames = model.frames
+    start_versions = {camera_id: camera.version for camera_id, camera in engine.cameras.items()}
+    start = time.perf_counter()
+    time.sleep(args.seconds)
+    elapsed = time.perf_counter() - start
+    frames = model.frames - start_frames
+    published = {camera_id: (camera.version - start_versions[camera_id]) / elapsed
+                 for camera_id, camera in engine.cameras.items()}
+    stats = engine.stats()
+    engine.stop()
+    engine.join(2)
+    return {"batch_size": batch_size, "detector_fps": frames / elapsed, "mean_batch": stats["detector"]["mean_batch"],
+            "published_fps": published}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--warmup", type=float, default=1)
+    parser.add_argument("--clip-frames", type=int, default=100)
+    parser.add_argument("--call-ms", type=float, default=30, help="Stub detector cost per call")
+    parser.add_argument("--frame-ms", type=float, default=4, help="Stub detector cost per frame in the batch")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        cameras = write_cameras(root, args.cameras, frames=args.clip_frames)
+        print(f"{'batch':>6} {'detector fps':>13} {'mean batch':>11}  per-camera published fps")
+        for batch_size in args.batch_sizes:
+            row = run(cameras, batch_size, args)
+            results.append(row)
+            per_camera = " ".join(f"{fps:5.1f}" for fps in row["published_fps"].values())
+            print(f"{batch_size:>6} {row['detector_fps']:>13.1f} {row['mean_batch']:>11.2f}  {per_camera}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Serial loop against the threaded Pipeline on a synthetic video with a stub detector.
+
+Decode renders (and resizes) a synthetic frame, track calls StubModel (which sleeps like a
+GPU call) and updates a TrafficProcessor, annotate draws, encode JPEG-encodes.
+
+    python bench/bench_pipeline.py --frames 200 --latency-ms 20 --vehicles 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_batch import boxes_to_arrays
+from pipeline import FramePacket, Pipeline, Stage
+from traffic_processor import TrafficProcessor
+from synthetic import IMAGE_HEIGHT, IMAGE_WIDTH, FPS, SOURCE_0, TARGET, StubModel, SyntheticTraffic
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+
+
+def build(args):
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    # Render at 1080p so decode includes a resize, like the real source
+    scene = SyntheticTraffic(args.vehicles, 1920, 1080)
+    model = StubModel(latency=args.latency_ms / 1000)
+    processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT)
+    frame_number = [0]
+
+    def read_frame():
+        if frame_number[0] >= args.frames:
+            return None
+        frame = cv2.resize(scene.frame(frame_number[0]), (IMAGE_WIDTH, IMAGE_HEIGHT))
+        frame_number[0] += 1
+        return FramePacket(frame, frame_number[0] / FPS, frame_number[0])
+
+    def track_frame(packet):
+        result = model.track(packet.frame)[0]
+        processor.track(packet, *boxes_to_arrays(result.boxes))
+
+    def encode(packet):
+        packet.data["jpeg"] = cv2.imencode(".jpg", packet.frame)[1]
+
+    return read_frame, track_frame, processor.annotate, encode
+
+
+def run_serial(args):
+    read_frame, track_frame, annotate, encode = build(args)
+    start = time.perf_counter()
+    frames = 0
+    while True:
+        packet = read_frame()
+        if packet is None:
+            break
+        track_frame(packet)
+        annotate(packet)
+        encode(packet)
+        frames += 1
+    return frames / (time.perf_counter() - start), None
+
+
+def run_pipeline(args):
+    read_frame, track_frame, annotate, encode = build(args)
+    pipeline = Pipeline(read_frame, track_frame,
+                        [Stage("annotate", annotate, workers=args.workers), Stage("encode", encode, workers=args.workers)],
+                        queue_size=args.queue_size, policy=args.policy).start()
+    start = time.perf_counter()
+    frames = 0
+    last_sequence = -1
+    for packet in pipeline.results():
+        assert packet.sequence > last_sequence, "results out of order"
+        last_sequence = packet.sequence
+        frames += 1
+    elapsed = time.perf_counter() - start
+    pipeline.join()
+    return frames / elapsed, pipeline.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20, help="Simulated inference time per frame")
+    parser.add_argument("--workers", type=int, default=2, help="Threads per annotate/encode stage")
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--policy", default="block", choices=["block", "drop_oldest"])
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    serial_fps, _ = run_serial(args)
+    pipeline_fps, stats = run_pipeline(args)
+    print(f"serial:   {serial_fps:6.1f} fps")
+    print(f"pipeline: {pipeline_fps:6.1f} fps ({pipeline_fps / serial_fps:.2f}x)")
+    print(f"{'stage':>10} {'frames':>7} {'fps':>7} {'mean ms':>8} {'max ms':>8}")
+    for name, row in [("decode", stats["decode"])] + list(stats["stages"].items()) + [("end_to_end", stats["end_to_end"])]:
+        print(f"{name:>10} {row['frames']:>7} {row['fps']:>7.1f} {row['mean_ms']:>8.2f} {row['max_ms']:>8.2f}")
+    print(f"queues: {stats['queues']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"serial_fps": serial_fps, "pipeline_fps": pipeline_fps, "stats": stats}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Compare stream_server.py's single-process video loop with ProcessPipeline (decode, inference and encode in 3 processes).
+
+Both run the same synthetic clip, as fast as it decodes, with StubModel burning --detector-ms
+of CPU per frame while holding the GIL as CPU inference does. The frames go through
+TrafficProcessor's tracking and annotation, and each annotated frame is JPEG-encoded at
+the "half" rendition, as it would be for one viewer.
+
+- threads: process_video's Pipeline. A decoder thread, detection and tracking, then
+  ANNOTATION_WORKERS annotation threads, with the encode on the consuming thread, all in one
+  process.
+- processes: ProcessPipeline with a --slots frame SharedFrameRing. Decoding, then detection,
+  tracking and annotation, each run in a worker process, with the encode in this one.
+- supervised: processes again, with the inference worker killed (SIGKILL) every --kill-after
+  frames. It must be restarted each time, the clip must still play to the end, and every
+  slot of the ring must be free again at the end (a killed worker leaks none).
+
+The processes run also checks that the workers' traffic counters, stage timers and trace
+spans reach this process's registry, as /metrics and /trace need.
+
+The gain needs a core per process: on fewer than 3 cores the processes only take turns.
+
+    python bench/bench_processes.py --frames 300 --detector-ms 20
+"""
+import argparse
+import functools
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_batch import boxes_to_arrays
+from broadcast import RenditionBroadcaster
+from frame_scheduler import CaptureClock, FrameScheduler, read_scheduled
+from metrics import MetricsExporter, registry
+from pipeline import FramePacket, Pipeline, Stage
+from process_pipeline import ProcessPipeline, TrackAndAnnotate, VideoSource
+from synthetic import IMAGE_HEIGHT, IMAGE_WIDTH, REGION_POINTS_FILE, SOURCE_0, TARGET, StubModel, SyntheticTraffic
+from traffic_processor import TrafficProcessor
+from video_capture import open_capture
+
+ANNOTATION_WORKERS = 2  # stream_server.py's
+PIPELINE_QUEUE_SIZE = 4
+
+
+def serve(frames, broadcaster: RenditionBroadcaster):
+    """Publish every (frame, metadata) and encode it for one "half" viewer; (frames, seconds spent encoding)"""
+    view = broadcaster.view("half")
+    served = 0
+    seconds = 0.0
+    for frame, metadata in frames:
+        start = time.perf_counter()
+        broadcaster.publish(frame, metadata)
+        view.latest()
+        seconds += time.perf_counter() - start
+        served += 1
+    return served, seconds
+
+
+def run_threads(video: str, region_points: list, args):
+    model = StubModel(cpu_seconds=args.detector_ms / 1000)
+    processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT)
+    cap = open_capture(video, IMAGE_WIDTH, IMAGE_HEIGHT)
+    capture_clock = CaptureClock(cap)
+    scheduler = FrameScheduler(realtime=False)
+
+    def read_frame():
+        frame, time_stamp = read_scheduled(cap, capture_clock, scheduler)
+        return None if frame is None else FramePacket(frame, time_stamp, capture_clock.frames)
+
+    def track_frame(packet):
+        result = model.track(packet.frame, persist=True, verbose=False)[0]
+        processor.track(packet, *boxes_to_arrays(result.boxes))
+
+    start = time.perf_counter()
+    pipeline = Pipeline(read_frame, track_frame, [Stage("annotate", processor.annotate, workers=ANNOTATION_WORKERS)],
+                        queue_size=PIPELINE_QUEUE_SIZE).start()
+    frames, _ = serve(((packet.frame, processor.frame_metadata(packet)) for packet in pipeline.results()),
+                      RenditionBroadcaster())
+    elapsed = time.perf_counter() - start
+    pipeline.join()
+    cap.release()
+    return frames, elapsed, {}
+
+
+def run_processes(video: str, region_points: list, args, kill_after: int = 0):
+    job = TrackAndAnnotate(functools.partial(StubModel, cpu_seconds=args.detector_ms / 1000),
+                           functools.partial(TrafficProcessor, region_points, SOURCE_0, TARGET, IMAGE_WIDTH,
+                                             IMAGE_HEIGHT))
+    # What the workers' metrics add to this process's registry, and the spans they add to its trace
+    exporter = MetricsExporter(registry)
+    registry.start_trace()
+    start = time.perf_counter()
+    pipeline = ProcessPipeline(VideoSource(video, IMAGE_WIDTH, IMAGE_HEIGHT, realtime=False, loop=False), job,
+                               args.slots, IMAGE_WIDTH, IMAGE_HEIGHT, restart_seconds=0.1).start()
+
+    kills = 0
+
+    def results():
+        nonlocal kills
+        for served, result in enumerate(pipeline.results(), 1):
+            if kill_after and served % kill_after == 0:
+                os.kill(pipeline.workers["infer"].pid, signal.SIGKILL)
+                kills += 1
+            yield result
+
+    frames, encode_seconds = serve(results(), RenditionBroadcaster())
+    elapsed = time.perf_counter() - start
+    stats = pipeline.stats()
+    stats["encode_mean_ms"] = encode_seconds / frames * 1000 if frames else 0.0
+    stats["kills"] = kills
+    pipeline.stop()
+    pipeline.join()
+    trace = registry.stop_trace()
+    changes = exporter.export()["metrics"]
+    stats["metrics"] = {
+        "frames": sum(change for _, name, _, _, change in changes if name == "traffic_frames_total"),
+        "stages": sorted({labels["stage"] for kind, _, _, labels, _ in changes if kind == "histogram"}),
+        "worker_spans": sum(1 for event in trace.events if event[2] != os.getpid()),
+    }
+    return frames, elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--vehicles", type=int, default=10)
+    parser.add_argument("--detector-ms", type=float, default=20, help="CPU the stub detector burns per frame")
+    parser.add_argument("--slots", type=int, default=8, help="Frames in the shared-memory ring")
+    parser.add_argument("--kill-after", type=int, default=100, help="Frames between the supervised run's kills (0: skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        video = SyntheticTraffic(args.vehicles, seed=args.seed).write_video(os.path.join(workdir, "clip.mkv"),
+                                                                            args.frames, "FFV1")
+        results["threads"] = run_threads(video, region_points, args)
+        results["processes"] = run_processes(video, region_points, args)
+        if args.kill_after:
+            results["supervised"] = run_processes(video, region_points, args, args.kill_after)
+
+    print(f"{os.cpu_count()} cores, {args.frames} frames at {IMAGE_WIDTH}x{IMAGE_HEIGHT}, "
+          f"detector {args.detector_ms:g} ms CPU")
+    print(f"{'mode':<12}{'frames':>8}{'seconds':>9}{'fps':>8}{'speedup':>9}{'restarts':>10}")
+    base_fps = results["threads"][0] / results["threads"][1]
+    for mode, (frames, elapsed, stats) in results.items():
+        restarts = sum(worker["restarts"] for worker in stats["workers"].values()) if stats else 0
+        print(f"{mode:<12}{frames:>8}{elapsed:>9.2f}{frames / elapsed:>8.1f}{frames / elapsed / base_fps:>8.2f}x"
+              f"{restarts:>10}")
+    # Wall time per frame in each process; with a core each, the busiest one sets the frame rate
+    stats = results["processes"][2]
+    print(f"processes per frame: decode {stats['workers']['decode']['mean_ms']:.1f} ms, "
+          f"infer {stats['workers']['infer']['mean_ms']:.1f} ms, encode {stats['encode_mean_ms']:.1f} ms")
+    if os.cpu_count() < 3:
+        print("fewer than 3 cores: the processes cannot run side by side here (and share the time above)")
+
+    failures = []
+    if results["threads"][0] != args.frames or results["processes"][0] != args.frames:
+        failures.append("every frame processed in both modes")
+    metrics = results["processes"][2]["metrics"]
+    if metrics["frames"] != args.frames or "detect" not in metrics["stages"] or not metrics["worker_spans"]:
+        failures.append("the workers' counters, stage timers and trace spans reached this process")
+    if "supervised" in results:
+        frames, _, stats = results["supervised"]
+        # Only the frames the killed worker held are lost
+        kills = stats["kills"]
+        if (stats["workers"]["infer"]["restarts"] != kills or not stats["finished"]
+                or frames < args.frames - kills * args.slots):
+            failures.append("the killed inference worker restarted and the clip played to the end")
+        if stats["slots"]["free"] != args.slots:
+            failures.append(f"every slot free at the end (slots: {stats['slots']})")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+
+    if args.json:
+        report = {mode: {"frames": frames, "seconds": elapsed, "fps": frames / elapsed, "stats": stats}
+                  for mode, (frames, elapsed, stats) in results.items()}
+        report.update(cores=os.cpu_count(), failures=failures)
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
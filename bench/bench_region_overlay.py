@@ -0,0 +1,90 @@
+"""
+Per-frame cost of the precomputed RegionOverlay against the original apply_region_overlay,
+which ran once per detected box. Also reports how far the two outputs differ.
+
+    python bench/bench_region_overlay.py --frames 100 --boxes 0 10 40
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mask import mask
+from region_overlay import RegionOverlay
+
+IMAGE_WIDTH = 1280
+IMAGE_HEIGHT = 720
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+
+
+def apply_region_overlay(frame, region_mask_obj, region_points):
+    """The original main.py implementation, kept here as the reference"""
+    overlay = frame.copy()
+    region_color = np.array([144, 238, 144], dtype=np.uint8)
+    alpha = 0.25
+    mask_array = region_mask_obj.populated_mask
+    for i in range(3):
+        overlay[:, :, i] = np.where(mask_array == 1,
+                                   overlay[:, :, i] * (1 - alpha) + region_color[i] * alpha,
+                                   overlay[:, :, i])
+    if len(region_points) > 0:
+        points_array = np.array(region_points, dtype=np.int32)
+        cv2.polylines(overlay, [points_array], isClosed=True, color=(144, 238, 144), thickness=3)
+        for point in region_points:
+            cv2.circle(overlay, point, 5, (144, 238, 144), -1)
+    return overlay
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--boxes", type=int, nargs="+", default=[0, 10, 40],
+                        help="Detected boxes per frame (the old code overlaid once per box)")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    region_mask = mask(IMAGE_WIDTH, IMAGE_HEIGHT, region_points)
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, (IMAGE_HEIGHT, IMAGE_WIDTH, 3), dtype=np.uint8)
+
+    start = time.perf_counter()
+    region_overlay = RegionOverlay(region_mask, region_points)
+    setup_ms = (time.perf_counter() - start) * 1e3
+
+    target = frame.copy()
+    start = time.perf_counter()
+    for _ in range(args.frames):
+        np.copyto(target, frame)
+        region_overlay.apply(target)
+    engine_ms = (time.perf_counter() - start) / args.frames * 1e3
+
+    start = time.perf_counter()
+    for _ in range(max(args.frames // 10, 1)):
+        reference = apply_region_overlay(frame.copy(), region_mask, region_points)
+    legacy_ms = (time.perf_counter() - start) / max(args.frames // 10, 1) * 1e3
+
+    difference = np.abs(reference.astype(np.int16) - target.astype(np.int16))
+    print(f"RegionOverlay setup: {setup_ms:.1f} ms, max pixel difference to the original: {difference.max()}")
+    print(f"{'boxes':>6} {'original ms':>12} {'overlay ms':>11} {'speed-up':>9}")
+    results = []
+    for boxes in args.boxes:
+        # The original ran once per detected box (and at least once to have a frame to show)
+        legacy_frame_ms = legacy_ms * max(boxes, 1)
+        results.append({"boxes": boxes, "original_ms": legacy_frame_ms, "overlay_ms": engine_ms})
+        print(f"{boxes:>6} {legacy_frame_ms:>12.2f} {engine_ms:>11.2f} {legacy_frame_ms / engine_ms:>8.1f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"setup_ms": setup_ms, "max_difference": int(difference.max()), "rows": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
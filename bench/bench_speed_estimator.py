@@ -0,0 +1,106 @@
+"""
+Accuracy and cost of the speed estimators on synthetic trajectories with known speeds.
+
+Every track drives down the calibrated road plane at a constant speed; positions get
+Gaussian jitter plus occasional outlier boxes. The legacy two-point calculation
+(VehicleStore without an estimator) is included for comparison.
+
+    python bench/bench_speed_estimator.py --tracks 50 --noise 0.3 --outliers 0.02 --check
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speed_estimator import ESTIMATORS, make_estimator
+from vehicle_class import SCALING_FACTOR
+from vehicle_store import VehicleStore
+
+FPS = 25
+# Mean absolute error (km/h) each estimator must stay under for --check with the default scenario
+CHECK_LIMITS = {"least_squares": 3.0, "kalman": 3.0, "median": 3.0}
+
+
+def synthetic_tracks(tracks, frames, noise, outliers, seed=0):
+    """Returns (true speeds km/h, positions (frames, tracks, 2)) for straight tracks on the road plane"""
+    rng = np.random.default_rng(seed)
+    speeds = rng.uniform(40, 160, tracks)
+    velocity = speeds / SCALING_FACTOR
+    heading = rng.normal(0, 0.05, tracks)
+    t = np.arange(frames)[:, None] / FPS
+    positions = np.empty((frames, tracks, 2))
+    positions[..., 0] = rng.uniform(2, 23, tracks) + velocity * np.sin(heading) * t
+    positions[..., 1] = velocity * np.cos(heading) * t
+    positions += rng.normal(0, noise, positions.shape)
+    jumps = rng.random((frames, tracks)) < outliers
+    positions[jumps] += rng.normal(0, 5.0, (jumps.sum(), 2))
+    return speeds, positions
+
+
+def run_store(store, positions):
+    """Feed every frame through a VehicleStore; returns (speeds per frame, seconds per frame)"""
+    frames, tracks, _ = positions.shape
+    tracker_ids = np.arange(1, tracks + 1)
+    confs = np.ones(tracks, dtype=np.float32)
+    boxes = np.zeros((tracks, 4), dtype=np.int32)
+    is_inside = np.ones(tracks, dtype=bool)
+    estimates = np.zeros((frames, tracks), dtype=np.float32)
+    start = time.perf_counter()
+    for frame_number in range(frames):
+        estimates[frame_number], _ = store.detected_batch(tracker_ids, confs, boxes, is_inside,
+                                                          positions[frame_number], frame_number / FPS)
+    return estimates, (time.perf_counter() - start) / frames
+
+
+def summarise(name, speeds, estimates, seconds_per_frame, settle):
+    error = np.abs(estimates[settle:] - speeds[None, :])
+    row = {"estimator": name, "mae_kmh": float(error.mean()), "p95_kmh": float(np.percentile(error, 95)),
+           "max_kmh": float(error.max()), "us_per_frame": seconds_per_frame * 1e6}
+    print(f"{name:>14} {row['mae_kmh']:>9.2f} {row['p95_kmh']:>9.2f} {row['max_kmh']:>9.2f} {row['us_per_frame']:>11.1f}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=50)
+    parser.add_argument("--frames", type=int, default=250)
+    parser.add_argument("--window", type=int, default=25)
+    parser.add_argument("--noise", type=float, default=0.3, help="Position jitter in road-plane units")
+    parser.add_argument("--outliers", type=float, default=0.02, help="Fraction of samples that jump")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if an estimator misses CHECK_LIMITS")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    speeds, positions = synthetic_tracks(args.tracks, args.frames, args.noise, args.outliers)
+    # Only score once every method has had a full window (and the legacy method two intervals)
+    settle = 2 * args.window
+
+    print(f"{'estimator':>14} {'MAE km/h':>9} {'p95 km/h':>9} {'max km/h':>9} {'us/frame':>11}")
+    results = []
+    legacy = VehicleStore(args.tracks, INTERVAL_BETWEEN_SPEED_CALCULATION=args.window)
+    results.append(summarise("two-point", speeds, *run_store(legacy, positions), settle))
+    for name in ESTIMATORS:
+        store = VehicleStore(args.tracks, INTERVAL_BETWEEN_SPEED_CALCULATION=args.window,
+                             speed_estimator=make_estimator(name, args.tracks, window=args.window))
+        results.append(summarise(name, speeds, *run_store(store, positions), settle))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.check:
+        failed = [row["estimator"] for row in results
+                  if row["estimator"] in CHECK_LIMITS and row["mae_kmh"] > CHECK_LIMITS[row["estimator"]]]
+        if failed:
+            print(f"FAILED: {', '.join(failed)} over their MAE limits {CHECK_LIMITS}")
+            sys.exit(1)
+        print("All estimators within their MAE limits")
+
+
+if __name__ == "__main__":
+    main()
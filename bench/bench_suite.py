@@ -0,0 +1,343 @@
+"""
+End-to-end regression suite: main.py's and stream_server.py's processing on synthetic traffic, against a JSON baseline.
+
+Every scenario runs in a fresh child process, so its peak RSS and stage timings are its
+own. The clips are rendered losslessly by synthetic.py, and StubModel stands in for YOLO +
+ByteTrack. It reads the painted cars back out of each frame with their true ids, so runs
+repeat exactly and need neither a GPU nor model weights.
+
+- 1 camera: main.py's pipeline. That is the decoder, the detector with TrackPredictor,
+  TrafficProcessor.track, annotation on ANNOTATION_WORKERS threads, then the evidence ring,
+  EvidenceWriter and the processed video in frame order. It is not paced, so fps is the
+  throughput of the whole pipeline. Frames are also published to a RenditionBroadcaster with
+  one SSE viewer, as stream_server.py does.
+- 4 cameras: stream_server.py's MultiCameraEngine, with clips paced at the source frame rate
+  and one SSE viewer per camera. fps is the total frames published per second, so at most
+  cameras x FPS.
+
+Each scenario reports:
+- fps;
+- p50/p90/p99 of every traffic_stage_seconds stage (see metrics.py), over all cameras;
+- peak RSS;
+- the error of the mean speeds of the tracks that crossed the region against the cars' true speeds.
+
+--save records the results as the baseline. --check compares against it and exits non-zero
+on a regression beyond the tolerances (stage timings only for the 1-camera scenarios, whose
+work does not depend on timing). Baselines only compare on the machine that recorded them.
+
+    python bench/bench_suite.py --save          # record bench/baseline.json on this machine
+    python bench/bench_suite.py --check         # after a change: compare against it
+    python bench/bench_suite.py --scenarios 1x10 4x50
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcast import RenditionBroadcaster, sse_stream
+from evidence_buffer import FrameRingBuffer
+from evidence_writer import EvidenceWriter
+from frame_scheduler import CaptureClock, FrameScheduler, read_scheduled
+from metrics import STAGE_SECONDS, registry, stage_timer
+from multi_camera import MultiCameraEngine, ResultTracker, default_processor_factory, load_camera_configs
+from pipeline import FramePacket, Pipeline, Stage
+from roi_inference import RegionDetector
+from speed_estimator import make_estimator
+from synthetic import FPS, IMAGE_HEIGHT, IMAGE_WIDTH, REGION_POINTS_FILE, SOURCE_0, TARGET, StubModel, \
+    SyntheticTraffic, write_cameras
+from track_predictor import TrackPredictor
+from traffic_processor import TrafficProcessor
+from vehicle_store import VehicleStore
+from video_capture import open_capture
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SCENARIOS = ("1x1", "1x10", "1x50", "4x1", "4x10", "4x50")  # cameras x vehicles
+# main.py's settings, which the 1-camera scenario runs with
+TIME_NOT_DETECTED_THRESHOLD = 2
+MAX_TRACKED_VEHICLES = 256
+SPEED_ESTIMATION_WINDOW = 25
+CIRCULAR_ARRAY_SIZE = 100
+EVIDENCE_WORKERS = 2
+EVIDENCE_MAX_PENDING = 8
+ANNOTATION_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 4
+MAX_FRAME_LAG = 0.1
+BATCH_SIZE = 4  # stream_server.py's camera frames per detector call
+
+
+def parse_scenario(name: str):
+    """(cameras, vehicles) of a scenario name such as 4x10"""
+    cameras, vehicles = name.split("x")
+    return int(cameras), int(vehicles)
+
+
+class SpeedErrors:
+    """
+    on_summary callback comparing the mean speed of every track that crossed the region with
+    its car's true speed. Tracks still open at the end are left out: they only have the far end
+    of the region, where a pixel spans metres.
+    """
+    def __init__(self, traffic: SyntheticTraffic):
+        self.traffic = traffic
+        self.errors = []
+
+    def __call__(self, summary: dict):
+        if summary["mean_speed"] is not None and summary["reason"] != "shutdown":
+            car = (summary["tracker_id"] - 1) % self.traffic.vehicles
+            self.errors.append(abs(summary["mean_speed"] - self.traffic.speeds[car]))
+
+
+def sse_viewer(view):
+    """Daemon thread consuming a rendition's server-sent events, like one browser tile"""
+    def watch():
+        for _ in sse_stream(view, keepalive_seconds=1):
+            pass
+    threading.Thread(target=watch, name="sse-viewer", daemon=True).start()
+
+
+def run_single_camera(video: str, vehicles: int, workdir: str, args):
+    """main.py's pipeline over the whole clip; (frames, seconds, speed errors)"""
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    model = StubModel(cpu_seconds=args.detector_ms / 1000)
+    cap = open_capture(video, IMAGE_WIDTH, IMAGE_HEIGHT)
+    capture_clock = CaptureClock(cap)
+    scheduler = FrameScheduler(MAX_FRAME_LAG, realtime=False)
+    store = VehicleStore(MAX_TRACKED_VEHICLES, time_not_detected_threshold=TIME_NOT_DETECTED_THRESHOLD,
+                         speed_estimator=make_estimator("least_squares", MAX_TRACKED_VEHICLES,
+                                                        window=SPEED_ESTIMATION_WINDOW))
+    evidence_writer = EvidenceWriter(os.path.join(workdir, "evidence"), EVIDENCE_WORKERS, EVIDENCE_MAX_PENDING, "jpg",
+                                     fps=capture_clock.fps)
+    processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT, vehicle_store=store,
+                                 evidence_buffer=FrameRingBuffer(CIRCULAR_ARRAY_SIZE, IMAGE_WIDTH, IMAGE_HEIGHT),
+                                 evidence_writer=evidence_writer)
+    speed_errors = SpeedErrors(SyntheticTraffic(vehicles, seed=args.seed))
+    processor.on_summary = speed_errors
+    track_predictor = TrackPredictor()
+    region_detector = RegionDetector(model, region_points, IMAGE_WIDTH, IMAGE_HEIGHT, "full")
+    output_video = cv2.VideoWriter(os.path.join(workdir, "processed_video.mp4"), cv2.VideoWriter_fourcc(*"mp4v"),
+                                   capture_clock.fps, (IMAGE_WIDTH, IMAGE_HEIGHT))
+    detect_timer = stage_timer("detect")
+    video_write_timer = stage_timer("video_write")
+    broadcaster = RenditionBroadcaster()
+    sse_viewer(broadcaster.view("half"))
+
+    def read_frame():
+        frame, time_stamp = read_scheduled(cap, capture_clock, scheduler)
+        return None if frame is None else FramePacket(frame, time_stamp, capture_clock.frames)
+
+    def track_frame(packet):
+        with detect_timer.time():
+            detections = region_detector(packet.frame)
+        processor.track(packet, *track_predictor.update(*detections, packet.time_stamp))
+
+    def write_output(packet):
+        processor.record(packet)
+        with video_write_timer.time():
+            output_video.write(packet.frame)
+        broadcaster.publish(packet.frame, processor.frame_metadata(packet))
+
+    start = time.perf_counter()
+    pipeline = Pipeline(read_frame, track_frame,
+                        [Stage("annotate", processor.annotate, workers=ANNOTATION_WORKERS),
+                         Stage("output", write_output, ordered=True)],
+                        queue_size=PIPELINE_QUEUE_SIZE).start()
+    frames = sum(1 for _ in pipeline.results())
+    pipeline.join()
+    elapsed = time.perf_counter() - start
+    processor.finish()
+    cap.release()
+    output_video.release()
+    evidence_writer.close()
+    return frames, elapsed, speed_errors.errors
+
+
+def run_cameras(root: str, vehicles: int, args):
+    """MultiCameraEngine on the cameras configured in root for --seconds; (frames, seconds, speed errors)"""
+    factory = default_processor_factory(SOURCE_0, TARGET)
+    checks = []
+
+    def processor_factory(camera_id, config):
+        processor = factory(camera_id, config)
+        # write_cameras seeds each camera's scene with its id
+        processor.on_summary = SpeedErrors(SyntheticTraffic(vehicles, seed=camera_id))
+        checks.append(processor.on_summary)
+        return processor
+
+    model = StubModel(cpu_seconds=args.detector_ms / 1000)
+    engine = MultiCameraEngine(load_camera_configs(root), model, ResultTracker, BATCH_SIZE,
+                               processor_factory=processor_factory).start()
+    for camera in engine.cameras.values():
+        sse_viewer(camera.broadcaster.view("half"))
+    time.sleep(args.warmup)
+    start_versions = sum(camera.version for camera in engine.cameras.values())
+    start = time.perf_counter()
+    time.sleep(args.seconds)
+    frames = sum(camera.version for camera in engine.cameras.values()) - start_versions
+    elapsed = time.perf_counter() - start
+    engine.stop()
+    engine.join(2)
+    return frames, elapsed, [error for check in checks for error in check.errors]
+
+
+def child(args):
+    """One scenario in this process; prints its results as JSON"""
+    cameras, vehicles = parse_scenario(args.child)
+    if cameras == 1:
+        frames, elapsed, errors = run_single_camera(os.path.join(args.workdir, "camera_1.mkv"), vehicles,
+                                                    args.workdir, args)
+    else:
+        frames, elapsed, errors = run_cameras(args.workdir, vehicles, args)
+    stages = {stage: {"count": histogram.count, "p50_ms": histogram.quantile(0.5) * 1000,
+                      "p90_ms": histogram.quantile(0.9) * 1000, "p99_ms": histogram.quantile(0.99) * 1000}
+              for stage, histogram in sorted(registry.merged(STAGE_SECONDS, "stage").items()) if histogram.count}
+    print(json.dumps({
+        "scenario": args.child,
+        "cameras": cameras,
+        "vehicles": vehicles,
+        "frames": frames,
+        "fps": frames / elapsed,
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "speed_error": {"tracks": len(errors),
+                        "median_kmh": float(np.median(errors)) if errors else None,
+                        "p90_kmh": float(np.percentile(errors, 90)) if errors else None},
+        "stages": stages,
+    }))
+
+
+def run(scenario: str, args) -> dict:
+    """Render the scenario's clips, then run it in a child process"""
+    cameras, vehicles = parse_scenario(scenario)
+    with tempfile.TemporaryDirectory() as root:
+        if cameras == 1:
+            SyntheticTraffic(vehicles, seed=args.seed).write_video(os.path.join(root, "camera_1.mkv"), args.frames,
+                                                                   "FFV1")
+        else:
+            # Long enough not to loop during the run: a looped car would jump back under the same id
+            write_cameras(root, cameras, vehicles, int((args.warmup + args.seconds + 2) * FPS), "FFV1")
+        command = [sys.executable, os.path.abspath(__file__), "--child", scenario, "--workdir", root,
+                   "--frames", str(args.frames), "--seconds", str(args.seconds), "--warmup", str(args.warmup),
+                   "--detector-ms", str(args.detector_ms), "--seed", str(args.seed)]
+        output = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def machine() -> dict:
+    return {"platform": platform.platform(), "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(), "python": platform.python_version(), "opencv": cv2.__version__}
+
+
+def compare(results: list, baseline: dict, args) -> list:
+    """Regressions of results against the baseline's scenarios, as text"""
+    regressions = []
+    previous = {row["scenario"]: row for row in baseline["scenarios"]}
+    for row in results:
+        old = previous.get(row["scenario"])
+        if old is None:
+            continue
+        name = row["scenario"]
+        if row["fps"] < old["fps"] * (1 - args.fps_tolerance / 100):
+            regressions.append(f"{name}: {row['fps']:.1f} fps, was {old['fps']:.1f}")
+        if row["peak_rss_mb"] > old["peak_rss_mb"] * (1 + args.rss_tolerance / 100):
+            regressions.append(f"{name}: peak RSS {row['peak_rss_mb']:.0f} MB, was {old['peak_rss_mb']:.0f} MB")
+        error, old_error = row["speed_error"]["median_kmh"], old["speed_error"]["median_kmh"]
+        if old_error is not None and (error is None or error > old_error + args.speed_tolerance):
+            regressions.append(f"{name}: median speed error {error} km/h, was {old_error:.2f}")
+        # Paced cameras batch up differently from run to run, so only the 1-camera stage timings are compared
+        for stage, timing in (row["stages"].items() if row["cameras"] == 1 else ()):
+            old_timing = old["stages"].get(stage)
+            if old_timing is None:
+                continue
+            slower = timing["p50_ms"] - old_timing["p50_ms"]
+            if timing["p50_ms"] > old_timing["p50_ms"] * (1 + args.stage_tolerance / 100) and \
+                    slower > args.stage_min_ms:
+                regressions.append(f"{name}: {stage} p50 {timing['p50_ms']:.3f} ms, was {old_timing['p50_ms']:.3f}")
+    return regressions
+
+
+def print_results(results: list):
+    print(f"{'scenario':>9} {'frames':>7} {'fps':>7} {'peak RSS MB':>12} {'tracks':>7} "
+          f"{'speed err p50':>14} {'p90 km/h':>9}")
+    for row in results:
+        error = row["speed_error"]
+        median = f"{error['median_kmh']:.2f}" if error["median_kmh"] is not None else "-"
+        p90 = f"{error['p90_kmh']:.2f}" if error["p90_kmh"] is not None else "-"
+        print(f"{row['scenario']:>9} {row['frames']:>7} {row['fps']:>7.1f} {row['peak_rss_mb']:>12.0f} "
+              f"{error['tracks']:>7} {median:>14} {p90:>9}")
+    stages = sorted({stage for row in results for stage in row["stages"]})
+    print(f"\n{'stage p50/p99 ms':>16} " + " ".join(f"{row['scenario']:>13}" for row in results))
+    for stage in stages:
+        cells = []
+        for row in results:
+            timing = row["stages"].get(stage)
+            cells.append(f"{timing['p50_ms']:.2f}/{timing['p99_ms']:.2f}" if timing else "-")
+        print(f"{stage:>16} " + " ".join(f"{cell:>13}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), help="cameras x vehicles, e.g. 4x10")
+    parser.add_argument("--frames", type=int, default=500, help="Clip length of the 1-camera scenarios")
+    parser.add_argument("--seconds", type=float, default=10, help="Measured run of the multi-camera scenarios")
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--detector-ms", type=float, default=0,
+                        help="CPU the stub detector burns per frame (0: only the pipeline's own work is measured)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="Write the results to --baseline")
+    parser.add_argument("--check", action="store_true", help="Compare with --baseline; exit non-zero on a regression")
+    parser.add_argument("--fps-tolerance", type=float, default=15, help="Percent fps may drop")
+    parser.add_argument("--rss-tolerance", type=float, default=10, help="Percent peak RSS may grow")
+    parser.add_argument("--speed-tolerance", type=float, default=0.5, help="km/h the median speed error may grow")
+    parser.add_argument("--stage-tolerance", type=float, default=50, help="Percent a stage's p50 may grow")
+    parser.add_argument("--stage-min-ms", type=float, default=0.2, help="Smaller p50 increases are noise")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    results = []
+    for scenario in args.scenarios:
+        print(f"running {scenario} ...", file=sys.stderr, flush=True)
+        results.append(run(scenario, args))
+    print_results(results)
+    report = {"machine": machine(), "detector_ms": args.detector_ms, "frames": args.frames, "seconds": args.seconds,
+              "scenarios": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.check:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline["machine"] != report["machine"]:
+            print(f"\nNote: the baseline was recorded on {baseline['machine']}")
+        regressions = compare(results, baseline, args)
+        print(f"\n{len(regressions)} regressions against {args.baseline}")
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Replay synthetic ByteTrack detections into VehicleStore and the legacy dict of vehicle_class
+objects, reporting throughput and traced memory as the replay goes on.
+
+    python bench/bench_vehicle_store.py --detections 2000000 --active 40
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vehicle_class import vehicle_class
+from vehicle_store import VehicleStore
+
+FPS = 25
+INTERVAL_BETWEEN_SPEED_CALCULATION = 25
+TIME_NOT_DETECTED_THRESHOLD = 2
+
+
+def synthetic_frames(detections, active, track_length, seed=0):
+    """
+    Yield (time_stamp, tracker_ids, confs, boxes, is_inside, actual_points) per frame.
+    `active` vehicles are on screen at once and each lives for `track_length` frames before
+    ByteTrack issues a fresh id, so ids keep climbing like on a 24/7 camera.
+    """
+    rng = np.random.default_rng(seed)
+    lane_offset = rng.integers(0, track_length, active)
+    frame_number = 0
+    emitted = 0
+    while emitted < detections:
+        age = frame_number + lane_offset
+        tracker_ids = (age // track_length) * active + np.arange(active) + 1
+        progress = (age % track_length) / track_length
+        actual_points = np.stack([np.full(active, 12.0), progress * 250.0], axis=1).astype(np.float32)
+        boxes = np.tile(np.array([100, 300, 180, 360], dtype=np.int32), (active, 1))
+        confs = rng.uniform(0.3, 1.0, active).astype(np.float32)
+        is_inside = np.ones(active, dtype=bool)
+        yield frame_number / FPS, tracker_ids, confs, boxes, is_inside, actual_points
+        frame_number += 1
+        emitted += active
+
+
+def replay_store(frames, checkpoints):
+    store = VehicleStore(256, INTERVAL_BETWEEN_SPEED_CALCULATION=INTERVAL_BETWEEN_SPEED_CALCULATION,
+                         time_not_detected_threshold=TIME_NOT_DETECTED_THRESHOLD)
+    emitted = 0
+    for time_stamp, tracker_ids, confs, boxes, is_inside, actual_points in frames:
+        store.expire(time_stamp)
+        store.detected_batch(tracker_ids, confs, boxes, is_inside, actual_points, time_stamp)
+        emitted += len(tracker_ids)
+        checkpoints(emitted, len(store))
+
+
+def replay_legacy(frames, checkpoints):
+    vehicle_tracker = {}
+    emitted = 0
+    for time_stamp, tracker_ids, confs, boxes, is_inside, actual_points in frames:
+        for i, tracker_id in enumerate(tracker_ids.tolist()):
+            if tracker_id not in vehicle_tracker:
+                vehicle_tracker[tracker_id] = vehicle_class(tracker_id, [], INTERVAL_BETWEEN_SPEED_CALCULATION)
+            vehicle_tracker[tracker_id].detected(float(confs[i]), boxes[i].tolist(), bool(is_inside[i]),
+                                                 tuple(actual_points[i]), time_stamp)
+        emitted += len(tracker_ids)
+        checkpoints(emitted, len(vehicle_tracker))
+
+
+def run(name, replay, detections, active, track_length, samples=10):
+    rows = []
+    step = max(detections // samples, 1)
+    next_checkpoint = [step]
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    def checkpoints(emitted, tracked):
+        if emitted >= next_checkpoint[0]:
+            current, _ = tracemalloc.get_traced_memory()
+            rows.append({"detections": emitted, "tracked": tracked, "traced_mb": current / 1e6,
+                         "seconds": time.perf_counter() - start})
+            next_checkpoint[0] += step
+
+    replay(synthetic_frames(detections, active, track_length), checkpoints)
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+
+    print(f"\n{name}: {detections / elapsed:,.0f} detections/s")
+    print(f"{'detections':>12} {'tracked':>8} {'traced MB':>10}")
+    for row in rows:
+        print(f"{row['detections']:>12,} {row['tracked']:>8} {row['traced_mb']:>10.2f}")
+    return {"name": name, "detections_per_second": detections / elapsed, "checkpoints": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--detections", type=int, default=2_000_000)
+    parser.add_argument("--legacy-detections", type=int, default=200_000,
+                        help="The legacy dict grows without bound, so it replays a shorter run")
+    parser.add_argument("--active", type=int, default=40, help="Vehicles on screen at once")
+    parser.add_argument("--track-length", type=int, default=150, help="Frames each tracker id lives")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = [run("VehicleStore", replay_store, args.detections, args.active, args.track_length)]
+    if args.legacy_detections:
+        results.append(run("dict of vehicle_class", replay_legacy, args.legacy_detections, args.active,
+                           args.track_length))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Check the detector cascade: the heavy model runs once per suspect vehicle, confirms real ones and rejects ghosts.
+
+Replays a synthetic scene through TrafficProcessor (track, annotate, evidence ring) with a
+ViolationVerifier, both models injected as stubs:
+
+- the light model returns every painted car's true box, jittered by --jitter pixels, plus
+  "ghost" tracks: fast boxes that move down the road between the lanes but are never
+  painted, as a light model's false positives would;
+- the heavy model is StubModel, which finds only painted cars in a crop and burns
+  --heavy-ms of CPU per crop.
+
+Violations are issued to a recording evidence writer. Checks that:
+
+- every ghost that committed a violation was rejected and none of its violations issued;
+- every real car that committed a violation was confirmed, as a car, with at least one
+  violation issued;
+- the heavy model was called once per verified suspect, on at most --crops crops each,
+  whatever the number of frames;
+- every issued violation's clip covers the frame of the violation, although it is only
+  issued once the verdict is in.
+
+Also reports the refined speeds' error and the heavy model's CPU against running it on every frame.
+
+    python bench/check_cascade.py --frames 1500 --vehicles 15 --ghosts 3
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evidence_buffer import FrameRingBuffer
+from pipeline import FramePacket
+from speed_estimator import make_estimator
+from synthetic import FPS, IMAGE_HEIGHT, IMAGE_WIDTH, SOURCE_0, TARGET, StubModel, SyntheticTraffic
+from traffic_processor import TrafficProcessor
+from vehicle_class import ViewTransformer
+from vehicle_store import VehicleStore
+from violation_verifier import ViolationVerifier
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+GHOST_IDS = 50000  # ghost tracker ids start here, above any car's
+GHOST_LANES = (5.5, 10.5, 15.5)  # metres across the road, between the cars' lanes
+SPEED_LIMIT = 120
+FINE_SPEED_LIMIT = 130
+
+
+class RecordingWriter:
+    """
+    Stands in for EvidenceWriter: keeps the violations it is given, with whether their clip
+    covers the violation's time stamp and whether the ring still holds that frame at submit
+    """
+    def __init__(self):
+        self.violations = []
+        self.uncovered = 0
+        self.overwritten = 0
+
+    def submit(self, tracker_id, speed, time_stamp, evidence_buffer, start_time=None, end_time=None, extra=None,
+               clip=None):
+        slots, frame_numbers, time_stamps = clip if clip is not None else evidence_buffer.clip(start_time, end_time)
+        at = np.flatnonzero(time_stamps == time_stamp)
+        if not len(at):
+            self.uncovered += 1
+        elif evidence_buffer.frame_numbers[slots[at[0]]] != frame_numbers[at[0]]:
+            self.overwritten += 1
+        self.violations.append((tracker_id, speed, extra))
+        return True
+
+
+class LightModel:
+    """The light tier: true boxes with jitter, plus the boxes of ghost cars nobody painted"""
+    def __init__(self, scene: SyntheticTraffic, ghosts: SyntheticTraffic, jitter: float, seed: int):
+        self.scene = scene
+        self.ghosts = ghosts
+        self.jitter = jitter
+        self.rng = np.random.default_rng(seed)
+
+    def track(self, frame_number: int):
+        xyxy, ids, _ = self.scene.truth(frame_number)
+        ghost_xyxy, ghost_ids, _ = self.ghosts.truth(frame_number)
+        xyxy = np.concatenate([xyxy, ghost_xyxy])
+        xyxy = xyxy + np.round(self.rng.normal(0, self.jitter, xyxy.shape)).astype(np.int32)
+        return xyxy, np.concatenate([ids, ghost_ids + GHOST_IDS]), np.full(len(xyxy), 0.6, dtype=np.float32)
+
+
+def replay(args, region_points):
+    scene = SyntheticTraffic(args.vehicles, seed=args.seed)
+    ghosts = SyntheticTraffic(args.ghosts, speeds=(180, 220), seed=args.seed + 1, lanes=GHOST_LANES)
+    light = LightModel(scene, ghosts, args.jitter, args.seed)
+    heavy = StubModel(cpu_seconds=args.heavy_ms / 1000)
+    evidence_buffer = FrameRingBuffer(args.evidence_frames, IMAGE_WIDTH, IMAGE_HEIGHT)
+    writer = RecordingWriter()
+    # The replay runs faster than the stream would, so the queue is sized to never overflow
+    verifier = ViolationVerifier(heavy, evidence_buffer, writer, SPEED_LIMIT, args.crops, args.crop_every,
+                                 max_pending=args.frames, transformer=ViewTransformer(SOURCE_0, TARGET))
+    verdicts = {}
+    verifier.on_verdict = verdicts.__setitem__
+    processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT, SPEED_LIMIT,
+                                 FINE_SPEED_LIMIT, VehicleStore(speed_estimator=make_estimator("least_squares", 256)),
+                                 evidence_buffer, verifier=verifier)
+    violators = set()
+    frame = scene.background.copy()
+    start = time.process_time()
+    for frame_number in range(args.frames):
+        scene.frame(frame_number, frame)
+        packet = FramePacket(frame, frame_number / FPS, frame_number)
+        processor.process(packet, *light.track(frame_number))
+        violators.update(tracker_id for tracker_id, _ in packet.data["violations"])
+    processor.finish()
+    verifier.close()
+    return scene, heavy, verifier, writer, verdicts, violators, time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=1500)
+    parser.add_argument("--vehicles", type=int, default=15)
+    parser.add_argument("--ghosts", type=int, default=3, help="Fast tracks of the light model with no car behind them")
+    parser.add_argument("--jitter", type=float, default=1.0, help="Pixels of noise on the light model's boxes")
+    parser.add_argument("--heavy-ms", type=float, default=40, help="CPU the heavy stub burns per crop")
+    parser.add_argument("--crops", type=int, default=3)
+    parser.add_argument("--crop-every", type=int, default=5)
+    parser.add_argument("--evidence-frames", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    scene, heavy, verifier, writer, verdicts, violators, cpu_seconds = replay(args, region_points)
+    stats = verifier.stats()
+    ghost_violators = {tracker_id for tracker_id in violators if tracker_id >= GHOST_IDS}
+    car_violators = violators - ghost_violators
+    issued = {tracker_id for tracker_id, _, _ in writer.violations}
+    refined_errors = [abs(verdict["refined_speed"] - scene.speeds[(tracker_id - 1) % scene.vehicles])
+                      for tracker_id, verdict in verdicts.items()
+                      if tracker_id < GHOST_IDS and verdict.get("refined_speed") is not None]
+
+    print(f"{args.frames} frames, {args.vehicles} cars, {args.ghosts} ghost cars")
+    print(f"suspects {stats['suspects']}, verified {stats['verified']} (confirmed {stats['confirmed']}, "
+          f"rejected {stats['rejected']}, overflow {stats['overflow']})")
+    print(f"violators: {len(car_violators)} cars, {len(ghost_violators)} ghosts; violations issued "
+          f"{stats['violations_issued']}, dropped {stats['violations_dropped']}")
+    print(f"heavy model: {heavy.calls} calls on {heavy.frames} crops, {heavy.frames / args.frames:.3f} per frame "
+          f"(on every frame: {args.frames} full frames)")
+    print(f"heavy CPU {heavy.frames * args.heavy_ms / 1000:.1f} s against {args.frames * args.heavy_ms / 1000:.1f} s "
+          f"on every frame; whole replay {cpu_seconds:.1f} s CPU")
+    if refined_errors:
+        print(f"refined speed error: median {np.median(refined_errors):.2f} km/h over {len(refined_errors)} cars")
+
+    failures = []
+    if any(verdicts.get(tracker_id, {}).get("confirmed", True) for tracker_id in ghost_violators) or \
+            issued & ghost_violators:
+        failures.append("every violating ghost rejected, none of its violations issued")
+    if any(not verdicts.get(tracker_id, {}).get("confirmed") or verdicts[tracker_id]["class"] != "car"
+           for tracker_id in car_violators) or car_violators - issued:
+        failures.append("every violating car confirmed as a car and issued")
+    if heavy.calls != stats["verified"] or heavy.frames > stats["verified"] * args.crops or \
+            stats["verified"] > stats["suspects"]:
+        failures.append("one heavy call per verified suspect, at most --crops crops each")
+    print(f"clips: {writer.uncovered} of {len(writer.violations)} miss their violation's frame, "
+          f"{writer.overwritten} had it overwritten in the ring by the verdict")
+    if writer.uncovered:
+        failures.append("every issued clip covers its violation's time stamp")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"stats": stats, "heavy_calls": heavy.calls, "heavy_crops": heavy.frames,
+                       "car_violators": len(car_violators), "ghost_violators": len(ghost_violators),
+                       "refined_speed_errors": refined_errors, "failures": failures}, f, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
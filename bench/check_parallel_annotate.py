@@ -0,0 +1,95 @@
+"""
+Check that annotating frames on several pipeline workers gives the same pixels as annotating them one by one.
+
+Tracks synthetic traffic through TrafficProcessor, then annotates every frame twice: serially
+on the calling thread, and through a Pipeline whose annotate stage has --workers threads, as
+main.py and stream_server.py run it. Frames carry per-frame noise so that one frame's pixels
+leaking into another's region overlay cannot go unnoticed. Exits non-zero when any frame
+differs.
+
+    python bench/check_parallel_annotate.py --frames 600 --workers 2
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import FramePacket, Pipeline, Stage
+from synthetic import FPS, IMAGE_HEIGHT, IMAGE_WIDTH, SOURCE_0, TARGET, SyntheticTraffic
+from traffic_processor import TrafficProcessor
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+
+
+def tracked_packets(args, region_points):
+    """FramePackets with noisy frames and track() results, ready for annotate()"""
+    traffic = SyntheticTraffic(args.vehicles, seed=args.seed)
+    processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT)
+    rng = np.random.default_rng(args.seed)
+    packets = []
+    for frame_number in range(args.frames):
+        frame = traffic.frame(frame_number)
+        frame ^= rng.integers(0, 64, frame.shape, dtype=np.uint8)
+        packet = FramePacket(frame, frame_number / FPS, frame_number)
+        xyxy, ids, _ = traffic.truth(frame_number)
+        processor.track(packet, xyxy, ids, np.full(len(ids), 0.9))
+        packets.append(packet)
+    return processor, packets
+
+
+def copy_packet(packet) -> FramePacket:
+    copied = FramePacket(packet.frame.copy(), packet.time_stamp, packet.frame_number, **packet.data)
+    copied.sequence = packet.sequence
+    return copied
+
+
+def annotate_in_pipeline(processor, packets, workers: int) -> list:
+    source = iter(packets)
+    pipeline = Pipeline(lambda: next(source, None), lambda packet: None,
+                        [Stage("annotate", processor.annotate, workers=workers)]).start()
+    annotated = list(pipeline.results())
+    pipeline.join()
+    return annotated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--vehicles", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    processor, packets = tracked_packets(args, region_points)
+
+    serial = [copy_packet(packet) for packet in packets]
+    for packet in serial:
+        processor.annotate(packet)
+    parallel = annotate_in_pipeline(processor, [copy_packet(packet) for packet in packets], args.workers)
+
+    by_number = {packet.frame_number: packet for packet in parallel}
+    missing = [packet.frame_number for packet in serial if packet.frame_number not in by_number]
+    differing = [packet.frame_number for packet in serial
+                 if packet.frame_number in by_number and not np.array_equal(packet.frame,
+                                                                            by_number[packet.frame_number].frame)]
+    results = {"frames": args.frames, "workers": args.workers, "missing": len(missing),
+               "differing": len(differing), "first_differing": differing[:10]}
+    print(f"{args.frames} frames on {args.workers} annotate workers: "
+          f"{len(differing)} differ from serial annotation, {len(missing)} missing")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if differing or missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
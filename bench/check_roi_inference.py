@@ -0,0 +1,119 @@
+"""
+Check that region-cropped and tiled inference give the same boxes as full-frame inference.
+
+Runs the stub detector over synthetic frames three ways: on the full 1280x720 frame, on the
+region_points bounding rectangle (RegionDetector "crop"), and on native 3840x2160 tiles plus
+the crop (RegionDetector "tiles"). Only vehicles whose bottom centre is inside the region are
+compared, since those are the only ones main.py uses. Crop boxes must match exactly; tile
+boxes, which come from 3x the resolution, within a pixel of full-frame detection on the
+downscaled frame. Vehicles the tiles find but the downscaled frame has lost (slivers at
+the frame edge) are reported as native-only, not as mismatches. Exits non-zero on a mismatch.
+
+    python bench/check_roi_inference.py --frames 50 --margin 32
+"""
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_batch import bottom_centres, boxes_to_arrays
+from mask import mask
+from roi_inference import RegionDetector
+from synthetic import IMAGE_HEIGHT, IMAGE_WIDTH, StubModel, SyntheticTraffic
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+NATIVE_WIDTH, NATIVE_HEIGHT = 3840, 2160
+
+
+def inside(region_mask, xyxy, tracker_ids):
+    """{tracker id: box} of the boxes main.py would keep"""
+    points = bottom_centres(xyxy)
+    keep = region_mask.points_are_inside(points[:, 0], points[:, 1])
+    return {int(tracker_id): box for tracker_id, box in zip(tracker_ids[keep], xyxy[keep])}
+
+
+class IdFromPixels:
+    """Tracker for the check: reads the id back from the vehicle colour under each box centre"""
+    def update(self, result, frame):
+        xyxy = np.round(result.boxes.xyxy).astype(np.int32)
+        centres = (xyxy[:, :2] + xyxy[:, 2:]) // 2
+        pixels = frame[np.clip(centres[:, 1], 0, frame.shape[0] - 1), np.clip(centres[:, 0], 0, frame.shape[1] - 1)]
+        tracker_ids = pixels[:, 0].astype(np.int64) + pixels[:, 1].astype(np.int64) * 256
+        return xyxy, tracker_ids, result.boxes.conf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--margin", type=int, default=32)
+    parser.add_argument("--tile-size", type=int, default=640)
+    parser.add_argument("--tile-overlap", type=int, default=128)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    region_mask = mask(IMAGE_WIDTH, IMAGE_HEIGHT, region_points)
+    scene = SyntheticTraffic(args.vehicles, IMAGE_WIDTH, IMAGE_HEIGHT)
+    native_scene = SyntheticTraffic(args.vehicles, NATIVE_WIDTH, NATIVE_HEIGHT)
+    model = StubModel()
+    crop = RegionDetector(model, region_points, IMAGE_WIDTH, IMAGE_HEIGHT, "crop", args.margin)
+    tiles = RegionDetector(model, region_points, IMAGE_WIDTH, IMAGE_HEIGHT, "tiles", args.margin, args.tile_size,
+                           args.tile_overlap, tracker=IdFromPixels())
+
+    compared = crop_mismatches = tile_mismatches = native_only = 0
+    worst_tile_error = 0
+    for frame_number in range(args.frames):
+        frame = scene.frame(frame_number)
+        full = inside(region_mask, *boxes_to_arrays(model.track(frame)[0].boxes)[:2])
+        cropped = inside(region_mask, *crop(frame)[:2])
+        compared += len(full)
+        crop_mismatches += sum(1 for tracker_id, box in full.items()
+                               if tracker_id not in cropped or not np.array_equal(box, cropped[tracker_id]))
+        crop_mismatches += len(set(cropped) - set(full))
+
+        native_frame = native_scene.frame(frame_number)
+        # Nearest-neighbour keeps the id colours intact, like the stub needs
+        working_frame = cv2.resize(native_frame, (IMAGE_WIDTH, IMAGE_HEIGHT), interpolation=cv2.INTER_NEAREST)
+        truth = inside(region_mask, *boxes_to_arrays(model.track(working_frame)[0].boxes)[:2])
+        tiled = inside(region_mask, *tiles(working_frame, native_frame)[:2])
+        for tracker_id, box in truth.items():
+            if tracker_id not in tiled:
+                tile_mismatches += 1
+                continue
+            error = int(np.abs(box - tiled[tracker_id]).max())
+            worst_tile_error = max(worst_tile_error, error)
+            if error > 1:
+                tile_mismatches += 1
+        native_only += len(set(tiled) - set(truth))
+
+    result = {
+        "frames": args.frames,
+        "vehicles_compared": compared,
+        "crop_mismatches": crop_mismatches,
+        "crop_pixel_share": crop.pixel_share(),
+        "crop_bounds": crop.bounds,
+        "tile_mismatches": tile_mismatches,
+        "tile_max_error_px": worst_tile_error,
+        "tile_native_only": native_only,
+        "tiles": len(tiles.tiles(NATIVE_WIDTH, NATIVE_HEIGHT)[1]),
+        "tile_pixel_share": tiles.pixel_share(),
+    }
+    print(f"crop:  bounds {crop.bounds}, {crop.pixel_share() * 100:.0f}% of the frame's pixels, "
+          f"{crop_mismatches} mismatches in {compared} vehicles")
+    print(f"tiles: {result['tiles']} native tiles + crop, {tiles.pixel_share() * 100:.0f}% of the native frame's "
+          f"pixels, {tile_mismatches} mismatches, max error {worst_tile_error} px, {native_only} native-only")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    sys.exit(1 if crop_mismatches or tile_mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Check that tracks are finalized once, with correct summaries, and that memory stays flat under ID churn.
+
+Replays synthetic ByteTrack output (SyntheticTraffic ground truth, with a share of
+detections missed at random) through TrafficProcessor for a long stretch of stream time.
+Every lap of every car is a new tracker id, as on a camera that runs all day. Checks that:
+
+- every id is finalized exactly once (by expiry while running, or by finish() at the end)
+  and the store is empty afterwards;
+- traced memory at the last checkpoint is within --max-growth-kb of the first;
+- the summaries' mean speeds match the cars' true speeds (median error under --max-speed-error)
+  and every car that crossed the region has an entry, an exit and time in the region.
+
+Also reports the cost of expire() per frame against the store capacity, which should not
+grow with it. Exits non-zero when a check fails.
+
+    python bench/check_track_lifecycle.py --minutes 30 --vehicles 15 --miss 0.1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import FramePacket
+from speed_estimator import make_estimator
+from synthetic import FPS, IMAGE_HEIGHT, IMAGE_WIDTH, SOURCE_0, TARGET, SyntheticTraffic
+from traffic_processor import TrafficProcessor
+from vehicle_store import VehicleStore
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+TIME_NOT_DETECTED_THRESHOLD = 2
+ERROR_BINS = 0.1 * np.arange(501)  # km/h; the last bin takes every larger error
+
+
+class SummaryCheck:
+    """on_summary callback that checks summaries as they come, keeping only per-car state"""
+    def __init__(self, traffic: SyntheticTraffic):
+        self.traffic = traffic
+        self.last_id = np.zeros(traffic.vehicles, dtype=np.int64)
+        self.finalized = 0
+        self.reasons = {}
+        self.twice = 0
+        self.in_region = 0
+        self.no_region_time = 0
+        # Fixed-size histogram of speed errors, so the check itself does not grow
+        self.errors = np.zeros(len(ERROR_BINS), dtype=np.int64)
+
+    def __call__(self, summary: dict):
+        tracker_id = summary["tracker_id"]
+        car = (tracker_id - 1) % self.traffic.vehicles
+        # A car's ids only ever grow, one lap at a time; an id finalized again would not
+        if tracker_id <= self.last_id[car]:
+            self.twice += 1
+        self.last_id[car] = tracker_id
+        self.finalized += 1
+        self.reasons[summary["reason"]] = self.reasons.get(summary["reason"], 0) + 1
+        if summary["mean_speed"] is not None:
+            self.in_region += 1
+            error = abs(summary["mean_speed"] - self.traffic.speeds[car])
+            self.errors[min(np.searchsorted(ERROR_BINS, error), len(ERROR_BINS) - 1)] += 1
+            if not summary["time_in_region"] > 0 or summary["exit_time"] < summary["entry_time"]:
+                self.no_region_time += 1
+
+    def median_error(self) -> float:
+        if not self.in_region:
+            return None
+        return float(ERROR_BINS[np.searchsorted(np.cumsum(self.errors), self.in_region / 2)])
+
+
+def replay(args, region_points, capacity, minutes, trace=True):
+    traffic = SyntheticTraffic(args.vehicles, seed=args.seed)
+    store = VehicleStore(capacity, time_not_detected_threshold=TIME_NOT_DETECTED_THRESHOLD,
+                         speed_estimator=make_estimator("least_squares", capacity))
+    processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT, vehicle_store=store)
+    check = SummaryCheck(traffic)
+    processor.on_summary = check
+    rng = np.random.default_rng(args.seed)
+    frames = int(minutes * 60 * FPS)
+    step = max(frames // args.checkpoints, 1)
+    checkpoints, issued, max_active, expire_seconds = [], 0, 0, 0.0
+    last_id = np.zeros(args.vehicles, dtype=np.int64)
+    if trace:
+        tracemalloc.start()
+    for frame_number in range(frames):
+        xyxy, ids, _ = traffic.truth(frame_number)
+        kept = rng.random(len(ids)) >= args.miss
+        xyxy, ids = xyxy[kept], ids[kept]
+        cars = (ids - 1) % args.vehicles
+        issued += int(np.count_nonzero(ids != last_id[cars]))
+        last_id[cars] = ids
+        time_stamp = frame_number / FPS
+        start = time.perf_counter()
+        store.expire(time_stamp)
+        expire_seconds += time.perf_counter() - start
+        processor.track(FramePacket(None, time_stamp, frame_number), xyxy, ids, np.full(len(ids), 0.9))
+        max_active = max(max_active, len(store))
+        if trace and (frame_number + 1) % step == 0:
+            checkpoints.append({"minutes": time_stamp / 60, "active": len(store),
+                                "finalized": check.finalized, "traced_kb": tracemalloc.get_traced_memory()[0] / 1e3})
+    if trace:
+        tracemalloc.stop()
+    processor.finish()
+    return {
+        "capacity": capacity,
+        "frames": frames,
+        "max_active": max_active,
+        "left_in_store": len(store),
+        "store": store.stats(),
+        "finalized": check.finalized,
+        "ids_issued": issued,
+        "finalized_twice": check.twice,
+        "reasons": check.reasons,
+        "in_region": check.in_region,
+        "no_region_time": check.no_region_time,
+        "median_speed_error": check.median_error(),
+        "expire_us_per_frame": expire_seconds / frames * 1e6,
+        "checkpoints": checkpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--minutes", type=float, default=30, help="Stream time to replay")
+    parser.add_argument("--vehicles", type=int, default=15)
+    parser.add_argument("--miss", type=float, default=0.1, help="Share of detections dropped at random")
+    parser.add_argument("--capacity", type=int, nargs="+", default=[256, 4096],
+                        help="Store capacities to time expire() with; the first is also checked")
+    parser.add_argument("--timing-minutes", type=float, default=2, help="Stream time of each untraced timing run")
+    parser.add_argument("--checkpoints", type=int, default=10)
+    parser.add_argument("--max-growth-kb", type=float, default=64)
+    parser.add_argument("--max-speed-error", type=float, default=3.0, help="km/h")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    result = replay(args, region_points, args.capacity[0], args.minutes)
+    print(f"{args.minutes:g} min at {FPS} fps, {args.vehicles} cars, {args.miss:.0%} of detections missed")
+    print(f"{'minutes':>8} {'active':>7} {'finalized':>10} {'traced KB':>10}")
+    for row in result["checkpoints"]:
+        print(f"{row['minutes']:>8.1f} {row['active']:>7} {row['finalized']:>10} {row['traced_kb']:>10.1f}")
+    growth = result["checkpoints"][-1]["traced_kb"] - result["checkpoints"][0]["traced_kb"]
+    print(f"ids issued {result['ids_issued']}, finalized {result['finalized']} {result['reasons']}, "
+          f"twice {result['finalized_twice']}, left in store {result['left_in_store']}")
+    print(f"crossed the region {result['in_region']}, without region time {result['no_region_time']}, "
+          f"median mean-speed error {result['median_speed_error']:.2f} km/h")
+
+    # tracemalloc slows every allocation down, so expire() is timed on separate runs
+    timings = [replay(args, region_points, capacity, args.timing_minutes, trace=False) for capacity in args.capacity]
+    print(f"{'capacity':>9} {'expire us/frame':>16}")
+    for row in timings:
+        print(f"{row['capacity']:>9} {row['expire_us_per_frame']:>16.1f}")
+
+    failures = []
+    if result["finalized"] != result["ids_issued"] or result["finalized_twice"] or result["left_in_store"]:
+        failures.append("every id finalized exactly once")
+    if growth > args.max_growth_kb:
+        failures.append(f"memory flat (grew {growth:.1f} KB)")
+    if result["no_region_time"] or result["median_speed_error"] > args.max_speed_error:
+        failures.append("summaries match the cars")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"result": result, "timings": timings, "failures": failures}, f, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Throughput gain against speed-estimate error of detector frame skipping (track_predictor.py).
+
+Runs the main.py tracking step (detector or TrackPredictor, then TrafficProcessor.track with
+the least-squares speed estimator) over a synthetic clip rendered losslessly in memory, with
+a stub detector that burns CPU like yolov8x would. Every configuration sees the same frames;
+speed error is measured against the scene's ground truth, box error against its true boxes.
+
+    python bench/eval_frame_skipping.py --frames 500 --detector-ms 40 --intervals 1 2 3 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_batch import boxes_to_arrays
+from pipeline import FramePacket
+from speed_estimator import make_estimator
+from track_predictor import TrackPredictor
+from traffic_processor import TrafficProcessor
+from vehicle_store import VehicleStore
+from synthetic import IMAGE_HEIGHT, IMAGE_WIDTH, FPS, SOURCE_0, TARGET, StubModel, SyntheticTraffic
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+
+
+def box_errors(scene, frame_number, xyxy, tracker_ids, errors):
+    """Mean absolute corner error (px) of each box against the true box of the same vehicle"""
+    true_xyxy, true_ids, _ = scene.truth(frame_number)
+    common, mine, theirs = np.intersect1d(tracker_ids, true_ids, return_indices=True)
+    if len(common):
+        errors.extend(np.abs(xyxy[mine] - true_xyxy[theirs]).mean(axis=1).tolist())
+
+
+def run(name, predictor, frames, scene, region_points, args):
+    model = StubModel(cpu_seconds=args.detector_ms / 1000)
+    store = VehicleStore(speed_estimator=make_estimator("least_squares", 256))
+    processor = TrafficProcessor(region_points, SOURCE_0, TARGET, IMAGE_WIDTH, IMAGE_HEIGHT, vehicle_store=store)
+    speed_errors, boxes = [], []
+    start = time.perf_counter()
+    for frame_number, frame in enumerate(frames):
+        packet = FramePacket(frame, frame_number / FPS, frame_number)
+        if predictor.should_detect(packet.time_stamp):
+            result = model.track(frame)[0]
+            xyxy, tracker_ids, confs = predictor.update(*boxes_to_arrays(result.boxes), packet.time_stamp)
+        else:
+            xyxy, tracker_ids, confs = predictor.predict(packet.time_stamp)
+        processor.track(packet, xyxy, tracker_ids, confs)
+        data = packet.data
+        measured = data["is_inside"] & (data["speeds"] > 0)
+        speed_errors.extend(np.abs(data["speeds"][measured] -
+                                   scene.speeds[(data["tracker_ids"][measured] - 1) % scene.vehicles]).tolist())
+        box_errors(scene, frame_number, xyxy, tracker_ids, boxes)
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": name,
+        "fps": len(frames) / elapsed,
+        "detector_share": predictor.stats()["detector_share"],
+        "speed_mae_kmh": float(np.mean(speed_errors)) if speed_errors else float("nan"),
+        "speed_p95_kmh": float(np.percentile(speed_errors, 95)) if speed_errors else float("nan"),
+        "box_mae_px": float(np.mean(boxes)) if boxes else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--detector-ms", type=float, default=40, help="Simulated CPU inference time per frame")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 2, 3, 5], help="Fixed detector intervals")
+    parser.add_argument("--adaptive-interval", type=int, default=6, help="Longest gap of the adaptive mode")
+    parser.add_argument("--motion-threshold", type=float, default=0.5,
+                        help="Adaptive: predicted motion, in box heights, that triggers the detector")
+    parser.add_argument("--residual-threshold", type=float, default=0.4,
+                        help="Adaptive: prediction error, in box heights, that triggers the detector")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(REGION_POINTS_FILE, "r") as f:
+        region_points = json.load(f)
+    scene = SyntheticTraffic(args.vehicles, IMAGE_WIDTH, IMAGE_HEIGHT)
+    frames = [scene.frame(frame_number) for frame_number in range(args.frames)]
+
+    configurations = [(f"every {interval}", TrackPredictor(interval)) for interval in args.intervals]
+    configurations.append((f"adaptive <={args.adaptive_interval}",
+                           TrackPredictor(args.adaptive_interval, args.motion_threshold, args.residual_threshold)))
+    results = []
+    print(f"{'mode':>14} {'fps':>7} {'gain':>6} {'detector %':>11} {'speed MAE':>10} {'speed p95':>10} {'box MAE px':>11}")
+    for name, predictor in configurations:
+        row = run(name, predictor, frames, scene, region_points, args)
+        results.append(row)
+        row["gain"] = row["fps"] / results[0]["fps"]
+        print(f"{name:>14} {row['fps']:>7.1f} {row['gain']:>5.2f}x {row['detector_share'] * 100:>10.0f}% "
+              f"{row['speed_mae_kmh']:>10.2f} {row['speed_p95_kmh']:>10.2f} {row['box_mae_px']:>11.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Synthetic traffic and a stub detector for running the pipeline without video files or a GPU.
+
+SyntheticTraffic renders rectangles driving down the calibrated road plane at known speeds,
+projected into the image through the SOURCE_0/TARGET homography used by main.py. Each
+vehicle is painted in a colour that encodes its id, so StubModel can recover ByteTrack-shaped
+boxes (xyxy, id, conf) from the pixels alone, deterministically.
+"""
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vehicle_class import SCALING_FACTOR, scale_coordinates
+
+REGION_POINTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_points.json")
+
+IMAGE_WIDTH = 1280
+IMAGE_HEIGHT = 720
+FPS = 25
+SOURCE_0 = scale_coordinates(np.array([[1252, 787], [2298, 803], [5039, 2159], [-550, 2159]]))
+TARGET = np.array([[0, 0], [24, 0], [24, 249], [0, 249]])
+ROAD_LENGTH = 250.0
+LANES = (3.0, 8.0, 13.0, 18.0, 22.0)
+# Red channel value that marks vehicle pixels; blue + 256 * green holds the vehicle id
+MARKER = 200
+
+
+class SyntheticTraffic:
+    """Deterministic scene of `vehicles` cars looping down the road at constant speeds"""
+    def __init__(self, vehicles: int = 10, image_width: int = IMAGE_WIDTH, image_height: int = IMAGE_HEIGHT,
+                 fps: float = FPS, speeds=(60, 160), seed: int = 0, source_points=SOURCE_0, target_points=TARGET,
+                 lanes=LANES):
+        rng = np.random.default_rng(seed)
+        self.vehicles = vehicles
+        self.image_width = image_width
+        self.image_height = image_height
+        self.fps = fps
+        self.speeds = rng.uniform(speeds[0], speeds[1], vehicles)
+        self.lanes = np.array(lanes)[np.arange(vehicles) % len(lanes)]
+        # Spread the cars along the road, and leave a gap after it before a car re-enters
+        self.loop_length = ROAD_LENGTH * 1.5
+        self.offsets = rng.uniform(0, self.loop_length, vehicles)
+        # Homographies are defined at 1280x720; scale them for other frame sizes
+        scale = np.diag([image_width / IMAGE_WIDTH, image_height / IMAGE_HEIGHT, 1.0])
+        road_to_image = cv2.getPerspectiveTransform(target_points.astype(np.float32), source_points.astype(np.float32))
+        self.road_to_image = scale @ road_to_image
+        self.background = np.full((image_height, image_width, 3), 90, dtype=np.uint8)
+        road = cv2.perspectiveTransform(np.array([[[0, 0], [24, 0], [24, 249], [0, 249]]], dtype=np.float32),
+                                        self.road_to_image)
+        cv2.fillPoly(self.background, [road.astype(np.int32)], (60, 60, 60))
+
+    def _project(self, points: np.ndarray) -> np.ndarray:
+        if not len(points):
+            return np.empty((0, 2), dtype=np.float32)
+        return cv2.perspectiveTransform(points.reshape(-1, 1, 2).astype(np.float32), self.road_to_image).reshape(-1, 2)
+
+    def state(self, time_stamp: float):
+        """(tracker ids, road-plane positions (N, 2), speeds km/h) of the cars on the road at time_stamp"""
+        distance = self.offsets + self.speeds / SCALING_FACTOR * time_stamp
+        laps = np.floor(distance / self.loop_length).astype(np.int64)
+        y = distance - laps * self.loop_length
+        on_road = y < ROAD_LENGTH
+        ids = (laps * self.vehicles + np.arange(self.vehicles)) % 65535 + 1
+        positions = np.stack([self.lanes, y], axis=1)
+        return ids[on_road], positions[on_road], self.speeds[on_road]
+
+    def truth(self, frame_number: int):
+        """Ground-truth (xyxy int32, ids, speeds km/h) for a frame, nearest car last"""
+        ids, positions, speeds = self.state(frame_number / self.fps)
+        order = np.argsort(positions[:, 1])
+        ids, positions, speeds = ids[order], positions[order], speeds[order]
+        bottom = self._project(positions)
+        left = self._project(positions - [1.0, 0.0])
+        right = self._project(positions + [1.0, 0.0])
+        width = np.maximum(np.abs(right[:, 0] - left[:, 0]), 4)
+        height = np.maximum(width * 0.8, 3)
+        xyxy = np.stack([bottom[:, 0] - width / 2, bottom[:, 1] - height, bottom[:, 0] + width / 2, bottom[:, 1]],
+                        axis=1)
+        xyxy = np.round(xyxy).astype(np.int32)
+        visible = (xyxy[:, 2] > 0) & (xyxy[:, 0] < self.image_width) & (xyxy[:, 3] > 0) & \
+                  (xyxy[:, 1] < self.image_height)
+        return xyxy[visible], ids[visible], speeds[visible]
+
+    def frame(self, frame_number: int, out: np.ndarray = None) -> np.ndarray:
+        """Render a frame (into `out` if given)"""
+        if out is None:
+            out = self.background.copy()
+        else:
+            np.copyto(out, self.background)
+        xyxy, ids, _ = self.truth(frame_number)
+        for (x1, y1, x2, y2), tracker_id in zip(xyxy.tolist(), ids.tolist()):
+            colour = (tracker_id % 256, tracker_id // 256, MARKER)
+            cv2.rectangle(out, (x1, y1), (x2 - 1, y2 - 1), colour, -1)
+        return out
+
+    def write_video(self, path: str, frames: int, fourcc: str = "mp4v") -> str:
+        """Write `frames` rendered frames to a video file (FFV1 in .mkv keeps the id colours exact)"""
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), self.fps, (self.image_width, self.image_height))
+        frame = self.background.copy()
+        for frame_number in range(frames):
+            writer.write(self.frame(frame_number, frame))
+        writer.release()
+        return path
+
+
+def write_cameras(root: str, cameras: int, vehicles: int = 10, frames: int = 100, fourcc: str = "mp4v") -> dict:
+    """
+    One synthetic clip (seeded by the camera id) and one rtsp-credential-N.json per camera
+    in root, loaded back with multi_camera.load_camera_configs.
+    """
+    from multi_camera import load_camera_configs
+    extension = "mkv" if fourcc == "FFV1" else "mp4"
+    for camera_id in range(1, cameras + 1):
+        source = SyntheticTraffic(vehicles, IMAGE_WIDTH, IMAGE_HEIGHT, seed=camera_id).write_video(
+            os.path.join(root, f"camera_{camera_id}.{extension}"), frames, fourcc)
+        config = {"id": camera_id, "name": f"Camera {camera_id}", "url": f"http://localhost:5000/video_feed/{camera_id}",
+                  "source": source, "region_points": REGION_POINTS_FILE, "enabled": True}
+        with open(os.path.join(root, f"rtsp-credential-{camera_id}.json"), "w") as f:
+            json.dump(config, f)
+    return load_camera_configs(root)
+
+
+class StubBoxes:
+    """Just enough of ultralytics Boxes for box_batch.boxes_to_arrays"""
+    def __init__(self, xyxy: np.ndarray, ids: np.ndarray, conf: np.ndarray):
+        self.xyxy = xyxy.astype(np.float32)
+        self.id = ids.astype(np.float32) if len(ids) else None
+        self.conf = conf.astype(np.float32)
+        self.cls = np.full(len(xyxy), 2, dtype=np.float32)  # COCO "car"
+
+    def __len__(self):
+        return len(self.xyxy)
+
+
+class StubResult:
+    def __init__(self, boxes: StubBoxes):
+        self.boxes = boxes
+
+
+def detect_vehicles(frame: np.ndarray):
+    """Recover (xyxy, ids) of the painted vehicles from a SyntheticTraffic frame"""
+    ys, xs = np.nonzero(frame[:, :, 2] == MARKER)
+    if len(ys) == 0:
+        return np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=np.int64)
+    ids = frame[ys, xs, 0].astype(np.int64) + frame[ys, xs, 1].astype(np.int64) * 256
+    order = np.argsort(ids, kind="stable")
+    ids, xs, ys = ids[order], xs[order], ys[order]
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    xyxy = np.stack([np.minimum.reduceat(xs, starts), np.minimum.reduceat(ys, starts),
+                     np.maximum.reduceat(xs, starts) + 1, np.maximum.reduceat(ys, starts) + 1], axis=1)
+    return xyxy.astype(np.int32), ids[starts]
+
+
+class StubModel:
+    """
+    Stands in for an ultralytics YOLO model. track()/predict() read the vehicles back out of
+    a SyntheticTraffic frame. `latency` sleeps like a GPU call (the GIL is released);
+    `cpu_seconds` busy-waits like CPU inference (the GIL is held).
+    """
+    def __init__(self, latency: float = 0.0, cpu_seconds: float = 0.0, batch_latency: float = 0.0):
+        self.latency = latency
+        self.cpu_seconds = cpu_seconds
+        self.batch_latency = batch_latency
+        self.calls = 0
+        self.frames = 0
+
+    def _cost(self, frames: int):
+        self.calls += 1
+        self.frames += frames
+        if self.latency or self.batch_latency:
+            time.sleep(self.batch_latency + self.latency * frames)
+        if self.cpu_seconds:
+            # CPU time of this thread, so stubs sharing a core (threads or processes) really compete for it
+            deadline = time.thread_time() + self.cpu_seconds * frames
+            while time.thread_time() < deadline:
+                pass
+
+    def _result(self, frame):
+        xyxy, ids = detect_vehicles(frame)
+        return StubResult(StubBoxes(xyxy, ids, np.full(len(ids), 0.9)))
+
+    def track(self, frame, **kwargs):
+        self._cost(1)
+        return [self._result(frame)]
+
+    def predict(self, frames, **kwargs):
+        frames = frames if isinstance(frames, list) else [frames]
+        self._cost(len(frames))
+        return [self._result(frame) for frame in frames]
+
+    __call__ = predict
@@ -0,0 +1,110 @@
+import numpy as np
+
+# Box colours per speed class (BGR): under the limit, over the limit, over the fine limit
+SPEED_CLASS_COLOURS = ((0, 255, 0), (0, 255, 255), (0, 0, 255))
+
+
+def _to_numpy(values) -> np.ndarray:
+    """Convert a torch tensor (or anything array-like) to a NumPy array"""
+    if hasattr(values, "cpu"):
+        values = values.cpu()
+    if hasattr(values, "numpy"):
+        return values.numpy()
+    return np.asarray(values)
+
+
+def empty_arrays():
+    """Arrays returned when a frame has no tracked boxes"""
+    return (np.empty((0, 4), dtype=np.int32),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.float32))
+
+
+def boxes_to_arrays(boxes):
+    """
+    Convert an ultralytics Boxes object into NumPy arrays once per frame.
+    Boxes without a tracker id are dropped.
+    Returns (xyxy int32 (N, 4), tracker_ids int64 (N,), confs float32 (N,))
+    """
+    if boxes is None or boxes.id is None or len(boxes) == 0:
+        return empty_arrays()
+
+    xyxy = _to_numpy(boxes.xyxy).reshape(-1, 4)
+    tracker_ids = _to_numpy(boxes.id).reshape(-1)
+    confs = _to_numpy(boxes.conf).reshape(-1)
+
+    # Skip boxes the tracker has not assigned an id yet
+    has_id = np.isfinite(tracker_ids)
+    if not has_id.all():
+        xyxy, tracker_ids, confs = xyxy[has_id], tracker_ids[has_id], confs[has_id]
+
+    return (xyxy.astype(np.int32),
+            tracker_ids.astype(np.int64),
+            confs.astype(np.float32))
+
+
+class Detections:
+    """
+    Boxes in the shape of ultralytics' Boxes: xyxy, xywh, conf, cls and id (None when untracked),
+    plus the indexing BYTETracker uses. Lets detections that did not come from an ultralytics
+    model (merged tiles, ONNX/OpenVINO backends) go through boxes_to_arrays and ByteTrackTracker.
+    """
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray, id: np.ndarray = None):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.float32).reshape(-1)
+        self.id = None if id is None else np.asarray(id, dtype=np.float32).reshape(-1)
+
+    @property
+    def xywh(self) -> np.ndarray:
+        xywh = self.xyxy.copy()
+        xywh[:, :2] = (self.xyxy[:, :2] + self.xyxy[:, 2:]) / 2
+        xywh[:, 2:] = self.xyxy[:, 2:] - self.xyxy[:, :2]
+        return xywh
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __getitem__(self, index):
+        return Detections(self.xyxy[index], self.conf[index], self.cls[index],
+                          None if self.id is None else self.id[index])
+
+
+class DetectionsResult:
+    """One frame's result, like an ultralytics Results: only .boxes is used"""
+    def __init__(self, boxes: Detections):
+        self.boxes = boxes
+
+
+def bottom_centres(xyxy: np.ndarray) -> np.ndarray:
+    """Bottom centre of every box, i.e. where the vehicle touches the road"""
+    points = np.empty((len(xyxy), 2), dtype=np.int32)
+    points[:, 0] = (xyxy[:, 0] + xyxy[:, 2]) // 2
+    points[:, 1] = xyxy[:, 3]
+    return points
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(len(a), len(b)) IoU matrix of two sets of xyxy boxes"""
+    a, b = np.asarray(a, dtype=np.float64).reshape(-1, 4), np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def speed_classes(speeds: np.ndarray, speed_limit: float, fine_speed_limit: float) -> np.ndarray:
+    """
+    Colour class for every speed: 0 under the limit, 1 over SPEED_LIMIT,
+    2 over FINE_SPEED_LIMIT (index into SPEED_CLASS_COLOURS)
+    """
+    speeds = np.asarray(speeds)
+    return (speeds > speed_limit).astype(np.int8) + (speeds > fine_speed_limit).astype(np.int8)
@@ -0,0 +1,266 @@
+import base64
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from metrics import stage_timer
+
+# Rendition name -> (scale of the processed frame, JPEG quality)
+DEFAULT_RENDITIONS = {"full": (1.0, 80), "half": (0.5, 75), "thumb": (0.25, 60)}
+
+
+class FrameBroadcaster:
+    """
+    Versioned latest-frame slot: one producer publishes, any number of clients wait.
+
+    publish() replaces the frame and bumps the version; wait() returns as soon as
+    there is a version newer than the one the client already has. A slow client
+    simply gets the newest frame next time and skips the ones in between, so it
+    never holds up the producer. A frame may carry metadata (any JSON-able value, e.g.
+    the vehicles and speeds drawn on it), which is kept and handed out with it.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.version = 0
+        self.data = None
+        self.metadata = None
+        self.published_at = 0.0
+        self.subscribers = 0
+
+    def publish(self, data: bytes, metadata=None):
+        with self._condition:
+            self.data = data
+            self.metadata = metadata
+            self.version += 1
+            self.published_at = time.time()
+            self._condition.notify_all()
+
+    def latest(self):
+        """(version, data) of the newest frame; version 0 means nothing was published yet"""
+        with self._condition:
+            return self.version, self.data
+
+    def wait(self, after_version: int, timeout: float = 1.0):
+        """(version, data) of the first frame newer than after_version, or (after_version, None) on timeout"""
+        version, data, _ = self.wait_with_metadata(after_version, timeout)
+        return version, data
+
+    def wait_with_metadata(self, after_version: int, timeout: float = 1.0):
+        """As wait(), with the frame's metadata: (version, data, metadata)"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.version > after_version, timeout):
+                return after_version, None, None
+            return self.version, self.data, self.metadata
+
+    @contextmanager
+    def subscription(self):
+        """Count a client for as long as it is connected"""
+        with self._condition:
+            self.subscribers += 1
+        try:
+            yield self
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+
+class Rendition:
+    """One output size of a RenditionBroadcaster and its encode/bandwidth counters"""
+    def __init__(self, name: str, scale: float, quality: int, camera=None):
+        self.name = name
+        self.scale = scale
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.version = 0
+        self.data = None
+        self.event_version = 0
+        self.event = None
+        self.subscribers = 0
+        self.encoded = 0
+        self.encode_seconds = 0.0
+        self.bytes_encoded = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.timer = stage_timer("jpeg_encode", camera=camera, rendition=name)
+
+    def snapshot(self) -> dict:
+        return {
+            "scale": self.scale,
+            "quality": self.quality,
+            "subscribers": self.subscribers,
+            "encoded": self.encoded,
+            "mean_encode_ms": self.encode_seconds / self.encoded * 1000 if self.encoded else 0.0,
+            "mean_bytes": self.bytes_encoded / self.encoded if self.encoded else 0.0,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+        }
+
+
+class RenditionView:
+    """A single rendition seen through the FrameBroadcaster interface (wait/latest/subscription)"""
+    def __init__(self, parent, rendition: Rendition):
+        self.parent = parent
+        self.rendition = rendition
+
+    def wait(self, after_version: int, timeout: float = 1.0):
+        version, frame = self.parent.frames.wait(after_version, timeout)
+        if frame is None:
+            return version, None
+        return version, self._sent(self.parent.encode(self.rendition, version, frame))
+
+    def wait_event(self, after_version: int, timeout: float = 1.0):
+        """(version, server-sent event) of the first frame newer than after_version, see RenditionBroadcaster.event"""
+        version, frame, metadata = self.parent.frames.wait_with_metadata(after_version, timeout)
+        if frame is None:
+            return version, None
+        return version, self._sent(self.parent.event(self.rendition, version, frame, metadata))
+
+    def _sent(self, data: bytes) -> bytes:
+        with self.rendition.lock:
+            self.rendition.frames_sent += 1
+            self.rendition.bytes_sent += len(data)
+        return data
+
+    def latest(self):
+        version, frame = self.parent.frames.latest()
+        if frame is None:
+            return version, None
+        return version, self.parent.encode(self.rendition, version, frame)
+
+    @contextmanager
+    def subscription(self):
+        with self.rendition.lock:
+            self.rendition.subscribers += 1
+        try:
+            yield self
+        finally:
+            with self.rendition.lock:
+                self.rendition.subscribers -= 1
+
+
+class RenditionBroadcaster:
+    """
+    Broadcasts raw annotated frames and JPEG-encodes them per rendition on demand.
+
+    renditions maps a name to (scale, JPEG quality). The first client that asks for a
+    rendition of a new frame encodes it; everyone else on that rendition reuses the bytes,
+    so each rendition costs at most one encode per frame and nothing while unwatched.
+    camera labels the encode timings.
+    """
+    def __init__(self, renditions: dict = None, default: str = "full", camera=None):
+        renditions = renditions or DEFAULT_RENDITIONS
+        self.frames = FrameBroadcaster()
+        self.renditions = {name: Rendition(name, scale, quality, camera)
+                           for name, (scale, quality) in renditions.items()}
+        self.default = default
+
+    def publish(self, frame: np.ndarray, metadata=None):
+        """Publish an annotated frame (and its metadata); neither may be modified afterwards"""
+        self.frames.publish(frame, metadata)
+
+    def view(self, name: str = None) -> RenditionView:
+        """KeyError if there is no rendition called name"""
+        return RenditionView(self, self.renditions[name or self.default])
+
+    def encode(self, rendition: Rendition, version: int, frame: np.ndarray) -> bytes:
+        with rendition.lock:
+            if rendition.version < version:
+                start = time.perf_counter()
+                with rendition.timer.time():
+                    if rendition.scale != 1.0:
+                        frame = cv2.resize(frame, None, fx=rendition.scale, fy=rendition.scale,
+                                           interpolation=cv2.INTER_AREA)
+                    ret, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, rendition.quality])
+                if ret:
+                    rendition.data = buffer.tobytes()
+                    rendition.version = version
+                    rendition.encoded += 1
+                    rendition.encode_seconds += time.perf_counter() - start
+                    rendition.bytes_encoded += len(rendition.data)
+            return rendition.data
+
+    def event(self, rendition: Rendition, version: int, frame: np.ndarray, metadata) -> bytes:
+        """
+        The frame as one server-sent event: its version as the event id, and JSON data with
+        the sequence number, the metadata and the rendition's JPEG in base64. Built once per
+        frame and rendition, like the JPEG itself.
+        """
+        data = self.encode(rendition, version, frame)
+        with rendition.lock:
+            if rendition.event_version < version:
+                message = json.dumps({"sequence": version, "metadata": metadata,
+                                      "jpeg": base64.b64encode(data).decode("ascii")}, separators=(",", ":"))
+                rendition.event = f"id: {version}\nevent: frame\ndata: {message}\n\n".encode()
+                rendition.event_version = version
+            return rendition.event
+
+    def stats(self) -> dict:
+        return {name: rendition.snapshot() for name, rendition in self.renditions.items()}
+
+
+class BroadcastProducer(threading.Thread):
+    """
+    Runs a frame source once for all viewers: everything make_frames() yields (JPEG bytes
+    for a FrameBroadcaster, annotated frames for a RenditionBroadcaster) is published;
+    a yielded (frame, metadata) tuple publishes the metadata with the frame.
+    make_frames is called again if its generator ends or fails, so a source that drops
+    out is reopened rather than silently going dark.
+    """
+    def __init__(self, name: str, make_frames, broadcaster: FrameBroadcaster = None, restart_seconds: float = 1.0):
+        super().__init__(name=f"{name}-producer", daemon=True)
+        self.make_frames = make_frames
+        self.broadcaster = broadcaster or FrameBroadcaster()
+        self.restart_seconds = restart_seconds
+        self.produced = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            frames = self.make_frames()
+            try:
+                for frame in frames:
+                    if self._stop_event.is_set():
+                        break
+                    if frame is None:
+                        continue
+                    if isinstance(frame, tuple):
+                        self.broadcaster.publish(*frame)
+                    else:
+                        self.broadcaster.publish(frame)
+                    self.produced += 1
+            except Exception as e:
+                print(f"Error in {self.name}: {e}")
+            finally:
+                close = getattr(frames, "close", None)
+                if close is not None:
+                    close()
+            self._stop_event.wait(self.restart_seconds)
+
+
+def mjpeg_stream(broadcaster):
+    """multipart/x-mixed-replace body that sends every new frame of a FrameBroadcaster or RenditionView"""
+    with broadcaster.subscription():
+        version = 0
+        while True:
+            version, frame_bytes = broadcaster.wait(version)
+            if frame_bytes is None:
+                continue
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+
+
+def sse_stream(view: RenditionView, keepalive_seconds: float = 15.0):
+    """text/event-stream body that pushes every new frame of a RenditionView, with its metadata"""
+    with view.subscription():
+        version = 0
+        while True:
+            version, event = view.wait_event(version, keepalive_seconds)
+            # A comment line now and then lets the client (and any proxy) see the stream is alive
+            yield event if event is not None else b": keepalive\n\n"
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+
+from mask import mask
+from vehicle_class import SCALING_FACTOR, scale_coordinates
+
+CALIBRATION_METHODS = ("homography", "grid")
+CALIBRATION_GRID_STEP = 4  # pixels between the nodes the grid method samples the road plane at
+# Profile fields that may be left out; region_points, source_points and target_points are required
+PROFILE_DEFAULTS = {
+    "source_resolution": None,  # [width, height] the source points were picked at (None: the frame size)
+    "scaling_factor": SCALING_FACTOR,  # road-plane units per second -> km/h
+    "speed_limit": 120,
+    "fine_speed_limit": None,  # None: speed_limit + 10
+    "segments": [],  # extra {"source", "target", "polygon"} segments, see RoadPlaneMap
+    "method": "homography",
+}
+
+
+def calibration_path(path: str) -> str:
+    """Where the cache CameraCalibration builds from a profile file is kept: x.json -> x.calibration.npz"""
+    return os.path.splitext(path)[0] + ".calibration.npz"
+
+
+class RoadPlaneMap:
+    """
+    Pixel -> road-plane mapping for a camera calibrated in one or more segments; a drop-in
+    for ViewTransformer.transform_points.
+
+    Each segment is a (source, target) homography, optionally limited to an image polygon
+    (a lane, or a stretch of road calibrated on its own). A per-pixel uint8 label map says
+    which segment a pixel belongs to (the first one wherever no polygon claims it), so a
+    batch of points finds its segments with one fancy-indexed lookup. Then:
+
+    - "homography" maps each segment's points with its exact homography in one
+      cv2.perspectiveTransform call (one segment skips the label lookup altogether);
+    - "grid" interpolates bilinearly between the nodes of a float32 grid of road-plane
+      coordinates sampled every step pixels, per segment, for calibrations that are
+      measured rather than derived from a single homography.
+
+    The grid ends at the frame, so there out-of-frame points fall back to the exact
+    homography of the first segment. Segment targets must share one road coordinate
+    system, so speeds stay continuous across segment borders. CameraCalibration caches the
+    label map and grid with the camera's profile (see calibration_path), keyed by the
+    profile they were built from.
+    """
+    def __init__(self, segments: list, image_width: int = 1280, image_height: int = 720,
+                 method: str = "homography", step: int = CALIBRATION_GRID_STEP, grid: np.ndarray = None,
+                 labels: np.ndarray = None):
+        if method not in CALIBRATION_METHODS:
+            raise ValueError(f"Unknown calibration method {method!r}, expected one of {CALIBRATION_METHODS}")
+        self.segments = [{"source": np.asarray(segment["source"], dtype=np.float32),
+                          "target": np.asarray(segment["target"], dtype=np.float32),
+                          "polygon": segment.get("polygon")} for segment in segments]
+        self.image_width = image_width
+        self.image_height = image_height
+        self.method = method
+        self.step = step
+        self.matrices = [cv2.getPerspectiveTransform(segment["source"], segment["target"])
+                         for segment in self.segments]
+        self.grid = grid if grid is not None else self._sample_grid()
+        self.labels = labels if labels is not None else self._label_pixels()
+
+    @classmethod
+    def single(cls, source_points: np.ndarray, target_points: np.ndarray, image_width: int = 1280,
+               image_height: int = 720, **kwargs):
+        """Map of a camera calibrated with one homography, as a profile's source_points/target_points"""
+        return cls([{"source": source_points, "target": target_points}], image_width, image_height, **kwargs)
+
+    def _sample_grid(self) -> np.ndarray:
+        # Nodes every step pixels, plus one past the last pixel so every pixel has four neighbours
+        xs = np.arange(0, self.image_width + self.step, self.step, dtype=np.float32)
+        ys = np.arange(0, self.image_height + self.step, self.step, dtype=np.float32)
+        nodes = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 1, 2)
+        return np.stack([cv2.perspectiveTransform(nodes, matrix).reshape(len(ys), len(xs), 2)
+                         for matrix in self.matrices])
+
+    def _label_pixels(self) -> np.ndarray:
+        labels = np.zeros((self.image_height, self.image_width), dtype=np.uint8)
+        for index, segment in enumerate(self.segments[1:], start=1):
+            if segment["polygon"] is not None:
+                polygon = np.array(segment["polygon"], dtype=np.int32).reshape((-1, 1, 2))
+                cv2.fillPoly(labels, [polygon], color=index)
+        return labels
+
+    def segment_of(self, points: np.ndarray) -> np.ndarray:
+        """Segment index of each (x, y) point; out-of-frame points take that of the nearest pixel"""
+        x = np.clip(points[:, 0], 0, self.image_width - 1).astype(np.intp)
+        y = np.clip(points[:, 1], 0, self.image_height - 1).astype(np.intp)
+        return self.labels[y, x]
+
+    def exact(self, points: np.ndarray, labels: np.ndarray = None) -> np.ndarray:
+        """Each point through its segment's homography (all through the first without labels)"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if labels is None or len(self.matrices) == 1:
+            return cv2.perspectiveTransform(points.reshape(-1, 1, 2), self.matrices[0]).reshape(-1, 2)
+        mapped = np.empty_like(points)
+        for index in range(len(self.matrices)):
+            chosen = labels == index
+            if not chosen.any():
+                continue
+            mapped[chosen] = cv2.perspectiveTransform(points[chosen].reshape(-1, 1, 2),
+                                                      self.matrices[index]).reshape(-1, 2)
+        return mapped
+
+    def interpolate(self, points: np.ndarray, labels: np.ndarray) -> np.ndarray:
+        """Bilinear interpolation in each point's segment grid; points are clipped into the frame"""
+        x = np.clip(points[:, 0], 0, self.image_width - 1)
+        y = np.clip(points[:, 1], 0, self.image_height - 1)
+        gx = (x // self.step).astype(np.intp)
+        gy = (y // self.step).astype(np.intp)
+        fx = ((x - gx * self.step) / self.step)[:, None]
+        fy = ((y - gy * self.step) / self.step)[:, None]
+        # Flat index of the top-left node; the other three are one column and/or one row on
+        _, rows, columns, _ = self.grid.shape
+        nodes = self.grid.reshape(-1, 2)
+        top_left = (labels.astype(np.intp) * rows + gy) * columns + gx
+        top = nodes[top_left] * (1 - fx) + nodes[top_left + 1] * fx
+        bottom = nodes[top_left + columns] * (1 - fx) + nodes[top_left + columns + 1] * fx
+        return (top * (1 - fy) + bottom * fy).astype(np.float32)
+
+    def transform_points(self, points: np.ndarray) -> np.ndarray:
+        if points.size == 0:
+            return points
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if self.method == "homography" and len(self.matrices) == 1:
+            return self.exact(points)
+        labels = self.segment_of(points)
+        if self.method == "homography":
+            return self.exact(points, labels)
+        mapped = self.interpolate(points, labels)
+        out_of_frame = (points[:, 0] < 0) | (points[:, 0] > self.image_width - 1) | \
+                       (points[:, 1] < 0) | (points[:, 1] > self.image_height - 1)
+        if out_of_frame.any():
+            mapped[out_of_frame] = self.exact(points[out_of_frame])
+        return mapped
+
+
+def load_profile(path: str) -> dict:
+    """
+    A camera's calibration profile (JSON): region polygon, source/target points, scale and
+    speed limits, with PROFILE_DEFAULTS filled in. region_points may be the polygon itself
+    or the path of a region_points.json file.
+    """
+    with open(path, "r") as f:
+        profile = dict(PROFILE_DEFAULTS, **json.load(f))
+    missing = [field for field in ("region_points", "source_points", "target_points") if field not in profile]
+    if missing:
+        raise ValueError(f"Calibration profile {path} is missing {', '.join(missing)}")
+    if isinstance(profile["region_points"], str):
+        with open(profile["region_points"], "r") as f:
+            profile["region_points"] = json.load(f)
+    if profile["fine_speed_limit"] is None:
+        profile["fine_speed_limit"] = profile["speed_limit"] + 10
+    return profile
+
+
+class CameraCalibration:
+    """
+    A calibration profile compiled for one frame size: the region mask, the road-plane map
+    and the figures TrafficProcessor and VehicleStore need. The mask and the map's arrays
+    are cached in one .npz next to the profile (see calibration_path), keyed by the profile
+    and frame size, so a restart only reads them back.
+    """
+    def __init__(self, profile: dict, image_width: int = 1280, image_height: int = 720, cache_path: str = None):
+        self.profile = profile
+        self.image_width = image_width
+        self.image_height = image_height
+        self.region_points = profile["region_points"]
+        self.speed_limit = profile["speed_limit"]
+        self.fine_speed_limit = profile["fine_speed_limit"]
+        self.scaling_factor = profile["scaling_factor"]
+        segments = [{"source": profile["source_points"], "target": profile["target_points"]}] + profile["segments"]
+        if profile["source_resolution"] is not None:
+            width, height = profile["source_resolution"]
+            segments = [dict(segment, source=scale_coordinates(segment["source"], width, height, image_width,
+                                                               image_height),
+                             polygon=scale_coordinates(segment["polygon"], width, height, image_width,
+                                                       image_height).tolist()
+                             if segment.get("polygon") is not None else None)
+                        for segment in segments]
+        self.source_points = np.asarray(segments[0]["source"])
+        self.target_points = np.asarray(segments[0]["target"])
+
+        key = hashlib.sha1(json.dumps([profile, image_width, image_height, CALIBRATION_GRID_STEP], sort_keys=True,
+                                      default=lambda value: np.asarray(value).tolist()).encode()).hexdigest()
+        cached = self._load_cache(cache_path, key) if cache_path else None
+        if cached is not None:
+            self.cache_hit = True
+            self.region_mask = mask(image_width, image_height, self.region_points, cached["region_mask"])
+            self.road_plane_map = RoadPlaneMap(segments, image_width, image_height, profile["method"],
+                                               grid=cached["grid"], labels=cached["labels"])
+            return
+        self.cache_hit = False
+        self.region_mask = mask(image_width, image_height, self.region_points)
+        self.road_plane_map = RoadPlaneMap(segments, image_width, image_height, profile["method"])
+        if cache_path:
+            np.savez(cache_path, key=key, region_mask=self.region_mask.populated_mask, grid=self.road_plane_map.grid,
+                     labels=self.road_plane_map.labels)
+
+    @classmethod
+    def load(cls, path: str, image_width: int = 1280, image_height: int = 720):
+        """The profile at path, compiled through its cache file"""
+        return cls(load_profile(path), image_width, image_height, calibration_path(path))
+
+    @staticmethod
+    def _load_cache(path: str, key: str):
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as saved:
+                if str(saved["key"]) == key:
+                    return {name: saved[name] for name in ("region_mask", "grid", "labels")}
+        except (OSError, ValueError, KeyError) as error:
+            print(f"Warning: ignoring unreadable calibration cache {path}: {error}")
+        return None
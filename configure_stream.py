@@ -76,10 +76,21 @@ class region_class:
         
         return self.points
 
-cap = cv2.VideoCapture(r"demo_videos\video_0.mp4")
 
-ret, image = cap.read()
-image = cv2.resize(image, (1280, 720))
+def main(path_to_video: str = r"demo_videos\video_0.mp4"):
+    """Pick labelled points on the first frame of a video (saved as coordinate_<label>.json)"""
+    cap = cv2.VideoCapture(path_to_video)
+    ret, image = cap.read()
+    cap.release()
+    if not ret:
+        print(f"Error: Could not read {path_to_video}")
+        return None
+    image = cv2.resize(image, (1280, 720))
 
-region_drawer = region_class(image)
-region_points = region_drawer.get_image_coordinates()
\ No newline at end of file
+    region_drawer = region_class(image)
+    return region_drawer.get_image_coordinates()
+
+
+# Importing this module (e.g. for region_class) must not open a video or wait for input
+if __name__ == "__main__":
+    main()
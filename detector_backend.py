@@ -0,0 +1,300 @@
+import importlib.util
+import os
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+from box_batch import Detections, DetectionsResult
+
+DETECTOR_BACKENDS = ("auto", "pytorch", "onnx", "openvino")
+DEFAULT_INPUT_SIZE = (384, 640)  # (height, width): a 16:9 frame letterboxed to 640 wide, rounded up to stride 32
+LETTERBOX_COLOUR = (114, 114, 114)
+
+
+def detect_device() -> str:
+    """cuda:0 if PyTorch sees a GPU, else mps on Apple silicon, else cpu"""
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda:0"
+    mps = getattr(torch.backends, "mps", None)
+    if mps is not None and mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def resolve_backend(backend: str, device: str) -> str:
+    """
+    The backend "auto" stands for: PyTorch on a GPU, and on a CPU OpenVINO if it is installed,
+    else ONNX Runtime, else PyTorch.
+    """
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend {backend!r}, expected one of {DETECTOR_BACKENDS}")
+    if backend != "auto":
+        return backend
+    if device != "cpu":
+        return "pytorch"
+    if importlib.util.find_spec("openvino") is not None:
+        return "openvino"
+    if importlib.util.find_spec("onnxruntime") is not None:
+        return "onnx"
+    return "pytorch"
+
+
+def export_model(model_name: str, backend: str, input_size: tuple = DEFAULT_INPUT_SIZE, int8: bool = False,
+                 cache_dir: str = "models") -> str:
+    """
+    Path of model_name exported for backend with a fixed input_size, exporting it on first use.
+
+    Exports are cached in cache_dir under a name holding the input size and precision
+    (e.g. models/yolov8n_384x640.onnx, models/yolov8n_384x640_int8_openvino_model), and are
+    redone if the .pt weights are newer than the export. INT8 ONNX models are dynamically
+    quantized with onnxruntime; INT8 OpenVINO models are calibrated by the ultralytics export.
+    """
+    if backend not in ("onnx", "openvino"):
+        raise ValueError(f"Only onnx and openvino models are exported, not {backend!r}")
+    height, width = input_size
+    stem = os.path.splitext(os.path.basename(model_name))[0]
+    name = f"{stem}_{height}x{width}" + ("_int8" if int8 else "")
+    path = os.path.join(cache_dir, name + (".onnx" if backend == "onnx" else "_openvino_model"))
+    if os.path.exists(path) and not (os.path.exists(model_name) and
+                                     os.path.getmtime(model_name) > os.path.getmtime(path)):
+        return path
+
+    from ultralytics import YOLO
+
+    os.makedirs(cache_dir, exist_ok=True)
+    if backend == "onnx":
+        exported = YOLO(model_name).export(format="onnx", imgsz=(height, width), dynamic=False, simplify=True)
+        if int8:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(exported, path, weight_type=QuantType.QUInt8)
+            return path
+    else:
+        exported = YOLO(model_name).export(format="openvino", imgsz=(height, width), dynamic=False, int8=int8)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    shutil.move(exported, path)
+    return path
+
+
+def letterbox(frame: np.ndarray, input_size: tuple):
+    """(1, 3, H, W) float32 RGB blob of frame scaled into input_size, and the (scale, pad x, pad y) to undo it"""
+    height, width = input_size
+    frame_height, frame_width = frame.shape[:2]
+    scale = min(height / frame_height, width / frame_width)
+    resized_width, resized_height = round(frame_width * scale), round(frame_height * scale)
+    pad_x, pad_y = (width - resized_width) // 2, (height - resized_height) // 2
+    image = cv2.resize(frame, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+    image = cv2.copyMakeBorder(image, pad_y, height - resized_height - pad_y, pad_x, width - resized_width - pad_x,
+                               cv2.BORDER_CONSTANT, value=LETTERBOX_COLOUR)
+    blob = cv2.dnn.blobFromImage(image, 1 / 255.0, swapRB=True)
+    return blob, (scale, pad_x, pad_y)
+
+
+def decode_yolo(output: np.ndarray, transform: tuple, frame_shape: tuple, conf: float = 0.25, iou: float = 0.7,
+                classes=None, max_det: int = 300) -> Detections:
+    """
+    Detections in frame coordinates from one raw YOLOv8 output (4 + classes, anchors):
+    confidence filter, per-class NMS, then the letterbox undone.
+    """
+    predictions = output.reshape(output.shape[-2], output.shape[-1]).T
+    scores = predictions[:, 4:]
+    class_ids = scores.argmax(axis=1)
+    confs = scores[np.arange(len(scores)), class_ids]
+    keep = confs >= conf
+    if classes is not None:
+        keep &= np.isin(class_ids, classes)
+    boxes, confs, class_ids = predictions[keep, :4], confs[keep], class_ids[keep]
+    if len(boxes) == 0:
+        return Detections(np.empty((0, 4)), np.empty(0), np.empty(0))
+
+    xywh = boxes.copy()
+    xywh[:, :2] -= boxes[:, 2:] / 2
+    keep = np.array(cv2.dnn.NMSBoxesBatched(xywh.tolist(), confs.tolist(), class_ids.tolist(), conf, iou),
+                    dtype=np.int64).reshape(-1)[:max_det]
+    xyxy = np.concatenate([xywh[keep, :2], xywh[keep, :2] + xywh[keep, 2:]], axis=1)
+
+    scale, pad_x, pad_y = transform
+    xyxy = (xyxy - np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)) / scale
+    xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, frame_shape[1])
+    xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, frame_shape[0])
+    return Detections(xyxy, confs[keep], class_ids[keep])
+
+
+class ExportedModel(ABC):
+    """
+    A YOLO model exported with a fixed input size, with the predict()/track() calls of an
+    ultralytics YOLO model: predict(frames) returns one result per frame, track(frame)
+    runs ByteTrack on the detections (persist=True keeps the tracks across calls).
+    Subclasses run the network: infer(blob) returns the raw (1, 4 + classes, anchors) output.
+    """
+    def __init__(self, path: str, input_size: tuple = DEFAULT_INPUT_SIZE):
+        self.path = path
+        self.input_size = tuple(input_size)
+        self.tracker = None
+        self.tracker_config = None
+        # One inference at a time per session, like the shared YOLO model
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def infer(self, blob: np.ndarray) -> np.ndarray:
+        """Raw (1, 4 + classes, anchors) network output for a letterboxed blob"""
+
+    def predict(self, source, conf: float = 0.25, iou: float = 0.7, classes=None, max_det: int = 300, **kwargs):
+        frames = source if isinstance(source, (list, tuple)) else [source]
+        results = []
+        for frame in frames:
+            blob, transform = letterbox(frame, self.input_size)
+            with self.lock:
+                output = self.infer(blob)
+            results.append(DetectionsResult(decode_yolo(output, transform, frame.shape, conf, iou, classes, max_det)))
+        return results
+
+    __call__ = predict
+
+    def track(self, source, persist: bool = False, tracker: str = "bytetrack.yaml", **kwargs):
+        from multi_camera import ByteTrackTracker
+
+        if self.tracker is None or not persist or tracker != self.tracker_config:
+            self.tracker = ByteTrackTracker(tracker)
+            self.tracker_config = tracker
+        results = []
+        for frame, result in zip(source if isinstance(source, (list, tuple)) else [source],
+                                 self.predict(source, **kwargs)):
+            xyxy, tracker_ids, confs = self.tracker.update(result, frame)
+            results.append(DetectionsResult(Detections(xyxy, confs, np.zeros(len(confs)), tracker_ids)))
+        return results
+
+
+class OnnxModel(ExportedModel):
+    """ONNX Runtime session; threads sets its intra-op thread count (None: one per core)"""
+    def __init__(self, path: str, input_size: tuple = DEFAULT_INPUT_SIZE, threads: int = None, device: str = "cpu"):
+        import onnxruntime
+
+        super().__init__(path, input_size)
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        providers = ["CPUExecutionProvider"]
+        if device.startswith("cuda") and "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = onnxruntime.InferenceSession(path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def infer(self, blob: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVinoModel(ExportedModel):
+    """OpenVINO model compiled for latency on one device; threads caps its inference threads"""
+    def __init__(self, path: str, input_size: tuple = DEFAULT_INPUT_SIZE, threads: int = None, device: str = "cpu"):
+        import openvino as ov
+
+        super().__init__(path, input_size)
+        core = ov.Core()
+        xml = next(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".xml"))
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = core.compile_model(core.read_model(xml), "GPU" if device.startswith("cuda") else "CPU", config)
+        self.request = self.compiled.create_infer_request()
+
+    def infer(self, blob: np.ndarray) -> np.ndarray:
+        self.request.infer({0: blob})
+        return self.request.get_output_tensor(0).data.copy()
+
+
+class UltralyticsModel:
+    """
+    A PyTorch YOLO model that passes its device and input size to every predict()/track()
+    call, so callers no longer name a device.
+    """
+    def __init__(self, model_name: str, device: str, input_size: tuple = None, threads: int = None):
+        from ultralytics import YOLO
+
+        if threads and device == "cpu":
+            import torch
+            torch.set_num_threads(threads)
+        self.model = YOLO(model_name)
+        self.device = device
+        self.defaults = {"device": device}
+        if input_size is not None:
+            self.defaults["imgsz"] = tuple(input_size)
+
+    def predict(self, source, **kwargs):
+        return self.model.predict(source, **{**self.defaults, **kwargs})
+
+    __call__ = predict
+
+    def track(self, source, **kwargs):
+        return self.model.track(source, **{**self.defaults, **kwargs})
+
+
+def load_detector(model_name: str, backend: str = "auto", device: str = None, input_size: tuple = DEFAULT_INPUT_SIZE,
+                  threads: int = None, int8: bool = False, cache_dir: str = "models"):
+    """
+    A detector with the predict()/track() calls of an ultralytics YOLO model, on the best
+    device available (device=None) and the configured backend. ONNX and OpenVINO models are
+    exported once into cache_dir; threads caps the CPU threads inference may use.
+    """
+    device = device or detect_device()
+    backend = resolve_backend(backend, device)
+    if backend == "pytorch":
+        model = UltralyticsModel(model_name, device, input_size, threads)
+    else:
+        path = export_model(model_name, backend, input_size, int8, cache_dir)
+        model_class = OnnxModel if backend == "onnx" else OpenVinoModel
+        model = model_class(path, input_size, threads, device)
+    model.backend = backend
+    model.device = device
+    return model
+
+
+class LazyDetector:
+    """
+    load_detector on a background thread, started right away, so the weights load while
+    the capture, calibration and pipeline are set up. The first predict()/track() (or any
+    other attribute) waits for the model; load_seconds and waited_seconds tell how long
+    loading took and how much of it the caller actually waited for.
+    """
+    def __init__(self, *args, loader=load_detector, **kwargs):
+        self._model = None
+        self._error = None
+        self.load_seconds = None
+        self.waited_seconds = 0.0
+        self._thread = threading.Thread(target=self._load, args=(loader, args, kwargs), name="detector-load",
+                                        daemon=True)
+        self._thread.start()
+
+    def _load(self, loader, args, kwargs):
+        start = time.perf_counter()
+        try:
+            self._model = loader(*args, **kwargs)
+        except Exception as error:
+            self._error = error
+        self.load_seconds = time.perf_counter() - start
+
+    def get(self):
+        """The loaded model, waiting for it if needed; re-raises a load error"""
+        if self._thread.is_alive():
+            start = time.perf_counter()
+            self._thread.join()
+            self.waited_seconds += time.perf_counter() - start
+        if self._error is not None:
+            raise self._error
+        return self._model
+
+    def __getattr__(self, name):
+        # Only reached for attributes LazyDetector itself does not have
+        return getattr(self.get(), name)
@@ -0,0 +1,266 @@
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+EVENT_TYPES = ("track_start", "speed", "violation", "track_end")
+EVENT_SINKS = ("jsonl", "sqlite", "parquet")
+_parquet_files = itertools.count()  # tells apart the Parquet files one process opens within a second
+# Columns every event has; anything else goes into its "data" dict
+EVENT_FIELDS = ("wall_time", "time_stamp", "camera", "type", "tracker_id", "speed")
+
+
+def make_event(event_type: str, time_stamp: float, tracker_id: int, speed: float = None, camera: int = None,
+               **data) -> dict:
+    """An event row: when (stream and wall time), where (camera), what (type, track, speed) and extra data"""
+    return {"wall_time": time.time(), "time_stamp": float(time_stamp), "camera": camera, "type": event_type,
+            "tracker_id": int(tracker_id), "speed": None if speed is None else float(speed), "data": data}
+
+
+class JsonlSink:
+    """One JSON object per line, appended to path"""
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, events: list):
+        self._file.write("".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class SqliteSink:
+    """
+    An events table in a SQLite database in WAL mode, so queries can read while the log
+    writes. Indexed by (type, wall_time) and (type, time_stamp) for time-range queries.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            wall_time REAL NOT NULL,
+            time_stamp REAL NOT NULL,
+            camera INTEGER,
+            type TEXT NOT NULL,
+            tracker_id INTEGER NOT NULL,
+            speed REAL,
+            data TEXT
+        );
+        CREATE INDEX IF NOT EXISTS events_type_wall_time ON events (type, wall_time);
+        CREATE INDEX IF NOT EXISTS events_type_time_stamp ON events (type, time_stamp);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = None
+
+    def open(self):
+        # Opened on the writer thread, which is the only one that uses this connection
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(self.SCHEMA)
+
+    def write(self, events: list):
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO events (wall_time, time_stamp, camera, type, tracker_id, speed, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(event["wall_time"], event["time_stamp"], event["camera"], event["type"], event["tracker_id"],
+                  event["speed"], json.dumps(event["data"], separators=(",", ":"))) for event in events])
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+
+
+class ParquetSink:
+    """
+    Parquet file written with pyarrow, one row group per batch. A Parquet file is only
+    readable once closed, so every log opens a new file named after its start time, its
+    process and a per-process count, so that logs opened at once (the server and a
+    worker process, or two workers) never write to the same file.
+    """
+    def __init__(self, directory: str):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.directory = directory
+        self.path = os.path.join(directory, f"events-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                            f"{next(_parquet_files)}.parquet")
+        self.schema = pa.schema([("wall_time", pa.float64()), ("time_stamp", pa.float64()), ("camera", pa.int32()),
+                                 ("type", pa.string()), ("tracker_id", pa.int64()), ("speed", pa.float64()),
+                                 ("data", pa.string())])
+        self._writer = None
+
+    def open(self):
+        import pyarrow.parquet as pq
+
+        self._writer = pq.ParquetWriter(self.path, self.schema)
+
+    def write(self, events: list):
+        columns = {field: [event[field] for event in events] for field in EVENT_FIELDS}
+        columns["data"] = [json.dumps(event["data"], separators=(",", ":")) for event in events]
+        self._writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class EventLog:
+    """
+    Append-only stream of track events, written to one or more sinks on a background thread.
+
+    emit() only puts the event on a bounded queue, so the capture loop never waits for
+    the disk; when max_pending events are already waiting the event is dropped and
+    counted. The writer thread takes up to batch_size events at a time and writes each
+    batch to every sink in one go, at least every flush_seconds. close() writes what is
+    left and closes the sinks.
+
+    stats() counts an event as written once every sink has it; events of a batch that any
+    sink failed on are counted as failed, and each sink's write errors under errors. The
+    per-sink written and failed counts are under sinks, keyed by each sink's path.
+    """
+    def __init__(self, sinks: list, max_pending: int = 10000, batch_size: int = 500, flush_seconds: float = 1.0):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._stats = {"emitted": 0, "dropped": 0, "written": 0, "batches": 0, "failed": 0, "errors": 0,
+                       "write_seconds": 0.0}
+        self._sink_stats = {sink.path: {"written": 0, "failed": 0} for sink in sinks}
+        self._opened = threading.Event()
+        self._open_error = None
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+        self._opened.wait()
+        if self._open_error is not None:
+            raise self._open_error
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sinks"] = {name: dict(counts) for name, counts in self._sink_stats.items()}
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    def emit(self, event: dict) -> bool:
+        """Queue one event (see make_event); False if it was dropped because the writer is backed up"""
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._count(dropped=1)
+            return False
+        self._count(emitted=1)
+        return True
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        try:
+            for sink in self.sinks:
+                sink.open()
+        except Exception as error:
+            self._open_error = error
+            self._opened.set()
+            return
+        self._opened.set()
+        closing = False
+        while not closing:
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    event = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if event is None:
+                    closing = True
+                    break
+                batch.append(event)
+            if batch:
+                self._write(batch)
+        for sink in self.sinks:
+            sink.close()
+
+    def _write(self, batch: list):
+        start = time.perf_counter()
+        errors = 0
+        for sink in self.sinks:
+            try:
+                sink.write(batch)
+            except Exception as error:
+                print(f"Error: event log {sink.path} failed to write {len(batch)} events: {error}")
+                errors += 1
+                outcome = "failed"
+            else:
+                outcome = "written"
+            with self._lock:
+                self._sink_stats[sink.path][outcome] += len(batch)
+        if errors:
+            self._count(failed=len(batch), errors=errors, batches=1, write_seconds=time.perf_counter() - start)
+        else:
+            self._count(written=len(batch), batches=1, write_seconds=time.perf_counter() - start)
+
+
+def open_event_log(directory: str = "events", formats=("jsonl", "sqlite"), **kwargs) -> EventLog:
+    """EventLog writing events.jsonl, events.sqlite and/or events-<start>-<pid>-<n>.parquet in directory"""
+    os.makedirs(directory, exist_ok=True)
+    sinks = []
+    for name in formats:
+        if name == "jsonl":
+            sinks.append(JsonlSink(os.path.join(directory, "events.jsonl")))
+        elif name == "sqlite":
+            sinks.append(SqliteSink(os.path.join(directory, "events.sqlite")))
+        elif name == "parquet":
+            sinks.append(ParquetSink(directory))
+        else:
+            raise ValueError(f"Unknown event sink {name!r}, expected one of {EVENT_SINKS}")
+    return EventLog(sinks, **kwargs)
+
+
+def query_events(database: str, event_type: str = None, min_speed: float = None, start: float = None,
+                 end: float = None, camera: int = None, by: str = "wall_time", limit: int = None) -> list:
+    """
+    Events from an events.sqlite database, oldest first, e.g. every violation over 130 km/h
+    between two times: query_events("events/events.sqlite", "violation", 130, t1, t2).
+    start and end are compared with wall_time (Unix time) or, with by="time_stamp", stream time.
+    """
+    if by not in ("wall_time", "time_stamp"):
+        raise ValueError(f"Events are queried by wall_time or time_stamp, not {by!r}")
+    conditions, parameters = [], []
+    for condition, value in (("type = ?", event_type), ("speed > ?", min_speed), (f"{by} >= ?", start),
+                             (f"{by} < ?", end), ("camera = ?", camera)):
+        if value is not None:
+            conditions.append(condition)
+            parameters.append(value)
+    sql = "SELECT wall_time, time_stamp, camera, type, tracker_id, speed, data FROM events"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {by}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        parameters.append(limit)
+    connection = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    try:
+        rows = connection.execute(sql, parameters).fetchall()
+    finally:
+        connection.close()
+    return [dict(zip(EVENT_FIELDS, row[:6]), data=json.loads(row[6]) if row[6] else {}) for row in rows]
@@ -0,0 +1,103 @@
+import numpy as np
+
+
+class FrameRingBuffer:
+    """
+    Fixed (size, height, width, 3) uint8 ring of the most recent frames, allocated once.
+
+    Each frame is written exactly once at the write cursor together with its time
+    stamp and frame number; memory is size * height * width * 3 bytes
+    (100 x 1280x720 frames = ~276 MB) and the steady state allocates nothing.
+    Lookups hand out views into the ring, so they are only valid until the slot
+    is overwritten `size` frames later.
+    """
+    def __init__(self, size: int = 100, image_width: int = 1280, image_height: int = 720):
+        self.size = size
+        self.frames = np.zeros((size, image_height, image_width, 3), dtype=np.uint8)
+        self.time_stamps = np.full(size, np.nan, dtype=np.float64)
+        self.frame_numbers = np.full(size, -1, dtype=np.int64)
+        self.cursor = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self) -> int:
+        return self.frames.nbytes
+
+    def next_slot(self) -> np.ndarray:
+        """View of the slot the next frame goes into, so a frame can be rendered straight into the ring"""
+        # Invalidate the slot while it is being written so readers on other threads can detect it
+        self.frame_numbers[self.cursor] = -1
+        self.time_stamps[self.cursor] = np.nan
+        return self.frames[self.cursor]
+
+    def commit(self, time_stamp: float, frame_number: int) -> int:
+        """Mark the slot returned by next_slot as written; returns its index"""
+        slot = self.cursor
+        self.time_stamps[slot] = time_stamp
+        self.frame_numbers[slot] = frame_number
+        self.cursor = (slot + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        return slot
+
+    def write(self, frame: np.ndarray, time_stamp: float, frame_number: int) -> int:
+        """Copy a frame into the next slot; returns its index"""
+        np.copyto(self.next_slot(), frame)
+        return self.commit(time_stamp, frame_number)
+
+    def latest(self):
+        """View of the most recently written frame, or None if nothing was written yet"""
+        if self.count == 0:
+            return None
+        return self.frames[(self.cursor - 1) % self.size]
+
+    def _ordered_slots(self) -> np.ndarray:
+        """Written slot indices, oldest first"""
+        return (np.arange(self.cursor - self.count, self.cursor)) % self.size
+
+    def slot_for_time(self, time_stamp: float):
+        """Slot holding the frame closest to time_stamp, or None if the ring is empty"""
+        if self.count == 0:
+            return None
+        slots = self._ordered_slots()
+        return int(slots[np.argmin(np.abs(self.time_stamps[slots] - time_stamp))])
+
+    def slots_between(self, start_time: float = None, end_time: float = None) -> np.ndarray:
+        """Slot indices with start_time <= time stamp <= end_time (default: everything in the ring), oldest first"""
+        slots = self._ordered_slots()
+        times = self.time_stamps[slots]
+        keep = np.ones(len(slots), dtype=bool)
+        if start_time is not None:
+            keep &= times >= start_time
+        if end_time is not None:
+            keep &= times <= end_time
+        return slots[keep]
+
+    def clip(self, start_time: float = None, end_time: float = None):
+        """
+        (slots, frame numbers, time stamps) of the frames between start_time and end_time, oldest
+        first: a clip pinned now, whose slots can be read later while they still hold those frames
+        (see read_slot).
+        """
+        slots = self.slots_between(start_time, end_time)
+        return slots, self.frame_numbers[slots], self.time_stamps[slots]
+
+    def snapshot(self, start_time: float = None, end_time: float = None):
+        """
+        Frames between start_time and end_time (default: everything in the ring), oldest first.
+        Returns (frames, time_stamps, frame_numbers) where frames is a list of views into the ring.
+        """
+        slots = self.slots_between(start_time, end_time)
+        return [self.frames[slot] for slot in slots.tolist()], self.time_stamps[slots], self.frame_numbers[slots]
+
+    def read_slot(self, slot: int, frame_number: int, out: np.ndarray) -> bool:
+        """
+        Copy a slot into `out` if it still holds frame_number; False if it was overwritten
+        meanwhile (safe to call from another thread while the ring keeps being written).
+        """
+        if self.frame_numbers[slot] != frame_number:
+            return False
+        np.copyto(out, self.frames[slot])
+        return self.frame_numbers[slot] == frame_number
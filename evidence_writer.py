@@ -0,0 +1,184 @@
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from metrics import stage_timer
+
+EVIDENCE_FORMATS = ("jpg", "mp4")
+
+
+class EvidenceWriter:
+    """
+    Writes violation clips from a FrameRingBuffer on a bounded pool of worker threads.
+
+    submit() only records which ring slots make up the clip, so the capture loop
+    never encodes or touches the disk. Workers copy the slots out of the ring,
+    encode them as a JPEG sequence or one MP4 per violation, write the files in one
+    go and add a violation.json sidecar with the speed, tracker id, timestamps and
+    frame numbers.
+
+    A clip that waited long enough for the ring to overwrite some of its slots is
+    written without those frames; its sidecar has "complete": false and lists them
+    under "missing_frame_numbers", and it is counted in clips_incomplete. With
+    copy_on_submit=True, submit() copies the clip's frames out of the ring instead,
+    so no queued clip can lose any, at the cost of that copy on the capture loop and
+    up to max_pending clips of frames held in memory.
+
+    When max_pending clips are already waiting, a submit is dropped and counted,
+    unless block=True, in which case the capture loop waits for a free place.
+    """
+    def __init__(self, root: str = "evidence", workers: int = 2, max_pending: int = 8, format: str = "jpg",
+                 fps: float = 25, jpeg_quality: int = 90, block: bool = False, copy_on_submit: bool = False):
+        if format not in EVIDENCE_FORMATS:
+            raise ValueError(f"Unknown evidence format {format!r}, expected one of {EVIDENCE_FORMATS}")
+        self.root = root
+        self.format = format
+        self.fps = fps
+        self.jpeg_quality = jpeg_quality
+        self.block = block
+        self.copy_on_submit = copy_on_submit
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._write_timer = stage_timer("evidence_write")
+        self._stats = {"submitted": 0, "dropped": 0, "written": 0, "failed": 0, "frames_written": 0,
+                       "frames_overwritten": 0, "clips_incomplete": 0, "bytes_written": 0, "encode_seconds": 0.0}
+        self._workers = [threading.Thread(target=self._run, name=f"evidence-writer-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def stats(self) -> dict:
+        """Counters since start, plus the number of clips waiting for a worker"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    def submit(self, tracker_id: int, speed: float, time_stamp: float, evidence_buffer,
+               start_time: float = None, end_time: float = None, extra: dict = None, clip: tuple = None) -> bool:
+        """
+        Queue the frames of evidence_buffer between start_time and end_time (default: the whole ring)
+        as one violation clip, or the clip evidence_buffer.clip() pinned earlier (e.g. when the
+        violation happened). Returns False if the clip was dropped because the workers are backed up.
+        """
+        slots, frame_numbers, time_stamps = clip if clip is not None else evidence_buffer.clip(start_time, end_time)
+        job = {
+            "tracker_id": int(tracker_id),
+            "speed": float(speed),
+            "time_stamp": float(time_stamp),
+            "buffer": evidence_buffer,
+            "slots": slots,
+            "frame_numbers": frame_numbers,
+            "time_stamps": time_stamps,
+            "extra": extra or {},
+        }
+        if self.copy_on_submit:
+            # Fancy indexing copies, so these frames stay valid however far the ring moves on. A pinned
+            # clip's slots may already hold newer frames, or get them while being copied (as read_slot checks)
+            held = evidence_buffer.frame_numbers[slots] == frame_numbers
+            job["frames"] = evidence_buffer.frames[slots]
+            job["copied"] = held & (evidence_buffer.frame_numbers[slots] == frame_numbers)
+        self._count(submitted=1)
+        try:
+            self._queue.put(job, block=self.block)
+        except queue.Full:
+            self._count(dropped=1)
+            return False
+        return True
+
+    def close(self, timeout: float = None):
+        """Finish the queued clips and stop the workers"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _run(self):
+        scratch = None
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            frames = job["buffer"].frames
+            if scratch is None or scratch.shape != frames.shape[1:]:
+                scratch = np.empty(frames.shape[1:], dtype=np.uint8)
+            try:
+                with self._write_timer.time():
+                    self._write(job, scratch)
+            except Exception as e:
+                print(f"Error writing evidence for tracker {job['tracker_id']}: {e}")
+                self._count(failed=1)
+
+    def _write(self, job: dict, scratch: np.ndarray):
+        first_frame = int(job["frame_numbers"][0]) if len(job["frame_numbers"]) else 0
+        folder = os.path.join(self.root, str(job["tracker_id"]), f"{first_frame}_{job['speed']:.2f}")
+        os.makedirs(folder, exist_ok=True)
+
+        start = time.perf_counter()
+        written_frames = []
+        encoded = []
+        video = None
+        copied = job.get("frames")
+        for i, (slot, frame_number) in enumerate(zip(job["slots"].tolist(), job["frame_numbers"].tolist())):
+            if copied is not None and job["copied"][i]:
+                np.copyto(scratch, copied[i])
+            elif copied is not None or not job["buffer"].read_slot(slot, frame_number, scratch):
+                self._count(frames_overwritten=1)
+                continue
+            if self.format == "mp4":
+                if video is None:
+                    video = cv2.VideoWriter(os.path.join(folder, "clip.mp4"), cv2.VideoWriter_fourcc(*"mp4v"),
+                                            self.fps, (scratch.shape[1], scratch.shape[0]))
+                video.write(scratch)
+            else:
+                ret, buffer = cv2.imencode(".jpg", scratch, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                if not ret:
+                    continue
+                encoded.append((f"{frame_number}.jpg", buffer))
+            written_frames.append(frame_number)
+
+        # Encoding is done; write everything out in one burst
+        files = []
+        bytes_written = 0
+        if video is not None:
+            video.release()
+            files.append("clip.mp4")
+            bytes_written += os.path.getsize(os.path.join(folder, "clip.mp4"))
+        for name, buffer in encoded:
+            buffer.tofile(os.path.join(folder, name))
+            files.append(name)
+            bytes_written += buffer.nbytes
+
+        kept = np.isin(job["frame_numbers"], written_frames)
+        missing = job["frame_numbers"][~kept].tolist()
+        sidecar = {
+            "tracker_id": job["tracker_id"],
+            "speed": job["speed"],
+            "time_stamp": job["time_stamp"],
+            "frame_numbers": job["frame_numbers"][kept].tolist(),
+            "time_stamps": job["time_stamps"][kept].tolist(),
+            "complete": not missing,
+            "missing_frame_numbers": missing,
+            "format": self.format,
+            "files": files,
+            "written_at": time.time(),
+            **job["extra"],
+        }
+        with open(os.path.join(folder, "violation.json"), "w") as f:
+            json.dump(sidecar, f, indent=2)
+        if missing:
+            print(f"Evidence for tracker {job['tracker_id']} is missing {len(missing)} of "
+                  f"{len(job['frame_numbers'])} frames: the ring overwrote them before the clip was written")
+
+        self._count(written=1, frames_written=len(written_frames), clips_incomplete=int(bool(missing)),
+                    bytes_written=bytes_written, encode_seconds=time.perf_counter() - start)
@@ -0,0 +1,75 @@
+from flask import Response, request
+
+from broadcast import mjpeg_stream, sse_stream
+
+SNAPSHOT_MAX_WAIT = 10  # seconds a long-polling snapshot request (?wait=) may be held open
+
+
+def unknown_size(broadcaster):
+    """Error response if ?size= names no rendition, else None"""
+    size = request.args.get('size')
+    if size is not None and size not in broadcaster.renditions:
+        return f"Unknown size {size}, expected one of {', '.join(broadcaster.renditions)}", 400
+    return None
+
+
+def rendition_response(broadcaster):
+    """MJPEG response for the rendition picked with ?size= (full by default)"""
+    error = unknown_size(broadcaster)
+    if error is not None:
+        return error
+    return Response(mjpeg_stream(broadcaster.view(request.args.get('size'))),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+def push_headers(size=None, sequence=None):
+    """Headers of the snapshot and SSE responses: never cached, readable by the React app on its own origin"""
+    headers = {'Cache-Control': 'no-cache', 'Access-Control-Allow-Origin': '*',
+               'Access-Control-Expose-Headers': 'ETag, X-Frame-Sequence'}
+    if sequence is not None:
+        headers.update({'ETag': f'"{size}-{sequence}"', 'X-Frame-Sequence': str(sequence)})
+    return headers
+
+
+def etag_sequence(size):
+    """Sequence number of the frame the client's If-None-Match says it has, if it is of this size"""
+    tag = request.headers.get('If-None-Match', '').strip().removeprefix('W/').strip('"')
+    name, _, sequence = tag.rpartition('-')
+    return int(sequence) if name == size and sequence.isdigit() else None
+
+
+def snapshot_response(broadcaster):
+    """
+    The newest frame as a JPEG, its sequence number in X-Frame-Sequence and its ETag.
+    A client that has a frame already (?after=<sequence> or If-None-Match) gets 304 until
+    a newer one is published; with ?wait=<seconds> the request is held open until then
+    (up to SNAPSHOT_MAX_WAIT), so fetching frame after frame is a long poll, not a poll.
+    """
+    error = unknown_size(broadcaster)
+    if error is not None:
+        return error
+    size = request.args.get('size') or broadcaster.default
+    view = broadcaster.view(size)
+    after = request.args.get('after', type=int)
+    if after is None:
+        after = etag_sequence(size)
+    wait = min(request.args.get('wait', 0.0, type=float), SNAPSHOT_MAX_WAIT)
+    if after is not None and wait > 0:
+        version, frame = view.wait(after, wait)
+    else:
+        version, frame = view.latest()
+    if version == 0:
+        return "No frame available", 404
+    if frame is None or (after is not None and version <= after):
+        # Nothing newer than the frame the client has
+        return Response(status=304, headers=push_headers(size, after))
+    return Response(frame, mimetype='image/jpeg', headers=push_headers(size, version))
+
+
+def sse_response(broadcaster):
+    """Server-sent events pushing every frame of the ?size= rendition with its vehicles and speeds"""
+    error = unknown_size(broadcaster)
+    if error is not None:
+        return error
+    return Response(sse_stream(broadcaster.view(request.args.get('size'))), mimetype='text/event-stream',
+                    headers=dict(push_headers(), **{'X-Accel-Buffering': 'no'}))
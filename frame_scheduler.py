@@ -0,0 +1,162 @@
+import threading
+import time
+
+import cv2
+
+DEFAULT_FPS = 25
+# Frame rates outside this range are treated as "not reported" by the source
+PLAUSIBLE_FPS = (1, 240)
+
+
+class CaptureClock:
+    """
+    Capture time stamps (seconds of stream time) of the frames grabbed from a cv2.VideoCapture.
+
+    Uses the frame's PTS (CAP_PROP_POS_MSEC) when the source reports one that moves
+    forward, otherwise the previous time stamp plus one frame interval at the source
+    frame rate. rewind() keeps the clock running when a file is looped.
+    """
+    def __init__(self, cap: cv2.VideoCapture, fallback_fps: float = DEFAULT_FPS):
+        self.fallback_fps = fallback_fps
+        self.fps = self._source_fps(cap)
+        self.frames = 0
+        self.pts_frames = 0
+        self.time_stamp = None
+        self._pts_origin = None
+        self._offset = 0.0
+
+    def _source_fps(self, cap: cv2.VideoCapture) -> float:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        return fps if PLAUSIBLE_FPS[0] <= fps <= PLAUSIBLE_FPS[1] else self.fallback_fps
+
+    def tick(self, cap: cv2.VideoCapture) -> float:
+        """Time stamp of the frame just grabbed"""
+        self.frames += 1
+        interval = 1.0 / self.fps
+        pts = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if self._pts_origin is None and pts >= 0:
+            self._pts_origin = pts - self._offset
+        time_stamp = pts - self._pts_origin if self._pts_origin is not None else None
+        if time_stamp is not None and (self.time_stamp is None or time_stamp > self.time_stamp):
+            self.pts_frames += 1
+        elif self.time_stamp is None:
+            time_stamp = self._offset
+        else:
+            time_stamp = self.time_stamp + interval
+        self.time_stamp = time_stamp
+        return time_stamp
+
+    def rewind(self):
+        """The source restarts from its first frame: continue one interval after the last time stamp"""
+        self._pts_origin = None
+        self._offset = self.time_stamp + 1.0 / self.fps if self.time_stamp is not None else 0.0
+
+    def reopen(self, cap: cv2.VideoCapture):
+        """A new capture of the same source (reconnect, or a looped file reopened): keep the clock going"""
+        self.rewind()
+        self.fps = self._source_fps(cap)
+
+
+class FrameScheduler:
+    """
+    Paces a stream against the wall clock using its capture time stamps.
+
+    The first frame anchors stream time to the wall clock; every later frame is due at
+    anchor + time stamp. admit() waits for a frame that is early and refuses one that is
+    more than max_lag late, so the stream never builds up latency: frames are skipped
+    instead. A stream that stalls for longer than resync_seconds (an RTSP reconnect, a
+    paused debugger) is re-anchored rather than dropped forever. With realtime=False
+    every frame is admitted at once (offline processing) and only the counters run.
+    """
+    def __init__(self, max_lag: float = 0.1, realtime: bool = True, resync_seconds: float = 2.0,
+                 clock=time.perf_counter, sleep=time.sleep):
+        self.max_lag = max_lag
+        self.realtime = realtime
+        self.resync_seconds = resync_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self._anchor = None
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.admitted = 0
+        self.dropped = 0
+        self.stale = 0
+        self.resyncs = 0
+        self.last_lag = 0.0
+        self.max_lag_seen = 0.0
+        self._lag_sum = 0.0
+
+    def lag(self, time_stamp: float) -> float:
+        """Seconds the frame with this time stamp is behind the wall clock (negative: early)"""
+        if self._anchor is None:
+            return 0.0
+        return self.clock() - (self._anchor + time_stamp)
+
+    def admit(self, time_stamp: float) -> bool:
+        """Wait until the frame is due; False if it is already too late to be worth processing"""
+        with self._lock:
+            self.frames += 1
+            if not self.realtime:
+                self.admitted += 1
+                return True
+            if self._anchor is None or self.lag(time_stamp) > self.resync_seconds:
+                if self._anchor is not None:
+                    self.resyncs += 1
+                self._anchor = self.clock() - time_stamp
+            lag = self.lag(time_stamp)
+        if lag < 0:
+            self.sleep(-lag)
+            lag = 0.0
+        with self._lock:
+            self._record(lag)
+            if lag > self.max_lag:
+                self.dropped += 1
+                return False
+            self.admitted += 1
+            return True
+
+    def is_stale(self, time_stamp: float) -> bool:
+        """Check a frame again just before inference; queued frames can go stale after admit()"""
+        if not self.realtime:
+            return False
+        with self._lock:
+            lag = self.lag(time_stamp)
+            if lag > self.max_lag:
+                self.stale += 1
+                return True
+            return False
+
+    def _record(self, lag: float):
+        self.last_lag = lag
+        self.max_lag_seen = max(self.max_lag_seen, lag)
+        self._lag_sum += lag
+
+    def stats(self) -> dict:
+        with self._lock:
+            measured = self.admitted + self.dropped if self.realtime else 0
+            return {
+                "frames": self.frames,
+                "admitted": self.admitted,
+                "dropped": self.dropped,
+                "stale": self.stale,
+                "resyncs": self.resyncs,
+                "lag_ms": self.last_lag * 1000,
+                "mean_lag_ms": self._lag_sum / measured * 1000 if measured else 0.0,
+                "max_lag_ms": self.max_lag_seen * 1000,
+            }
+
+
+def read_scheduled(cap: cv2.VideoCapture, capture_clock: CaptureClock, scheduler: FrameScheduler):
+    """
+    (frame, time stamp) of the next frame the scheduler admits, or (None, None) at the
+    end of the stream. Frames that are skipped are only grabbed, never decoded.
+    """
+    while True:
+        if not cap.grab():
+            return None, None
+        time_stamp = capture_clock.tick(cap)
+        if not scheduler.admit(time_stamp):
+            continue
+        ret, frame = cap.retrieve()
+        if ret:
+            return frame, time_stamp
@@ -1,59 +1,100 @@
-from ultralytics import YOLO
+import time
+STARTED = time.perf_counter()  # cold start is measured from here to the first processed frame
+
 import cv2
 from scripts.draw_regions import region_class
-from vehicle_class import vehicle_class
 import json
-from vehicle_class import ViewTransformer, scale_coordinates
-from mask import mask
-import numpy as np
-import os
+from vehicle_store import VehicleStore
+from speed_estimator import make_estimator
+from evidence_buffer import FrameRingBuffer
+from evidence_writer import EvidenceWriter
+from traffic_processor import TrafficProcessor
+from calibration import CameraCalibration
+from pipeline import DropFrame, FramePacket, Pipeline, Stage
+from frame_scheduler import CaptureClock, FrameScheduler, read_scheduled
+from track_predictor import TrackPredictor
+from detector_backend import LazyDetector
+from video_capture import open_capture
+from event_log import open_event_log
+from roi_inference import RegionDetector
+from multi_camera import ByteTrackTracker
+from metrics import STAGE_SECONDS, registry, stage_timer
+from violation_verifier import ViolationVerifier
 
 
 #Initiate the variables
 PATH_TO_VIDEO = r"demo_videos\video_0.mp4"
 MODEL_NAME = "yolov8x.pt"
+CASCADE = False  # True: LIGHT_MODEL_NAME tracks every frame; MODEL_NAME only re-checks suspect vehicles' crops
+LIGHT_MODEL_NAME = "yolov8n.pt"
+VERIFY_FROM_SPEED = None  # km/h over which a vehicle inside the region is verified (None: the speed limit)
+VERIFY_CROPS = 3  # crops of a suspect vehicle (one every VERIFY_CROP_EVERY frames) the heavy model checks
+VERIFY_CROP_EVERY = 5
+VERIFIER_INPUT_SIZE = (320, 320)  # (height, width) the heavy model runs at on crops
+DETECTOR_BACKEND = "auto"  # auto, pytorch, onnx or openvino (see detector_backend.py)
+DETECTOR_DEVICE = None  # None: cuda:0 if PyTorch sees a GPU, else cpu
+DETECTOR_INPUT_SIZE = (384, 640)  # (height, width) the model runs at; use (TILE_SIZE, TILE_SIZE) for tiles
+DETECTOR_THREADS = None  # CPU inference threads (None: all cores)
+DETECTOR_INT8 = False  # INT8-quantized ONNX/OpenVINO export
+MODEL_CACHE_DIR = "models"  # exported ONNX/OpenVINO models, reused across runs
 TRACKING_MODEL = "bytetrack.yaml"
 IMAGE_WIDTH = 1280
 IMAGE_HEIGHT = 720
-vehicle_tracker = {}
-SPEED_LIMIT = 120
-PLAY_ROOM = 10
-FINE_SPEED_LIMIT = SPEED_LIMIT + PLAY_ROOM
+CAMERA_PROFILE = "camera_profile.json"  # region, source/target points, scale and speed limits (see calibration.py)
 TIME_NOT_DETECTED_THRESHOLD = 2
 INTERVAL_BETWEEN_SPEED_CALCULATION = 25
-CIRCULAR_ARRAY_SIZE = 100
-CIRCULAR_ARRAY = []
-image_number = 0
-FPS = 25 #(frames per second)
-
-
-SOURCE_0 = np.array([[1252, 787], [2298, 803], [5039, 2159], [-550, 2159]])
-SOURCE_0 = scale_coordinates(coords=SOURCE_0, original_width=3840, original_height=2160, target_width=IMAGE_WIDTH, target_height=IMAGE_HEIGHT)
-
-TARGET_WIDTH = 25
-TARGET_HEIGHT = 250
-TARGET = np.array(
-    [
-        [0, 0],
-        [TARGET_WIDTH - 1, 0],
-        [TARGET_WIDTH - 1, TARGET_HEIGHT - 1],
-        [0, TARGET_HEIGHT - 1],
-    ]
-)
-#Initialize the YOLO model
-model = YOLO(MODEL_NAME).to("cuda:0")
-
-#Initialize the videoCapture
-cap = cv2.VideoCapture(PATH_TO_VIDEO)
-ret, frame = cap.read()
-transformer = ViewTransformer(SOURCE_0, TARGET)
-if not ret:
+MAX_TRACKED_VEHICLES = 256
+SPEED_ESTIMATOR = "least_squares"  # least_squares, kalman or median (see speed_estimator.py)
+SPEED_ESTIMATION_WINDOW = 25  # frames of road-plane positions each speed is fitted over
+CIRCULAR_ARRAY_SIZE = 100  # frames of evidence kept (1280x720x100 = ~276 MB)
+PATH_TO_IMAGE_FOLDER = "evidence"
+EVIDENCE_FORMAT = "jpg"  # jpg (one image per frame) or mp4 (one clip per violation)
+EVIDENCE_WORKERS = 2
+EVIDENCE_MAX_PENDING = 8  # violations waiting to be written before new ones are dropped
+EVIDENCE_COPY_ON_SUBMIT = False  # True: copy each clip out of the ring when queued, so none can lose frames
+EVENT_LOG_DIR = "events"
+EVENT_LOG_FORMATS = ("jsonl", "sqlite")  # jsonl, sqlite and/or parquet (needs pyarrow); () to turn the log off
+ANNOTATION_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 4  # frames waiting between two pipeline stages
+PIPELINE_QUEUE_POLICY = "block"  # block (process every frame) or drop_oldest (stay live, skip frames)
+REALTIME = False  # True: keep pace with the source clock and skip frames that fall behind (live sources)
+MAX_FRAME_LAG = 0.1  # seconds behind the source clock after which a frame is skipped when REALTIME
+DECODE_BACKEND = "opencv"  # opencv (decode, then resize) or ffmpeg (scaled while decoding; needs ffmpeg on PATH)
+DETECT_EVERY = 1  # run the detector at least every N frames and predict tracks in between (1: every frame)
+PREDICT_MOTION_THRESHOLD = 0.5  # box heights a predicted box may move before the detector runs again
+PREDICT_RESIDUAL_THRESHOLD = 0.4  # prediction error (box heights) at a detection that makes the next frame one too
+INFERENCE_REGION = "full"  # full, crop (region_points bounding box only) or tiles (native-resolution tiles of it)
+INFERENCE_MARGIN = 32  # pixels around region_points still sent to the detector
+TILE_SIZE = 640  # native-resolution pixels per tile when INFERENCE_REGION is tiles
+TILE_OVERLAP = 128
+TRACE_FILE = None  # e.g. "trace.json": the last timed steps of every frame, for chrome://tracing or Perfetto
+
+
+if TRACE_FILE:
+    registry.start_trace()
+
+#Load the YOLO model on the best device available (exported for the CPU if needed) while the rest starts up
+model = LazyDetector(LIGHT_MODEL_NAME if CASCADE else MODEL_NAME, DETECTOR_BACKEND, DETECTOR_DEVICE,
+                     DETECTOR_INPUT_SIZE, DETECTOR_THREADS, DETECTOR_INT8, MODEL_CACHE_DIR)
+verifier_model = LazyDetector(MODEL_NAME, DETECTOR_BACKEND, DETECTOR_DEVICE, VERIFIER_INPUT_SIZE, DETECTOR_THREADS,
+                              DETECTOR_INT8, MODEL_CACHE_DIR) if CASCADE else None
+
+#Initialize the videoCapture: frames come out at IMAGE_WIDTH x IMAGE_HEIGHT, except for tiles, which need the source size
+if INFERENCE_REGION == "tiles":
+    cap = open_capture(PATH_TO_VIDEO, backend=DECODE_BACKEND)
+else:
+    cap = open_capture(PATH_TO_VIDEO, IMAGE_WIDTH, IMAGE_HEIGHT, DECODE_BACKEND)
+# Time stamps come from the source (PTS, or its reported frame rate), not a hard-coded FPS
+capture_clock = CaptureClock(cap)
+scheduler = FrameScheduler(MAX_FRAME_LAG, realtime=REALTIME)
+frame, _ = read_scheduled(cap, capture_clock, scheduler)
+if frame is None:
     print("Error: Could not open video.")
     exit()
 
 # Initialize video writer for processed video
 fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # or 'XVID' for .avi
-output_video = cv2.VideoWriter('processed_video.mp4', fourcc, FPS, (IMAGE_WIDTH, IMAGE_HEIGHT))
+output_video = cv2.VideoWriter('processed_video.mp4', fourcc, capture_clock.fps, (IMAGE_WIDTH, IMAGE_HEIGHT))
 
 # reuse_previous_regions = input("Do you want to reuse previous regions? (y/n): ")
 reuse_previous_regions = 'y'
@@ -64,127 +105,111 @@ if reuse_previous_regions == "n":
     region_points = region_drawer.draw_region()
     with open("region_points.json", "w") as f:
         json.dump(region_points, f)
-else:
-    with open("region_points.json", "r") as f:
-        region_points = json.load(f)
-
-# Build binary mask (1 inside polygon, 0 outside)
-image_w, image_h = IMAGE_WIDTH, IMAGE_HEIGHT
-region_mask = mask(image_w, image_h, region_points)
-
-def apply_region_overlay(frame, region_mask_obj, region_points):
-    """
-    Apply a semi-transparent overlay showing the region area and polygon outline
-    """
-    # Create overlay with semi-transparent fill
-    overlay = frame.copy()
-    # Create colored mask for the region area (light green with transparency)
-    region_color = np.array([144, 238, 144], dtype=np.uint8)  # Light green
-    alpha = 0.25  # Transparency level (0.0 to 1.0)
-
-    # Apply color to the region area
-    mask_array = region_mask_obj.populated_mask
-    for i in range(3):  # Apply to all color channels
-        overlay[:, :, i] = np.where(mask_array == 1,
-                                   overlay[:, :, i] * (1 - alpha) + region_color[i] * alpha,
-                                   overlay[:, :, i])
-
-    # Draw polygon outline (more visible)
-    if len(region_points) > 0:
-        points_array = np.array(region_points, dtype=np.int32)
-        # Draw the polygon outline in red
-        cv2.polylines(overlay, [points_array], isClosed=True, color=(144, 238, 144), thickness=3)
-        # Draw individual points as small circles
-        for point in region_points:
-            cv2.circle(overlay, point, 5, (144, 238, 144), -1)  # Red dots
-
-    return overlay
-
-if not cap.isOpened():
-    print("Error: Could not open video.")
-    exit()
-
-if cap.isOpened():
-    while ret:
-        if not ret:
-            cap = cv2.VideoCapture(PATH_TO_VIDEO)
-            ret, frame = cap.read()
-        image_number += 1
-        time_stamp = image_number / FPS
-        ret, frame = cap.read()
-        frame = cv2.resize(frame, (IMAGE_WIDTH, IMAGE_HEIGHT))
-
-
-        if len(CIRCULAR_ARRAY) >= CIRCULAR_ARRAY_SIZE:
-            CIRCULAR_ARRAY.pop(0)
-
-
-        result = model.track(frame, persist=True, tracker=TRACKING_MODEL, verbose=False, device="cuda:0")[0]
-        boxes = result.boxes
-        for box in boxes:
-
-            # Skip boxes without a tracker id yet
-            if box.id is None:
-                continue
-            conf = box.conf[0]
-            tracker_id = int(box.id[0].item()) if hasattr(box.id[0], 'item') else int(box.id[0])
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-
-            # Compute a representative point (bbox center) and test against mask
-            center_x = (x1 + x2) // 2
-            center_y = y2
-
-            is_inside = region_mask.point_is_inside(center_x, center_y)
-
-            # Ensure vehicle object exists in tracker dict
-            if tracker_id not in vehicle_tracker:
-                vehicle_tracker[tracker_id] = vehicle_class(tracker_id, region_points, INTERVAL_BETWEEN_SPEED_CALCULATION)
-
-            vehicle_object = vehicle_tracker[tracker_id]
-            transformed_points = transformer.transform_points(np.array([x1, y1, x2, y2])).astype(int)
-            x_actual = transformed_points[0]
-            y_actual = transformed_points[1]
-            speed, update = vehicle_object.detected(float(conf), [x1, y1, x2, y2], bool(is_inside), (x_actual, y_actual), time_stamp)
-
-
-            if region_mask.point_is_inside(center_x, center_y):
-                if speed > FINE_SPEED_LIMIT:
-                    color = (0, 0, 255)
-                elif speed > SPEED_LIMIT:
-                    color = (0, 255, 255)
-                else:
-                    color = (0, 255, 0)
-                label = f"id: {tracker_id}, speed: {speed} km/h"
-                cv2.putText(frame, label, (x1, y1), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-
-                if speed > FINE_SPEED_LIMIT:
-                    PATH_TO_IMAGE_FOLDER = "evidence"
-                    if update:
-                        for img_number, img in enumerate(CIRCULAR_ARRAY):
-                            if not os.path.exists(f"{PATH_TO_IMAGE_FOLDER}/{tracker_id}"):
-                                os.makedirs(f"{PATH_TO_IMAGE_FOLDER}/{tracker_id}")
-                            cv2.imwrite(f"{PATH_TO_IMAGE_FOLDER}/{tracker_id}/{img_number+image_number}_{speed:.2f}.jpg", img)
-
-            # Apply region overlay to the frame
-            frame_with_overlay = apply_region_overlay(frame.copy(), region_mask, region_points)
-
-            CIRCULAR_ARRAY.append(frame_with_overlay)
-
-        # Write the processed frame to output video
-        output_video.write(frame_with_overlay)
-
-        cv2.imshow("Frame", frame_with_overlay)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+# The profile's mask and road-plane map are cached next to it and rebuilt only when it (or the region) changes
+calibration = CameraCalibration.load(CAMERA_PROFILE, IMAGE_WIDTH, IMAGE_HEIGHT)
+region_points = calibration.region_points
+
+vehicle_store = VehicleStore(MAX_TRACKED_VEHICLES, INTERVAL_BETWEEN_SPEED_CALCULATION=INTERVAL_BETWEEN_SPEED_CALCULATION,
+                             time_not_detected_threshold=TIME_NOT_DETECTED_THRESHOLD,
+                             speed_estimator=make_estimator(SPEED_ESTIMATOR, MAX_TRACKED_VEHICLES, window=SPEED_ESTIMATION_WINDOW,
+                                                            scaling_factor=calibration.scaling_factor),
+                             scaling_factor=calibration.scaling_factor)
+evidence_buffer = FrameRingBuffer(CIRCULAR_ARRAY_SIZE, IMAGE_WIDTH, IMAGE_HEIGHT)
+evidence_writer = EvidenceWriter(PATH_TO_IMAGE_FOLDER, EVIDENCE_WORKERS, EVIDENCE_MAX_PENDING, EVIDENCE_FORMAT,
+                                 fps=capture_clock.fps, copy_on_submit=EVIDENCE_COPY_ON_SUBMIT)
+event_log = open_event_log(EVENT_LOG_DIR, EVENT_LOG_FORMATS) if EVENT_LOG_FORMATS else None
+# Fines are only issued for vehicles the heavy model confirms, on crops from the evidence ring
+verifier = ViolationVerifier(verifier_model, evidence_buffer, evidence_writer,
+                             VERIFY_FROM_SPEED or calibration.speed_limit, VERIFY_CROPS, VERIFY_CROP_EVERY,
+                             transformer=calibration.road_plane_map, scaling_factor=calibration.scaling_factor,
+                             predict_kwargs=dict(verbose=False)) if CASCADE else None
+traffic_processor = TrafficProcessor(region_points, calibration.source_points, calibration.target_points,
+                                     IMAGE_WIDTH, IMAGE_HEIGHT, calibration.speed_limit, calibration.fine_speed_limit,
+                                     vehicle_store, evidence_buffer, evidence_writer, event_log,
+                                     transformer=calibration.road_plane_map, region_mask=calibration.region_mask,
+                                     verifier=verifier)
+track_predictor = TrackPredictor(DETECT_EVERY, PREDICT_MOTION_THRESHOLD, PREDICT_RESIDUAL_THRESHOLD)
+region_detector = RegionDetector(model, region_points, IMAGE_WIDTH, IMAGE_HEIGHT, INFERENCE_REGION, INFERENCE_MARGIN,
+                                 TILE_SIZE, TILE_OVERLAP,
+                                 tracker=ByteTrackTracker(TRACKING_MODEL, round(capture_clock.fps))
+                                 if INFERENCE_REGION == "tiles" else None,
+                                 track_kwargs=dict(persist=True, tracker=TRACKING_MODEL, verbose=False),
+                                 predict_kwargs=dict(verbose=False))
+detect_timer = stage_timer("detect")
+video_write_timer = stage_timer("video_write")
+
+
+def read_frame():
+    """Decoder thread: next resized frame with its capture time stamp, or None at the end of the video"""
+    frame, time_stamp = read_scheduled(cap, capture_clock, scheduler)
+    if frame is None:
+        return None
+    if INFERENCE_REGION != "tiles":
+        return FramePacket(frame, time_stamp, capture_clock.frames)
+    # Far-away vehicles are detected on the source resolution, before the resize shrinks them
+    return FramePacket(cv2.resize(frame, (IMAGE_WIDTH, IMAGE_HEIGHT)), time_stamp, capture_clock.frames, native=frame)
+
+
+def track_frame(packet):
+    """Tracking thread: frames arrive in order, as ByteTrack needs"""
+    if scheduler.is_stale(packet.time_stamp):
+        raise DropFrame()
+    native_frame = packet.data.pop("native", None)
+    if track_predictor.should_detect(packet.time_stamp):
+        with detect_timer.time():
+            detections = region_detector(packet.frame, native_frame)
+        xyxy, tracker_ids, confs = track_predictor.update(*detections, packet.time_stamp)
+    else:
+        # Skipped by the detector: carry the tracks forward so the frame still gets boxes and speeds
+        xyxy, tracker_ids, confs = track_predictor.predict(packet.time_stamp)
+    traffic_processor.track(packet, xyxy, tracker_ids, confs)
+
+
+def write_output(packet):
+    """Output thread: evidence ring and processed video, in frame order"""
+    traffic_processor.record(packet)
+    with video_write_timer.time():
+        output_video.write(packet.frame)
+
+
+pipeline = Pipeline(read_frame, track_frame,
+                    [Stage("annotate", traffic_processor.annotate, workers=ANNOTATION_WORKERS),
+                     Stage("output", write_output, ordered=True)],
+                    queue_size=PIPELINE_QUEUE_SIZE, policy=PIPELINE_QUEUE_POLICY).start()
+
+first_frame = True
+for packet in pipeline.results():
+    if first_frame:
+        first_frame = False
+        cold_start = time.perf_counter() - STARTED
+        print(f"First frame processed {cold_start:.2f} s after start, "
+              f"{cold_start - model.waited_seconds:.2f} s without waiting for the model")
+    cv2.imshow("Frame", packet.frame)
+    if cv2.waitKey(1) & 0xFF == ord('q'):
+        pipeline.stop()
+        break
+pipeline.join()
+# Vehicles still on screen get their final summary too
+traffic_processor.finish()
 
 cap.release()
 output_video.release()
-cv2.destroyAllWindows()
-
-
-
-
-
-
+if verifier is not None:
+    verifier.close()
+evidence_writer.close()
+if event_log is not None:
+    event_log.close()
+    print(f"Events: {event_log.stats()}")
+print(f"Detector: {LIGHT_MODEL_NAME if CASCADE else MODEL_NAME} on {model.device} ({model.backend}), "
+      f"loaded in {model.load_seconds:.1f} s")
+if verifier is not None:
+    print(f"Verifier: {MODEL_NAME}, {verifier.stats()}")
+print(f"Vehicles: {vehicle_store.stats()}")
+print(f"Pipeline: {pipeline.stats()}")
+print(f"Schedule: {scheduler.stats()}")
+print(f"Detections: {track_predictor.stats()}, {region_detector.pixel_share() * 100:.0f}% of the frame's pixels")
+print(f"Evidence: {evidence_writer.stats()}")
+print(f"Stages: {registry.stats()[STAGE_SECONDS]}")
+if TRACE_FILE:
+    registry.stop_trace().dump(TRACE_FILE)
+    print(f"Trace: {TRACE_FILE}")
@@ -2,11 +2,12 @@ import numpy as np
 import cv2
 
 class mask:
-    def __init__(self, image_width: int, image_height: int, region_points: list):
+    def __init__(self, image_width: int, image_height: int, region_points: list, populated_mask: np.ndarray = None):
         self.image_width = image_width
         self.image_height = image_height
         self.mask = np.zeros((self.image_height, self.image_width), dtype=np.uint8)
-        self.populated_mask = self._populate_mask(region_points)
+        # A populated_mask saved earlier (see calibration.CameraCalibration) skips filling the polygon again
+        self.populated_mask = populated_mask if populated_mask is not None else self._populate_mask(region_points)
 
     def _populate_mask(self, region_points: list):
         if region_points is None or len(region_points) == 0:
@@ -21,3 +22,12 @@ class mask:
             return bool(self.populated_mask[y, x] == 1)
         except:
             return False
+
+    def points_are_inside(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Vectorised point_is_inside: one fancy-indexed lookup for a batch of points"""
+        xs = np.asarray(xs, dtype=np.intp)
+        ys = np.asarray(ys, dtype=np.intp)
+        in_frame = (xs >= 0) & (xs < self.image_width) & (ys >= 0) & (ys < self.image_height)
+        # Clip so out-of-frame points index safely, then let in_frame zero them out
+        values = self.populated_mask[np.clip(ys, 0, self.image_height - 1), np.clip(xs, 0, self.image_width - 1)]
+        return (values == 1) & in_frame
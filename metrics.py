@@ -0,0 +1,410 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from itertools import accumulate
+
+HISTOGRAM_LOWEST = 1e-6  # seconds; smaller values share the first bucket
+HISTOGRAM_OCTAVES = 28  # powers of two covered above HISTOGRAM_LOWEST (up to ~268 s)
+HISTOGRAM_SUB_BUCKETS = 16  # linear buckets per power of two: values are binned within 1/16 of themselves
+# Bucket bounds (seconds) of the histograms at /metrics; the fine buckets are summed into these
+PROMETHEUS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+TRACE_MAX_EVENTS = 200000  # spans a trace keeps (the most recent ones)
+STAGE_SECONDS = "traffic_stage_seconds"
+STAGE_HELP = "Time spent in one step of frame processing"
+
+
+class Histogram:
+    """
+    Latency histogram with preallocated log-linear buckets, HDR-style.
+
+    Every power of two from HISTOGRAM_LOWEST up is split into HISTOGRAM_SUB_BUCKETS equal
+    buckets, so a value lands in a bucket less than 1/HISTOGRAM_SUB_BUCKETS of itself wide
+    from 1 us to minutes, and recording one is an index computation and an increment. time()
+    is a context manager that records the time spent in its block (and, while a trace
+    runs, the span itself).
+    """
+    def __init__(self, registry, name: str, labels: dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.span_name = " ".join(str(value) for value in labels.values()) or name
+        # Bucket 0 takes everything under HISTOGRAM_LOWEST, the last one everything past the top octave
+        self.counts = [0] * (HISTOGRAM_OCTAVES * HISTOGRAM_SUB_BUCKETS + 2)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def index(value: float) -> int:
+        if value < HISTOGRAM_LOWEST:
+            return 0
+        # value / HISTOGRAM_LOWEST = mantissa * 2 ** exponent with mantissa in [0.5, 1)
+        mantissa, exponent = math.frexp(value / HISTOGRAM_LOWEST)
+        index = (exponent - 1) * HISTOGRAM_SUB_BUCKETS + int((mantissa - 0.5) * 2 * HISTOGRAM_SUB_BUCKETS) + 1
+        return min(index, HISTOGRAM_OCTAVES * HISTOGRAM_SUB_BUCKETS + 1)
+
+    @staticmethod
+    def upper_bound(index: int) -> float:
+        """Largest value bucket index takes"""
+        if index == 0:
+            return HISTOGRAM_LOWEST
+        if index > HISTOGRAM_OCTAVES * HISTOGRAM_SUB_BUCKETS:
+            return math.inf
+        octave, sub_bucket = divmod(index - 1, HISTOGRAM_SUB_BUCKETS)
+        return HISTOGRAM_LOWEST * 2 ** octave * (1 + (sub_bucket + 1) / HISTOGRAM_SUB_BUCKETS)
+
+    def record(self, seconds: float):
+        index = self.index(seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def add(self, other: "Histogram"):
+        """Add the values recorded by another histogram to this one"""
+        with other._lock:
+            counts, count, total, largest = list(other.counts), other.count, other.sum, other.max
+        with self._lock:
+            self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+            self.count += count
+            self.sum += total
+            self.max = max(self.max, largest)
+
+    def add_counts(self, counts: dict, count: int, total: float, largest: float):
+        """Add values recorded elsewhere, given as bucket index -> count (see MetricsExporter)"""
+        with self._lock:
+            for index, bucket_count in counts.items():
+                self.counts[index] += bucket_count
+            self.count += count
+            self.sum += total
+            self.max = max(self.max, largest)
+
+    def time(self):
+        """with histogram.time(): ... records the block's duration (nothing while metrics are disabled)"""
+        return _Span(self) if self.registry.enabled else _NO_SPAN
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (at most the largest value recorded)"""
+        with self._lock:
+            counts, count, largest = list(self.counts), self.count, self.max
+        if not count:
+            return 0.0
+        rank = q * count
+        for index, total in enumerate(accumulate(counts)):
+            if total >= rank:
+                return min(self.upper_bound(index), largest)
+        return largest
+
+    def cumulative(self, bounds) -> list:
+        """Number of values up to each bound; a bucket counts below a bound it straddles"""
+        with self._lock:
+            totals = list(accumulate(self.counts))
+        result = []
+        index = 0
+        for bound in bounds:
+            while index < len(totals) and self.upper_bound(index) <= bound * (1 + 1e-9):
+                index += 1
+            result.append(totals[index - 1] if index else 0)
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.sum / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.quantile(0.5) * 1000,
+            "p90_ms": self.quantile(0.9) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class _Span:
+    """One timed block of a Histogram"""
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        self.histogram.record(end - self.start)
+        trace = self.histogram.registry.trace
+        if trace is not None:
+            trace.span(self.histogram, self.start, end)
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def timed(histogram: Histogram):
+    """Decorator: every call of the function is timed into histogram"""
+    def decorate(function):
+        def wrapper(*args, **kwargs):
+            with histogram.time():
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorate
+
+
+class Counter:
+    """Monotonic count, e.g. frames or violations of one camera"""
+    def __init__(self, registry, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Value that goes up and down, e.g. active tracks"""
+    def __init__(self, registry, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class TraceRecorder:
+    """
+    The most recent timed spans (and tracked frames) as a Chrome trace, for chrome://tracing
+    or Perfetto. Recording appends a tuple; the JSON is only built by dump(). extend() adds
+    the spans of another process (see MetricsExporter), which share the monotonic clock.
+    """
+    def __init__(self, max_events: int = TRACE_MAX_EVENTS):
+        self.events = deque(maxlen=max_events)
+        self.pid = os.getpid()
+        self.thread_names = {}  # (pid, tid) -> name of the threads of other processes
+
+    def span(self, histogram: Histogram, start: float, end: float):
+        self.events.append((histogram.span_name, histogram.labels, self.pid, threading.get_ident(), start, end))
+
+    def frame(self, camera, frame_number: int, time_stamp: float):
+        """Instant event marking the frame a thread starts tracking, so spans can be told apart per frame"""
+        now = time.perf_counter()
+        self.events.append((f"frame {frame_number}", {"camera": camera, "time_stamp": time_stamp},
+                            self.pid, threading.get_ident(), now, None))
+
+    def extend(self, events: list, thread_names: dict):
+        self.events.extend(events)
+        self.thread_names.update(thread_names)
+
+    def drain(self) -> list:
+        """Remove and return the events recorded so far"""
+        return [self.events.popleft() for _ in range(len(self.events))]
+
+    def _thread_names(self) -> dict:
+        names = dict(self.thread_names)
+        names.update(((self.pid, thread.ident), thread.name) for thread in threading.enumerate())
+        return names
+
+    def trace(self) -> dict:
+        recorded = list(self.events)
+        thread_names = self._thread_names()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                   "args": {"name": thread_names.get((pid, tid), str(tid))}}
+                  for pid, tid in {(event[2], event[3]) for event in recorded}]
+        for name, labels, pid, tid, start, end in recorded:
+            event = {"name": name, "pid": pid, "tid": tid, "ts": start * 1e6,
+                     "args": {key: value for key, value in labels.items() if value is not None}}
+            if end is None:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=(end - start) * 1e6)
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+
+
+class Metrics:
+    """
+    Registry of the histograms, counters and gauges of the running process, by name and
+    labels. histogram()/counter()/gauge() return the same object for the same name and
+    labels, so call sites look theirs up once and keep it. prometheus() renders them in the
+    Prometheus text format; start_trace() also records every timed span until stop_trace().
+    With enabled=False, timers do nothing (counters still count).
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.trace = None
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metric_class, kind: str, name: str, help: str, labels: dict):
+        # A label that is None (a single-camera feed has no camera id) is left out
+        labels = {key: str(value) for key, value in labels.items() if value is not None}
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(name, {"kind": kind, "help": help, "metrics": {}})
+            if family["kind"] != kind:
+                raise ValueError(f"Metric {name} is a {family['kind']}, not a {kind}")
+            metric = family["metrics"].get(key)
+            if metric is None:
+                metric = family["metrics"][key] = metric_class(self, name, labels)
+            return metric
+
+    def histogram(self, name: str, help: str = "", **labels) -> Histogram:
+        return self._get(Histogram, "histogram", name, help, labels)
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get(Counter, "counter", name, help, labels)
+
+    def gauge(self, name: str, help: str = "", **labels) -> Gauge:
+        return self._get(Gauge, "gauge", name, help, labels)
+
+    def start_trace(self, max_events: int = TRACE_MAX_EVENTS) -> TraceRecorder:
+        self.trace = TraceRecorder(max_events)
+        return self.trace
+
+    def stop_trace(self) -> TraceRecorder:
+        trace, self.trace = self.trace, None
+        return trace
+
+    def _snapshot_families(self):
+        with self._lock:
+            return [(name, family["kind"], family["help"], list(family["metrics"].values()))
+                    for name, family in sorted(self._families.items())]
+
+    def prometheus(self) -> str:
+        """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, kind, help, metrics in self._snapshot_families():
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in metrics:
+                if kind != "histogram":
+                    lines.append(f"{name}{_label_text(metric.labels)} {metric.value}")
+                    continue
+                for bound, total in zip(PROMETHEUS_BUCKETS, metric.cumulative(PROMETHEUS_BUCKETS)):
+                    lines.append(f"{name}_bucket{_label_text(metric.labels, le=repr(bound))} {total}")
+                lines.append(f"{name}_bucket{_label_text(metric.labels, le='+Inf')} {metric.count}")
+                lines.append(f"{name}_sum{_label_text(metric.labels)} {metric.sum!r}")
+                lines.append(f"{name}_count{_label_text(metric.labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    def merged(self, name: str, label: str) -> dict:
+        """Value of label -> one Histogram summing every histogram of name with it (e.g. a stage over all cameras)"""
+        merged = {}
+        for family_name, kind, _, metrics in self._snapshot_families():
+            if family_name != name or kind != "histogram":
+                continue
+            for metric in metrics:
+                value = metric.labels.get(label)
+                if value not in merged:
+                    merged[value] = Histogram(self, name, {label: value} if value is not None else {})
+                merged[value].add(metric)
+        return merged
+
+    def apply(self, exported: dict):
+        """Add the changes another process's MetricsExporter.export() returned to this registry"""
+        for kind, name, help, labels, change in exported["metrics"]:
+            if kind == "counter":
+                self.counter(name, help, **labels).inc(change)
+            elif kind == "gauge":
+                self.gauge(name, help, **labels).set(change)
+            else:
+                self.histogram(name, help, **labels).add_counts(*change)
+        trace = self.trace
+        if trace is not None and exported["trace"]:
+            trace.extend(exported["trace"], exported["threads"])
+
+    def stats(self) -> dict:
+        """name -> labels as text -> snapshot (quantiles for histograms), for /stats and end-of-run prints"""
+        return {name: {",".join(f"{key}={value}" for key, value in metric.labels.items()): metric.snapshot()
+                       for metric in metrics}
+                for name, _, _, metrics in self._snapshot_families()}
+
+
+def _label_text(labels: dict, **extra) -> str:
+    labels = dict(labels, **extra)
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class MetricsExporter:
+    """
+    What a registry recorded since the last export(), as picklable data for another process's
+    Metrics.apply(): counter increments, gauge values, histogram bucket counts, and the trace
+    spans recorded meanwhile. A worker process sends these to the process serving /metrics.
+
+    Whatever the registry held when the exporter was created (e.g. inherited over fork) is
+    not exported.
+    """
+    def __init__(self, registry: Metrics):
+        self.registry = registry
+        self._last = {}
+        self.export()
+
+    def export(self) -> dict:
+        changes = []
+        for name, kind, help, metrics in self.registry._snapshot_families():
+            for metric in metrics:
+                key = (name, tuple(metric.labels.items()))
+                if kind == "histogram":
+                    with metric._lock:
+                        state = (list(metric.counts), metric.count, metric.sum, metric.max)
+                    last = self._last.get(key, ([0] * len(state[0]), 0, 0.0, 0.0))
+                    if state[1] == last[1]:
+                        continue
+                    counts = {index: now - then for index, (now, then) in enumerate(zip(state[0], last[0]))
+                              if now != then}
+                    change = (counts, state[1] - last[1], state[2] - last[2], state[3])
+                else:
+                    state = metric.value
+                    last = self._last.get(key)
+                    if state == last:
+                        continue
+                    change = state - (last or 0) if kind == "counter" else state
+                self._last[key] = state
+                changes.append((kind, name, help, metric.labels, change))
+        trace = self.registry.trace
+        events = trace.drain() if trace is not None else []
+        threads = trace._thread_names() if events else {}
+        return {"metrics": changes, "trace": events, "threads": threads}
+
+
+# The process-wide registry every instrumented module records into
+registry = Metrics()
+
+
+def stage_timer(stage: str, **labels) -> Histogram:
+    """The traffic_stage_seconds histogram of one processing step (decode, detect, track, jpeg_encode...)"""
+    return registry.histogram(STAGE_SECONDS, STAGE_HELP, stage=stage, **labels)
@@ -0,0 +1,322 @@
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from box_batch import boxes_to_arrays, empty_arrays
+from broadcast import RenditionBroadcaster
+from calibration import CameraCalibration
+from frame_scheduler import CaptureClock, FrameScheduler, read_scheduled
+from metrics import stage_timer
+from pipeline import FramePacket, StageStats
+from traffic_processor import TrafficProcessor
+from video_capture import open_capture
+from vehicle_store import VehicleStore
+
+CONFIG_PATTERN = "rtsp-credential-*.json"
+
+
+def load_camera_configs(config_dir: str = os.path.join("react_app", "configs")) -> dict:
+    """Enabled camera configs that have a video source, keyed by camera id"""
+    cameras = {}
+    for path in sorted(glob.glob(os.path.join(config_dir, CONFIG_PATTERN))):
+        with open(path, "r") as f:
+            config = json.load(f)
+        if config.get("enabled", True) and config.get("source"):
+            cameras[int(config["id"])] = config
+    return cameras
+
+
+class ResultTracker:
+    """
+    Uses the tracker ids already on the detector result (model.track, or a stub model).
+    model.predict results carry no ids, so with UltralyticsBatchDetector every box would be
+    dropped; use ByteTrackTracker there.
+    """
+    def update(self, result, frame):
+        return boxes_to_arrays(result.boxes)
+
+
+class ByteTrackTracker:
+    """One ByteTrack instance per camera, fed by batched model.predict results"""
+    def __init__(self, tracker_config: str = "bytetrack.yaml", frame_rate: int = 25):
+        from ultralytics.trackers.byte_tracker import BYTETracker
+        from ultralytics.utils import IterableSimpleNamespace, yaml_load
+        from ultralytics.utils.checks import check_yaml
+
+        args = IterableSimpleNamespace(**yaml_load(check_yaml(tracker_config)))
+        self.tracker = BYTETracker(args=args, frame_rate=frame_rate)
+
+    def update(self, result, frame):
+        tracks = self.tracker.update(result.boxes.cpu().numpy(), frame)
+        if len(tracks) == 0:
+            return empty_arrays()
+        # Rows are x1, y1, x2, y2, track id, score, class, detection index
+        return tracks[:, :4].astype(np.int32), tracks[:, 4].astype(np.int64), tracks[:, 5].astype(np.float32)
+
+
+class UltralyticsBatchDetector:
+    """Calls model.predict once for a whole list of frames"""
+    def __init__(self, model, device=None):
+        self.model = model
+        self.device = device
+
+    def __call__(self, frames: list) -> list:
+        kwargs = {"verbose": False}
+        if self.device is not None:
+            kwargs["device"] = self.device
+        return self.model.predict(frames, **kwargs)
+
+
+class CameraDecoder(threading.Thread):
+    """
+    Reads one camera and keeps only its most recent frame, so a slow detector makes
+    the engine skip frames instead of falling behind. Frames carry their capture time
+    stamp (source PTS) and are paced by a FrameScheduler, so local files play at their
+    own frame rate and loop, which makes them stand in for RTSP feeds, and a decoder
+    that falls behind a live feed skips frames rather than building up latency.
+    Frames are decoded straight to image_width x image_height where decode_backend
+    can (see video_capture.py), and resized otherwise.
+    """
+    def __init__(self, camera_id: int, source: str, image_width: int, image_height: int, on_frame=None,
+                 loop: bool = True, reconnect_seconds: float = 2.0, max_lag: float = 0.1,
+                 decode_backend: str = "opencv"):
+        super().__init__(name=f"camera-{camera_id}-decode", daemon=True)
+        self.camera_id = camera_id
+        self.source = source
+        self.image_width = image_width
+        self.image_height = image_height
+        self.on_frame = on_frame
+        self.loop = loop
+        self.reconnect_seconds = reconnect_seconds
+        self.decode_backend = decode_backend
+        self.is_file = os.path.exists(source)
+        self.stats = StageStats(f"camera-{camera_id}-decode")
+        self.scheduler = FrameScheduler(max_lag)
+        self._lock = threading.Lock()
+        self._frame = None
+        self._time_stamp = 0.0
+        self._sequence = 0
+        self._stop_event = threading.Event()
+
+    def latest(self):
+        """(sequence, frame, time stamp) of the newest frame; sequence 0 means nothing decoded yet"""
+        with self._lock:
+            return self._sequence, self._frame, self._time_stamp
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        capture_clock = None
+        while not self._stop_event.is_set():
+            cap = open_capture(self.source, self.image_width, self.image_height, self.decode_backend,
+                               camera=self.camera_id)
+            if not cap.isOpened():
+                print(f"Error: Could not open camera {self.camera_id} source {self.source}")
+                self._stop_event.wait(self.reconnect_seconds)
+                continue
+            # A looped file or a reconnected stream continues the previous clock
+            if capture_clock is None:
+                capture_clock = CaptureClock(cap)
+            else:
+                capture_clock.reopen(cap)
+            while not self._stop_event.is_set():
+                frame, time_stamp = read_scheduled(cap, capture_clock, self.scheduler)
+                if frame is None:
+                    break
+                start = time.perf_counter()
+                with self._lock:
+                    # Numbered by frames grabbed, so the ones the scheduler skipped show up as gaps
+                    self._sequence = capture_clock.frames
+                    self._frame = frame
+                    self._time_stamp = time_stamp
+                self.stats.record(time.perf_counter() - start)
+                if self.on_frame is not None:
+                    self.on_frame()
+            cap.release()
+            if self.is_file and not self.loop:
+                return
+
+
+class CameraContext:
+    """Per-camera state: decoder, tracker, vehicle store/processor and the broadcaster of its annotated frames"""
+    def __init__(self, camera_id: int, config: dict, decoder: CameraDecoder, tracker, processor: TrafficProcessor,
+                 renditions: dict = None):
+        self.camera_id = camera_id
+        self.config = config
+        self.decoder = decoder
+        self.tracker = tracker
+        self.processor = processor
+        self.last_sequence = 0
+        self.stats = StageStats(f"camera-{camera_id}")
+        self.tracker_timer = stage_timer("tracker_update", camera=camera_id)
+        self._pending = None
+        self._pending_lock = threading.Condition()
+        self.broadcaster = RenditionBroadcaster(renditions, camera=camera_id)
+
+    @property
+    def version(self) -> int:
+        return self.broadcaster.frames.version
+
+    def publish(self, frame: np.ndarray, metadata: dict = None):
+        self.broadcaster.publish(frame, metadata)
+
+    def wait_for_frame(self, after_version: int, timeout: float = 1.0, size: str = None):
+        """(version, jpeg) of the first frame newer than after_version, or (after_version, None) on timeout"""
+        return self.broadcaster.view(size).wait(after_version, timeout)
+
+
+class MultiCameraEngine:
+    """
+    One decoder per camera, one batched detector call for the latest frames of all cameras,
+    and per-camera tracking, vehicle stores, region masks and JPEG renditions.
+
+    detector(frames) takes a list of frames and returns one result per frame, and
+    tracker_factory() makes each camera's tracker: ByteTrackTracker tracks the untracked
+    results of UltralyticsBatchDetector, ResultTracker keeps the ids a stub model puts on
+    its results. Tracking, speed estimation and drawing run on a thread per camera so
+    they stay in order for that camera while the detector works on the next batch.
+    """
+    def __init__(self, cameras: dict, detector, tracker_factory=ByteTrackTracker, batch_size: int = 4,
+                 image_width: int = 1280, image_height: int = 720, processor_factory=None, renditions: dict = None,
+                 decode_backend: str = "opencv"):
+        self.detector = detector
+        self.batch_size = batch_size
+        self.batch_stats = StageStats("detector")
+        self.detect_timer = stage_timer("detect")
+        self.batched_frames = 0
+        self._new_frame = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._next_camera = 0
+        self.cameras = {}
+        for camera_id, config in cameras.items():
+            decoder = CameraDecoder(camera_id, config["source"], image_width, image_height,
+                                    on_frame=self._new_frame.set, decode_backend=decode_backend)
+            processor = processor_factory(camera_id, config) if processor_factory else None
+            self.cameras[camera_id] = CameraContext(camera_id, config, decoder, tracker_factory(), processor,
+                                                    renditions)
+
+    def start(self):
+        for camera in self.cameras.values():
+            camera.decoder.start()
+            thread = threading.Thread(target=self._post_process, args=(camera,), name=f"camera-{camera.camera_id}-post",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._infer, name="multi-camera-infer", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._new_frame.set()
+        for camera in self.cameras.values():
+            camera.decoder.stop()
+            with camera._pending_lock:
+                camera._pending_lock.notify_all()
+
+    def join(self, timeout: float = None):
+        for thread in self._threads:
+            thread.join(timeout)
+        for camera in self.cameras.values():
+            camera.decoder.join(timeout)
+        if not any(thread.is_alive() for thread in self._threads):
+            # No frame can reach a processor any more: finalize the tracks still open
+            for camera in self.cameras.values():
+                if camera.processor is not None:
+                    camera.processor.finish()
+
+    def _gather(self) -> list:
+        """Up to batch_size cameras with an unprocessed frame, round-robin so none starves"""
+        batch = []
+        camera_list = list(self.cameras.values())
+        for offset in range(len(camera_list)):
+            camera = camera_list[(self._next_camera + offset) % len(camera_list)]
+            sequence, frame, time_stamp = camera.decoder.latest()
+            if sequence > camera.last_sequence:
+                camera.last_sequence = sequence
+                batch.append((camera, FramePacket(frame, time_stamp, sequence)))
+                if len(batch) == self.batch_size:
+                    break
+        self._next_camera = (self._next_camera + 1) % max(len(camera_list), 1)
+        return batch
+
+    def _infer(self):
+        while not self._stop.is_set():
+            self._new_frame.clear()
+            batch = self._gather()
+            if not batch:
+                self._new_frame.wait(0.1)
+                continue
+            start = time.perf_counter()
+            with self.detect_timer.time():
+                results = self.detector([packet.frame for _, packet in batch])
+            self.batch_stats.record(time.perf_counter() - start)
+            self.batched_frames += len(batch)
+            for (camera, packet), result in zip(batch, results):
+                packet.data["result"] = result
+                # Hand over to the camera's own thread; if it is still busy, the older frame is replaced
+                with camera._pending_lock:
+                    camera._pending = packet
+                    camera._pending_lock.notify()
+
+    def _post_process(self, camera: CameraContext):
+        while not self._stop.is_set():
+            with camera._pending_lock:
+                camera._pending_lock.wait_for(lambda: camera._pending is not None or self._stop.is_set())
+                packet, camera._pending = camera._pending, None
+            if packet is None:
+                continue
+            start = time.perf_counter()
+            with camera.tracker_timer.time():
+                xyxy, tracker_ids, confs = camera.tracker.update(packet.data["result"], packet.frame)
+            metadata = None
+            if camera.processor is not None:
+                camera.processor.process(packet, xyxy, tracker_ids, confs)
+                metadata = camera.processor.frame_metadata(packet)
+            # Encoded lazily, per rendition, by the viewers of this camera
+            camera.publish(packet.frame, metadata)
+            camera.stats.record(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        detector = self.batch_stats.snapshot()
+        detector["mean_batch"] = self.batched_frames / detector["frames"] if detector["frames"] else 0.0
+        return {
+            "detector": detector,
+            "cameras": {camera_id: {"decode": camera.decoder.stats.snapshot(), "processed": camera.stats.snapshot(),
+                                    "schedule": camera.decoder.scheduler.stats(),
+                                    "renditions": camera.broadcaster.stats()}
+                        for camera_id, camera in self.cameras.items()},
+        }
+
+
+def default_processor_factory(source_points, target_points, image_width: int = 1280, image_height: int = 720,
+                              speed_limit: float = 120, fine_speed_limit: float = 130,
+                              default_region_points: str = "region_points.json", event_log=None):
+    """
+    processor_factory building a TrafficProcessor per camera: from its config's "calibration"
+    profile (see calibration.load_profile) if it has one, else from its region_points file
+    and the source/target points and speed limits given here.
+    """
+    def factory(camera_id: int, config: dict) -> TrafficProcessor:
+        if config.get("calibration"):
+            calibration = CameraCalibration.load(config["calibration"], image_width, image_height)
+            return TrafficProcessor(calibration.region_points, calibration.source_points, calibration.target_points,
+                                    image_width, image_height, calibration.speed_limit, calibration.fine_speed_limit,
+                                    VehicleStore(scaling_factor=calibration.scaling_factor), event_log=event_log,
+                                    camera_id=camera_id, transformer=calibration.road_plane_map,
+                                    region_mask=calibration.region_mask)
+        with open(config.get("region_points", default_region_points), "r") as f:
+            region_points = json.load(f)
+        camera_speed_limit = config.get("speed_limit", speed_limit)
+        camera_fine_speed_limit = config.get("fine_speed_limit", camera_speed_limit + fine_speed_limit - speed_limit)
+        return TrafficProcessor(region_points, source_points, target_points, image_width, image_height,
+                                camera_speed_limit, camera_fine_speed_limit, VehicleStore(), event_log=event_log,
+                                camera_id=camera_id)
+    return factory
@@ -0,0 +1,314 @@
+import heapq
+import threading
+import time
+import traceback
+from collections import deque
+
+QUEUE_POLICIES = ("block", "drop_oldest")
+_END = object()
+
+
+class DropFrame(Exception):
+    """Raised by a stage to discard its packet on purpose (counted as a drop, not an error)"""
+
+
+class FramePacket:
+    """One frame travelling through the pipeline; stages attach their results to `data`"""
+    def __init__(self, frame, time_stamp: float, frame_number: int = None, **data):
+        self.sequence = None
+        self.frame = frame
+        self.time_stamp = time_stamp
+        self.frame_number = frame_number
+        self.created = time.perf_counter()
+        self.data = data
+
+
+class Stage:
+    """
+    A step of the pipeline run by `workers` threads. An ordered stage has a single
+    worker and gets its packets back in frame order even if an earlier stage ran them
+    in parallel.
+    """
+    def __init__(self, name: str, fn, workers: int = 1, ordered: bool = False):
+        if ordered and workers != 1:
+            raise ValueError(f"Ordered stage {name!r} must have exactly one worker")
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.ordered = ordered
+
+
+class StageStats:
+    """Throughput and processing-latency counters of one stage"""
+    def __init__(self, name: str):
+        self.name = name
+        self.frames = 0
+        self.errors = 0
+        self.dropped = 0
+        self.busy_seconds = 0.0
+        self.max_seconds = 0.0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.frames += 1
+            self.busy_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = max(time.perf_counter() - self.started, 1e-9)
+            return {
+                "frames": self.frames,
+                "fps": self.frames / elapsed,
+                "mean_ms": self.busy_seconds / self.frames * 1e3 if self.frames else 0.0,
+                "max_ms": self.max_seconds * 1e3,
+                "errors": self.errors,
+                "dropped": self.dropped,
+            }
+
+
+class BoundedQueue:
+    """
+    FIFO between two stages. When full, put() either waits ("block") or throws away the
+    oldest packet ("drop_oldest") and reports it through on_drop.
+    """
+    def __init__(self, name: str, maxsize: int, policy: str = "block", on_drop=None):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {QUEUE_POLICIES}")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+        self.dropped = 0
+        self._items = deque()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item, stop_event: threading.Event) -> bool:
+        with self._condition:
+            # The end marker is never dropped and never waits
+            while item is not _END and len(self._items) >= self.maxsize:
+                if self.policy == "drop_oldest":
+                    dropped = self._items.popleft()
+                    self.dropped += 1
+                    if self.on_drop is not None:
+                        self.on_drop(dropped)
+                    continue
+                if stop_event.is_set():
+                    return False
+                self._condition.wait(0.1)
+            self._items.append(item)
+            self._condition.notify_all()
+        return True
+
+    def get(self, stop_event: threading.Event):
+        with self._condition:
+            while not self._items:
+                if stop_event.is_set():
+                    return _END
+                self._condition.wait(0.1)
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+
+class _Reorderer:
+    """Releases packets in sequence order, skipping sequences known to be dropped upstream"""
+    def __init__(self):
+        self._heap = []
+        self._skipped = set()
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def skip(self, sequence: int):
+        with self._lock:
+            if sequence >= self._next:
+                self._skipped.add(sequence)
+
+    def push(self, packet) -> list:
+        with self._lock:
+            heapq.heappush(self._heap, (packet.sequence, id(packet), packet))
+            released = []
+            while True:
+                if self._heap and self._heap[0][0] <= self._next:
+                    released.append(heapq.heappop(self._heap)[2])
+                    self._next = max(self._next, released[-1].sequence + 1)
+                elif self._next in self._skipped:
+                    self._skipped.discard(self._next)
+                    self._next += 1
+                else:
+                    return released
+
+    def flush(self) -> list:
+        with self._lock:
+            released = [heapq.heappop(self._heap)[2] for _ in range(len(self._heap))]
+            self._skipped.clear()
+            return released
+
+
+class Pipeline:
+    """
+    Threaded decode -> track -> stages... pipeline connected by bounded queues.
+
+    read_frame() runs on a dedicated decoder thread and returns a FramePacket, or None
+    at the end of the stream. track_frame(packet) runs on a single thread in frame order
+    (ByteTrack needs in-order frames) and is where the injected detector is called. Each
+    Stage after that runs on its own worker threads. results() yields finished packets in
+    frame order on the caller's thread, which is where imshow or an HTTP response belongs.
+    Any stage may raise DropFrame to discard a packet (a frame too stale to infer on).
+
+    `policy` applies to every queue; `policies` overrides it per consumer ("track", a
+    stage name or "results").
+    """
+    def __init__(self, read_frame, track_frame, stages=(), queue_size: int = 4, policy: str = "block",
+                 policies: dict = None):
+        self.read_frame = read_frame
+        self.stages = [Stage("track", track_frame)] + list(stages)
+        self._stop = threading.Event()
+        self._threads = []
+        policies = policies or {}
+
+        consumers = [stage.name for stage in self.stages] + ["results"]
+        self.queues = []
+        for position, consumer in enumerate(consumers):
+            self.queues.append(BoundedQueue(consumer, queue_size, policies.get(consumer, policy),
+                                            on_drop=lambda packet, position=position: self._dropped(packet, position)))
+
+        # Ordered stages (and results) sit behind a reorder buffer once anything upstream runs in parallel
+        self._reorderers = {}
+        parallel = False
+        for position, consumer in enumerate(consumers):
+            ordered = consumer == "results" or self.stages[position].ordered
+            if ordered and parallel:
+                self._reorderers[position] = _Reorderer()
+            if position < len(self.stages) and self.stages[position].workers > 1:
+                parallel = True
+
+        self.decode_stats = StageStats("decode")
+        self.stage_stats = {stage.name: StageStats(stage.name) for stage in self.stages}
+        self.end_to_end = StageStats("end_to_end")
+        self._finished_workers = {stage.name: 0 for stage in self.stages}
+        self._finished_lock = threading.Lock()
+
+    def _dropped(self, packet, position: int):
+        """A packet never made it past queue `position`: later reorder buffers must not wait for it"""
+        for reorderer_position, reorderer in self._reorderers.items():
+            if reorderer_position >= position:
+                reorderer.skip(packet.sequence)
+
+    def start(self):
+        self._threads.append(threading.Thread(target=self._decode, name="pipeline-decode", daemon=True))
+        for position, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                self._threads.append(threading.Thread(target=self._work, args=(position, stage),
+                                                      name=f"pipeline-{stage.name}-{worker}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Abort: every thread exits at its next queue operation"""
+        self._stop.set()
+
+    def join(self, timeout: float = None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _decode(self):
+        sequence = 0
+        output = self.queues[0]
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            try:
+                packet = self.read_frame()
+            except Exception:
+                traceback.print_exc()
+                self.decode_stats.error()
+                packet = None
+            if packet is None:
+                break
+            self.decode_stats.record(time.perf_counter() - start)
+            packet.sequence = sequence
+            if packet.frame_number is None:
+                packet.frame_number = sequence
+            sequence += 1
+            if not output.put(packet, self._stop):
+                break
+        output.put(_END, self._stop)
+
+    def _work(self, position: int, stage: Stage):
+        input_queue = self.queues[position]
+        output_queue = self.queues[position + 1]
+        reorderer = self._reorderers.get(position)
+        stats = self.stage_stats[stage.name]
+        while True:
+            item = input_queue.get(self._stop)
+            if item is _END:
+                break
+            packets = reorderer.push(item) if reorderer is not None else [item]
+            for packet in packets:
+                self._process(position, stage, stats, packet, output_queue)
+
+        if reorderer is not None:
+            for packet in reorderer.flush():
+                self._process(position, stage, stats, packet, output_queue)
+        # Let sibling workers see the end too; the last one to finish passes it on
+        input_queue.put(_END, self._stop)
+        with self._finished_lock:
+            self._finished_workers[stage.name] += 1
+            last = self._finished_workers[stage.name] == stage.workers
+        if last:
+            output_queue.put(_END, self._stop)
+
+    def _process(self, position: int, stage: Stage, stats: StageStats, packet: FramePacket, output_queue):
+        start = time.perf_counter()
+        try:
+            stage.fn(packet)
+        except DropFrame:
+            stats.drop()
+            self._dropped(packet, position + 1)
+            return
+        except Exception:
+            traceback.print_exc()
+            stats.error()
+            self._dropped(packet, position + 1)
+            return
+        stats.record(time.perf_counter() - start)
+        output_queue.put(packet, self._stop)
+
+    def results(self):
+        """Finished packets in frame order, until the stream ends or stop() is called"""
+        position = len(self.queues) - 1
+        reorderer = self._reorderers.get(position)
+        while True:
+            item = self.queues[position].get(self._stop)
+            if item is _END:
+                break
+            for packet in (reorderer.push(item) if reorderer is not None else [item]):
+                self.end_to_end.record(time.perf_counter() - packet.created)
+                yield packet
+        if reorderer is not None:
+            for packet in reorderer.flush():
+                self.end_to_end.record(time.perf_counter() - packet.created)
+                yield packet
+
+    def stats(self) -> dict:
+        """Per-stage counters, queue depths and drops, and end-to-end latency"""
+        return {
+            "decode": self.decode_stats.snapshot(),
+            "stages": {name: stats.snapshot() for name, stats in self.stage_stats.items()},
+            "queues": {queue.name: {"depth": len(queue), "dropped": queue.dropped} for queue in self.queues},
+            "end_to_end": self.end_to_end.snapshot(),
+        }
@@ -0,0 +1,467 @@
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from box_batch import boxes_to_arrays
+from frame_scheduler import DEFAULT_FPS, CaptureClock, FrameScheduler, read_scheduled
+from metrics import MetricsExporter, registry, stage_timer
+from pipeline import FramePacket
+from video_capture import open_capture
+
+# Who holds a slot of a SharedFrameRing
+FREE, DECODING, DECODED, INFERRING, ANNOTATED = range(5)
+SLOT_STATES = ("free", "decoding", "decoded", "inferring", "annotated")
+# Per-worker shared counters, indices into ProcessPipeline.counters[role]
+FRAMES, SECONDS, ERRORS, LAST_TIME_STAMP, LAST_FRAME_NUMBER = range(5)
+WORKER_ROLES = ("decode", "infer")
+POLL_SECONDS = 0.1  # how often blocked workers and the supervisor look at the stop event
+METRICS_EXPORT_SECONDS = 0.5  # how often workers send their metrics (and trace spans) along with a frame
+_END = -1  # slot index that marks the end of a finite source
+_RECLAIM = -2  # slot index of the supervisor's message listing the slots a dead inference worker left annotated
+
+
+class SharedFrameRing:
+    """
+    Fixed (slots, height, width, 3) uint8 frames in one multiprocessing.shared_memory block,
+    with each slot's time stamp, frame number and state (FREE ... ANNOTATED) behind them.
+
+    The creating process owns the block and unlinks it in close(); worker processes attach to
+    it by name (pickling a ring attaches, so it can be handed to a spawned process) or inherit
+    it when forked, and only unmap it. The slots themselves are never copied between
+    processes, only their indices.
+    """
+    def __init__(self, slots: int = 8, image_width: int = 1280, image_height: int = 720, name: str = None):
+        self.slots = slots
+        self.image_width = image_width
+        self.image_height = image_height
+        frame_bytes = slots * image_height * image_width * 3
+        size = frame_bytes + slots * (8 + 8 + 1)
+        create = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self._owner_pid = os.getpid() if create else None
+        buf = self.shm.buf
+        self.frames = np.ndarray((slots, image_height, image_width, 3), dtype=np.uint8, buffer=buf)
+        self.time_stamps = np.ndarray(slots, dtype=np.float64, buffer=buf, offset=frame_bytes)
+        self.frame_numbers = np.ndarray(slots, dtype=np.int64, buffer=buf, offset=frame_bytes + slots * 8)
+        self.states = np.ndarray(slots, dtype=np.int8, buffer=buf, offset=frame_bytes + slots * 16)
+        if create:
+            self.states[:] = FREE
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def nbytes(self) -> int:
+        return self.shm.size
+
+    def __reduce__(self):
+        return SharedFrameRing, (self.slots, self.image_width, self.image_height, self.name)
+
+    def state_counts(self) -> dict:
+        counts = np.bincount(self.states, minlength=len(SLOT_STATES))
+        return dict(zip(SLOT_STATES, counts.tolist()))
+
+    def close(self):
+        """Drop this process's views and mapping; the owner also frees the block"""
+        self.frames = self.time_stamps = self.frame_numbers = self.states = None
+        self.shm.close()
+        if self._owner_pid == os.getpid():
+            self.shm.unlink()
+
+
+class VideoSource:
+    """
+    Decode worker job: frames of a video file or stream at image_width x image_height, paced to
+    the wall clock like stream_server.process_video (realtime=False: as fast as they decode).
+    A file is looped unless loop=False. Picklable; the capture is opened by start() in the worker.
+    """
+    def __init__(self, source, image_width: int = 1280, image_height: int = 720, backend: str = "opencv",
+                 max_frame_lag: float = 0.1, realtime: bool = True, loop: bool = True):
+        self.source = source
+        self.image_width = image_width
+        self.image_height = image_height
+        self.backend = backend
+        self.max_frame_lag = max_frame_lag
+        self.realtime = realtime
+        self.loop = loop
+        self.cap = None
+
+    def start(self):
+        self.cap = open_capture(self.source, self.image_width, self.image_height, self.backend)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open {self.source}")
+        self.capture_clock = CaptureClock(self.cap)
+        self.scheduler = FrameScheduler(self.max_frame_lag, realtime=self.realtime)
+
+    def __call__(self):
+        """(frame, time stamp, frame number) of the next frame, or None at the end of the source"""
+        frame, time_stamp = read_scheduled(self.cap, self.capture_clock, self.scheduler)
+        if frame is None and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self.capture_clock.rewind()
+            frame, time_stamp = read_scheduled(self.cap, self.capture_clock, self.scheduler)
+        if frame is None:
+            return None
+        return frame, time_stamp, self.capture_clock.frames
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+class TrackAndAnnotate:
+    """
+    Inference worker job: model.track, TrafficProcessor.track and annotate on a frame, in place.
+
+    Picklable; start() builds the model with make_model() and the processor with
+    make_processor(event_log=...) in the worker, e.g. functools.partial(load_detector, ...) and
+    functools.partial(TrafficProcessor, ...). make_event_log, if given, opens the worker's own
+    event log. Returns the frame's metadata (TrafficProcessor.frame_metadata).
+    """
+    def __init__(self, make_model, make_processor, make_event_log=None, track_kwargs: dict = None):
+        self.make_model = make_model
+        self.make_processor = make_processor
+        self.make_event_log = make_event_log
+        self.track_kwargs = track_kwargs if track_kwargs is not None else {"persist": True, "verbose": False}
+        self.model = None
+        self.processor = None
+        self.event_log = None
+
+    def start(self):
+        self.model = self.make_model()
+        self.event_log = self.make_event_log() if self.make_event_log is not None else None
+        self.processor = self.make_processor(event_log=self.event_log)
+        self.detect_timer = stage_timer("detect")
+
+    def __call__(self, frame: np.ndarray, time_stamp: float, frame_number: int) -> dict:
+        packet = FramePacket(frame, time_stamp, frame_number)
+        with self.detect_timer.time():
+            result = self.model.track(frame, **self.track_kwargs)[0]
+        self.processor.process(packet, *boxes_to_arrays(result.boxes))
+        return self.processor.frame_metadata(packet)
+
+    def close(self):
+        if self.processor is not None:
+            self.processor.finish()
+        if self.event_log is not None:
+            self.event_log.close()
+
+
+def _worker_init():
+    # Ctrl+C reaches the whole process group; the parent decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # A forked worker must not inherit a parent's graceful SIGTERM handler: a kill is a crash to restart
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Nor a trace the parent was recording: the worker records its own while `tracing` is set
+    registry.stop_trace()
+
+
+class _MetricsLink:
+    """Worker side of the metrics: what to send the parent every METRICS_EXPORT_SECONDS, and its /trace state"""
+    def __init__(self, tracing):
+        self.tracing = tracing
+        self.exporter = MetricsExporter(registry)
+        self.next_export = time.monotonic() + METRICS_EXPORT_SECONDS
+
+    def poll(self, force: bool = False):
+        """The metrics to send with the next message, or None until it is time (or force)"""
+        now = time.monotonic()
+        if not force and now < self.next_export:
+            return None
+        self.next_export = now + METRICS_EXPORT_SECONDS
+        exported = self.exporter.export()
+        # Record spans while the parent records a trace
+        if self.tracing.is_set() != (registry.trace is not None):
+            if self.tracing.is_set():
+                registry.start_trace()
+            else:
+                registry.stop_trace()
+        return exported
+
+
+def _stopping(stop_event) -> bool:
+    parent = multiprocessing.parent_process()
+    return stop_event.is_set() or (parent is not None and not parent.is_alive())
+
+
+def _drain(connection) -> list:
+    """The messages already waiting in a pipe, without blocking"""
+    messages = []
+    while connection.poll():
+        messages.append(connection.recv())
+    return messages
+
+
+def _wait(connection, stop_event) -> bool:
+    """Block until a pipe has a message or POLL_SECONDS pass; False once the pipeline stops"""
+    if _stopping(stop_event):
+        return False
+    connection.poll(POLL_SECONDS)
+    return True
+
+
+def decode_worker(ring: SharedFrameRing, source, free, decoded, stop_event, tracing, counters):
+    """Fill free slots with the source's frames and wake the inference worker for each"""
+    _worker_init()
+    metrics = _MetricsLink(tracing)
+    # A restarted decoder continues the stream's clock and frame numbers where the last one stopped
+    time_offset = counters[LAST_TIME_STAMP] + 1.0 / DEFAULT_FPS if counters[FRAMES] else 0.0
+    frame_offset = int(counters[LAST_FRAME_NUMBER])
+    source.start()
+    try:
+        while True:
+            # The free pipe only wakes this worker up; the slot states say which slots are free
+            _drain(free)
+            free_slots = np.flatnonzero(ring.states == FREE)
+            if not len(free_slots):
+                if not _wait(free, stop_event):
+                    return
+                continue
+            if _stopping(stop_event):
+                return
+            slot = int(free_slots[0])
+            # Claimed by its state alone: killed before this the slot is still free, after it the supervisor frees it
+            ring.states[slot] = DECODING
+            start = time.perf_counter()
+            item = source()
+            if item is None:
+                ring.states[slot] = FREE
+                decoded.send((_END, metrics.poll(force=True)))
+                return
+            frame, time_stamp, frame_number = item
+            np.copyto(ring.frames[slot], frame)
+            time_stamp, frame_number = time_stamp + time_offset, frame_number + frame_offset
+            ring.time_stamps[slot] = time_stamp
+            ring.frame_numbers[slot] = frame_number
+            ring.states[slot] = DECODED
+            decoded.send((slot, metrics.poll()))
+            counters[FRAMES] += 1
+            counters[SECONDS] += time.perf_counter() - start
+            counters[LAST_TIME_STAMP] = time_stamp
+            counters[LAST_FRAME_NUMBER] = frame_number
+    finally:
+        source.close()
+        ring.close()
+
+
+def infer_worker(ring: SharedFrameRing, job, decoded, annotated, stop_event, tracing, counters):
+    """Run job on every decoded slot in place, oldest frame first, and pass the slot on with the frame's metadata"""
+    _worker_init()
+    metrics = _MetricsLink(tracing)
+    job.start()
+    ended = False
+    try:
+        while True:
+            # The decoded pipe wakes this worker up and carries the decoder's metrics, which reach the
+            # parent with this worker's; the slot states say which frames are ready
+            for slot, decoder_metrics in _drain(decoded):
+                if decoder_metrics is not None:
+                    registry.apply(decoder_metrics)
+                ended = ended or slot == _END
+            ready = np.flatnonzero(ring.states == DECODED)
+            if not len(ready):
+                if ended:
+                    annotated.send((_END, 0, 0.0, None, metrics.poll(force=True)))
+                    return
+                if not _wait(decoded, stop_event):
+                    return
+                continue
+            if _stopping(stop_event):
+                return
+            slot = int(ready[np.argmin(ring.frame_numbers[ready])])
+            # Claimed by its state alone: killed before this the slot is still decoded, after it the supervisor frees it
+            ring.states[slot] = INFERRING
+            frame_number, time_stamp = int(ring.frame_numbers[slot]), float(ring.time_stamps[slot])
+            start = time.perf_counter()
+            try:
+                metadata = job(ring.frames[slot], time_stamp, frame_number)
+            except Exception as e:
+                print(f"Error processing frame {frame_number}: {e}")
+                counters[ERRORS] += 1
+                metadata = None
+            ring.states[slot] = ANNOTATED
+            # metadata None: the frame failed, the parent only frees its slot
+            annotated.send((slot, frame_number, time_stamp, metadata, metrics.poll()))
+            counters[FRAMES] += 1
+            counters[SECONDS] += time.perf_counter() - start
+    finally:
+        job.close()
+        ring.close()
+
+
+class ProcessPipeline:
+    """
+    Decode, inference and encode/serve in three processes, so none of them waits on another's GIL.
+
+    A decode worker process fills the slots of a SharedFrameRing with source() frames. An
+    inference worker process runs job() on each of them in place: detect, track and annotate.
+    The calling process gets the annotated frames from results(), e.g. to publish to a
+    RenditionBroadcaster that JPEG-encodes per viewer. Each slot's state in the ring says who
+    holds it, and a worker takes a slot by setting its state, so a worker killed at any point
+    leaves every slot either claimed by it or where the next one finds it. Only wake-ups, slot
+    indices and the small metadata dicts travel between the processes, over one-way pipes:
+    parent -> decoder, decoder -> inference and inference -> parent. Each pipe has a single
+    reader and a single writer, and no lock a killed worker could leave held.
+    At most `slots` frames are in flight, which bounds the latency and the memory
+    (slots x 2.76 MB at 1280x720).
+
+    The workers' metrics (the TrafficProcessor counters, stage timers, ...) come back every
+    METRICS_EXPORT_SECONDS with a frame and are added to this process's registry by
+    results(), so /metrics and /stats cover them. While this process records a trace, so do
+    the workers, and their spans are added to it.
+
+    A supervisor thread restarts a worker that dies (exit code != 0: an exception, a crash in
+    a native decoder or model, a kill) after restart_seconds, and hands the slots it held back
+    to the decoder: those it was decoding or inferring on, and those an inference worker had
+    annotated but not sent. A restarted decoder continues the clock and frame numbers. A restarted
+    inference worker loads the model again and starts with fresh tracks. At most max_restarts
+    restarts per worker (None: no limit).
+
+    source and job follow the worker job protocol: start() in the worker, then calls, then
+    close(); see VideoSource and TrackAndAnnotate. They are pickled when the platform spawns
+    processes, so they must be built from module-level callables.
+    """
+    def __init__(self, source, job, slots: int = 8, image_width: int = 1280, image_height: int = 720,
+                 restart_seconds: float = 1.0, max_restarts: int = None, start_method: str = None):
+        self.context = multiprocessing.get_context(start_method)
+        self.source = source
+        self.job = job
+        self.ring = SharedFrameRing(slots, image_width, image_height)
+        self.restart_seconds = restart_seconds
+        self.max_restarts = max_restarts
+        self.stop_event = self.context.Event()
+        self.tracing = self.context.Event()
+        self.free_reader, self.free = self.context.Pipe(duplex=False)
+        self.decoded_reader, self.decoded_writer = self.context.Pipe(duplex=False)
+        self.annotated, self.annotated_writer = self.context.Pipe(duplex=False)
+        self.counters = {role: self.context.Array("d", 5, lock=False) for role in WORKER_ROLES}
+        self.workers = {}
+        self.restarts = {role: 0 for role in WORKER_ROLES}
+        self.served = 0
+        self.failed = 0
+        self._free_lock = threading.Lock()
+        self._join_lock = threading.Lock()
+        self._finished = False
+        self._supervisor = threading.Thread(target=self._supervise, name="process-pipeline-supervisor", daemon=True)
+
+    def _spawn(self, role: str):
+        if role == "decode":
+            target, args = decode_worker, (self.ring, self.source, self.free_reader, self.decoded_writer)
+        else:
+            target, args = infer_worker, (self.ring, self.job, self.decoded_reader, self.annotated_writer)
+        worker = self.context.Process(target=target, args=args + (self.stop_event, self.tracing, self.counters[role]),
+                                      name=f"process-pipeline-{role}", daemon=True)
+        worker.start()
+        self.workers[role] = worker
+
+    def start(self):
+        for slot in range(self.ring.slots):
+            self.free.send(slot)
+        for role in WORKER_ROLES:
+            self._spawn(role)
+        self._supervisor.start()
+        return self
+
+    def _release(self, slot: int):
+        with self._free_lock:
+            self.ring.states[slot] = FREE
+            self.free.send(slot)
+
+    def _supervise(self):
+        held = {"decode": DECODING, "infer": INFERRING}
+        while not self.stop_event.wait(POLL_SECONDS):
+            for role, worker in list(self.workers.items()):
+                if worker.is_alive() or worker.exitcode == 0:
+                    continue
+                print(f"{worker.name} (pid {worker.pid}) exited with code {worker.exitcode}")
+                worker.join()
+                for slot in np.flatnonzero(self.ring.states == held[role]).tolist():
+                    self._release(slot)
+                if role == "infer":
+                    # Annotated slots are in the pipe to results() or were never sent; results() frees the
+                    # unsent ones once it has read everything the dead worker sent (it cannot send any more)
+                    annotated = np.flatnonzero(self.ring.states == ANNOTATED)
+                    pairs = list(zip(annotated.tolist(), self.ring.frame_numbers[annotated].tolist()))
+                    self.annotated_writer.send((_RECLAIM, 0, 0.0, pairs, None))
+                if self.max_restarts is not None and self.restarts[role] >= self.max_restarts:
+                    del self.workers[role]
+                    continue
+                if self.stop_event.wait(self.restart_seconds):
+                    return
+                self.restarts[role] += 1
+                self._spawn(role)
+
+    def results(self):
+        """(annotated frame, metadata) in order until the source ends or the pipeline stops; frames are copies"""
+        while not self.stop_event.is_set():
+            # Workers record trace spans while this process does
+            if registry.trace is not None and not self.tracing.is_set():
+                self.tracing.set()
+            elif registry.trace is None and self.tracing.is_set():
+                self.tracing.clear()
+            if not self.annotated.poll(POLL_SECONDS):
+                continue
+            slot, frame_number, time_stamp, metadata, metrics = self.annotated.recv()
+            if metrics is not None:
+                registry.apply(metrics)
+            if slot == _END:
+                self._finished = True
+                return
+            if slot == _RECLAIM:
+                # metadata holds (slot, frame number) of the slots annotated when the worker died
+                for unsent, unsent_frame in metadata:
+                    if self.ring.states[unsent] == ANNOTATED and self.ring.frame_numbers[unsent] == unsent_frame:
+                        self._release(unsent)
+                        self.failed += 1
+                continue
+            # The slot is reused as soon as it is released, while viewers may still be encoding this frame
+            frame = None if metadata is None else self.ring.frames[slot].copy()
+            self._release(slot)
+            if frame is None:
+                self.failed += 1
+                continue
+            self.served += 1
+            yield frame, metadata
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout: float = 5.0):
+        """Wait for the workers (terminating any still running after timeout) and free the ring"""
+        deadline = time.monotonic() + timeout
+        # The consumer of results() and a shutdown handler may both join
+        with self._join_lock:
+            for worker in list(self.workers.values()):
+                worker.join(max(deadline - time.monotonic(), 0))
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+            if self._supervisor.is_alive():
+                self._supervisor.join()
+            if self.ring.frames is not None:
+                self.ring.close()
+
+    def stats(self) -> dict:
+        workers = {}
+        for role in WORKER_ROLES:
+            counters = self.counters[role]
+            worker = self.workers.get(role)
+            frames = int(counters[FRAMES])
+            workers[role] = {
+                "pid": worker.pid if worker is not None else None,
+                "alive": worker is not None and worker.is_alive(),
+                "restarts": self.restarts[role],
+                "frames": frames,
+                "errors": int(counters[ERRORS]),
+                "mean_ms": counters[SECONDS] / frames * 1000 if frames else 0.0,
+            }
+        slots = self.ring.state_counts() if self.ring.frames is not None else {}
+        return {"workers": workers, "slots": slots, "served": self.served, "failed": self.failed,
+                "finished": self._finished}
@@ -1,9 +1,36 @@
 import React, { useState, useEffect, useRef } from 'react';
 
-const VideoStream = ({ streamId }) => {
+// Append query parameters to a stream URL that may already have some
+const withParams = (url, params) => {
+  const query = new URLSearchParams(params).toString();
+  return `${url}${url.includes('?') ? '&' : '?'}${query}`;
+};
+
+// How a tile receives frames (override per camera with "delivery" in its config):
+// sse      - one connection; the server pushes every frame with its vehicles and speeds
+// snapshot - one long-polling request per frame (snapshot.jpg?after=<sequence>&wait=<seconds>)
+// mjpeg    - one multipart connection, frames only
+const DEFAULT_DELIVERY = 'sse';
+const LONG_POLL_SECONDS = 5;
+const RETRY_MS = 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// One line about the vehicles on a frame, for the tile header
+const describe = (metadata) => {
+  if (!metadata || !metadata.vehicles) {
+    return '';
+  }
+  const speeds = metadata.vehicles.map((vehicle) => vehicle.speed);
+  const fastest = speeds.length ? ` - max ${Math.max(...speeds).toFixed(0)} km/h` : '';
+  return `${speeds.length} vehicles${fastest}`;
+};
+
+const VideoStream = ({ streamId, size = 'half' }) => {
   const [config, setConfig] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
   const [hasError, setHasError] = useState(false);
+  const [summary, setSummary] = useState('');
   const imgRef = useRef(null);
 
   useEffect(() => {
@@ -31,36 +58,101 @@ const VideoStream = ({ streamId }) => {
   }, [streamId]);
 
   useEffect(() => {
-    if (config && config.enabled) {
-      // For HTTP streams, we'll use an img element instead of video
-      setIsLoading(true);
+    if (!config || !config.enabled) {
+      return undefined;
+    }
+    setIsLoading(true);
+    setHasError(false);
+    const params = { size: config.size || size };
+    const shown = () => {
+      setIsLoading(false);
       setHasError(false);
+    };
+    const failed = () => {
+      setIsLoading(false);
+      setHasError(true);
+    };
+    const delivery = config.delivery || DEFAULT_DELIVERY;
 
-      // Test if the stream is accessible
-      const testImage = new Image();
-      testImage.onload = () => {
-        setIsLoading(false);
-        setHasError(false);
-      };
-      testImage.onerror = () => {
-        setIsLoading(false);
-        setHasError(true);
+    if (delivery === 'sse') {
+      const source = new EventSource(withParams(`${config.url}/sse`, params));
+      source.addEventListener('frame', (event) => {
+        const frame = JSON.parse(event.data);
+        if (imgRef.current) {
+          imgRef.current.src = `data:image/jpeg;base64,${frame.jpeg}`;
+        }
+        setSummary(describe(frame.metadata));
+        shown();
+      });
+      // EventSource reconnects by itself; only a closed source is an error
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+          failed();
+        }
       };
+      return () => source.close();
+    }
 
-      // Set a timestamp to force reload and avoid caching
-      const timestamp = new Date().getTime();
-      testImage.src = `${config.url}?t=${timestamp}`;
-
-      const interval = setInterval(() => {
-        if (imgRef.current) {
-          const timestamp = new Date().getTime();
-          imgRef.current.src = `${config.url}?t=${timestamp}`;
+    if (delivery === 'snapshot') {
+      const controller = new AbortController();
+      let stopped = false;
+      let sequence = null;
+      let objectUrl = null;
+      const poll = async () => {
+        while (!stopped) {
+          try {
+            // The first request takes the newest frame; every later one waits for the next
+            const query = sequence === null ? params : { ...params, after: sequence, wait: LONG_POLL_SECONDS };
+            const response = await fetch(withParams(`${config.url}/snapshot.jpg`, query),
+                                         { signal: controller.signal, cache: 'no-store' });
+            if (response.status === 200) {
+              sequence = Number(response.headers.get('X-Frame-Sequence'));
+              const url = URL.createObjectURL(await response.blob());
+              if (imgRef.current) {
+                imgRef.current.src = url;
+              }
+              if (objectUrl) {
+                URL.revokeObjectURL(objectUrl);
+              }
+              objectUrl = url;
+              shown();
+            } else if (response.status !== 304) {
+              failed();
+              await sleep(RETRY_MS);
+            }
+          } catch (error) {
+            if (!stopped) {
+              failed();
+              await sleep(RETRY_MS);
+            }
+          }
         }
-      }, 100); // Update every 100ms
+      };
+      poll();
+      return () => {
+        stopped = true;
+        controller.abort();
+        if (objectUrl) {
+          URL.revokeObjectURL(objectUrl);
+        }
+      };
+    }
 
-      return () => clearInterval(interval);
+    // mjpeg: a single long-lived request; the browser swaps in each frame as it arrives
+    const img = imgRef.current;
+    if (!img) {
+      return undefined;
     }
-  }, [config]);
+    img.onload = shown;
+    img.onerror = failed;
+    img.src = withParams(config.url, params);
+    return () => {
+      img.onload = null;
+      img.onerror = null;
+      // Dropping the source closes the connection
+      img.src = '';
+    };
+  }, [config, size]);
 
   if (!config) {
     return (
@@ -85,7 +177,9 @@ const VideoStream = ({ streamId }) => {
 
   return (
     <div className="video-container">
-      <div className="video-header">{config.name}</div>
+      <div className="video-header">
+        {config.name}{summary && ` - ${summary}`}
+      </div>
       {isLoading && (
         <div className="video-loading">
           Connecting to stream...
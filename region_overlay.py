@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+import cv2
+
+
+class RegionOverlay:
+    """
+    Semi-transparent region fill plus polygon outline, precomputed once.
+
+    The outline and point markers are rasterised at startup and everything is
+    restricted to the bounding rectangle of the region, so apply() is a single
+    uint8 blend of that rectangle done in place, whatever the number of vehicles.
+    Each thread blends into its own scratch buffer, so apply() may run on several
+    annotation workers at once.
+    """
+    def __init__(self, region_mask_obj, region_points: list, color=(144, 238, 144), alpha: float = 0.25,
+                 outline_thickness: int = 3, point_radius: int = 5):
+        self.color = np.array(color, dtype=np.uint8)
+        self.alpha = alpha
+        fill = region_mask_obj.populated_mask == 1
+
+        # Draw the outline and the point markers once on a blank canvas
+        outline = np.zeros(fill.shape, dtype=np.uint8)
+        if len(region_points) > 0:
+            points_array = np.array(region_points, dtype=np.int32)
+            cv2.polylines(outline, [points_array], isClosed=True, color=1, thickness=outline_thickness)
+            for point in region_points:
+                cv2.circle(outline, tuple(int(v) for v in point), point_radius, 1, -1)
+        outline = outline == 1
+
+        x, y, width, height = cv2.boundingRect((fill | outline).astype(np.uint8))
+        self.rect = (slice(y, y + height), slice(x, x + width))
+        self.fill_mask = (fill & ~outline)[self.rect].astype(np.uint8)
+        self.outline_mask = outline[self.rect].astype(np.uint8)
+        self.tint = np.empty((height, width, 3), dtype=np.uint8)
+        self.tint[:] = self.color
+        self._scratch = threading.local()
+
+    def _blend_buffer(self) -> np.ndarray:
+        blended = getattr(self._scratch, "blended", None)
+        if blended is None:
+            blended = self._scratch.blended = np.empty(self.tint.shape, dtype=np.uint8)
+        return blended
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """Blend the overlay into frame in place and return it"""
+        roi = frame[self.rect]
+        if roi.size == 0:
+            return frame
+        blended = self._blend_buffer()
+        cv2.addWeighted(roi, 1 - self.alpha, self.tint, self.alpha, 0, dst=blended)
+        # cv2.copyTo writes through the roi view, so the frame is updated in place
+        cv2.copyTo(blended, self.fill_mask, roi)
+        cv2.copyTo(self.tint, self.outline_mask, roi)
+        return frame
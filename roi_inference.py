@@ -0,0 +1,151 @@
+import cv2
+import numpy as np
+
+from box_batch import Detections, DetectionsResult, _to_numpy, boxes_to_arrays
+
+INFERENCE_MODES = ("full", "crop", "tiles")
+
+
+def region_bounds(region_points: list, image_width: int, image_height: int, margin: int = 0):
+    """(x1, y1, x2, y2) bounding rectangle of the region polygon plus margin, clipped to the frame"""
+    if not region_points:
+        return 0, 0, image_width, image_height
+    points = np.array(region_points, dtype=np.int32).reshape(-1, 2)
+    x, y, w, h = cv2.boundingRect(points)
+    return (max(x - margin, 0), max(y - margin, 0),
+            min(x + w + margin, image_width), min(y + h + margin, image_height))
+
+
+def tile_grid(x1: int, y1: int, x2: int, y2: int, tile_size: int, overlap: int) -> list:
+    """(x1, y1, x2, y2) tiles of at most tile_size covering the rectangle, neighbours overlapping by overlap"""
+    def starts(low, high):
+        if high - low <= tile_size:
+            return [low]
+        step = tile_size - overlap
+        positions = list(range(low, high - tile_size, step))
+        return positions + [high - tile_size]
+    return [(tx, ty, min(tx + tile_size, x2), min(ty + tile_size, y2))
+            for ty in starts(y1, y2) for tx in starts(x1, x2)]
+
+
+class RegionDetector:
+    """
+    Runs the detector only where region_points can produce a violation.
+
+    "full" tracks the whole frame (the old behaviour). "crop" tracks the bounding rectangle
+    of the region plus margin, and shifts the boxes back to frame coordinates. "tiles" cuts
+    the same rectangle out of the native-resolution frame into tile_size tiles, so far-away
+    vehicles keep their full resolution, and adds the working-resolution crop for vehicles
+    larger than a tile; all of them go to the detector in one batched predict call. Boxes
+    cut by an inner tile edge are dropped, duplicates are merged by NMS, and the result is
+    scaled to the working frame and handed to `tracker` (a multi_camera.ByteTrackTracker).
+
+    __call__(frame, native_frame) returns (xyxy int32, tracker ids, confs) in frame coordinates.
+    """
+    def __init__(self, model, region_points: list, image_width: int = 1280, image_height: int = 720,
+                 mode: str = "crop", margin: int = 32, tile_size: int = 640, tile_overlap: int = 128,
+                 tracker=None, track_kwargs: dict = None, predict_kwargs: dict = None, nms_iou: float = 0.5):
+        if mode not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode {mode!r}, expected one of {INFERENCE_MODES}")
+        if mode == "tiles" and tracker is None:
+            raise ValueError("Tiled inference needs a tracker (e.g. multi_camera.ByteTrackTracker)")
+        self.model = model
+        self.mode = mode
+        self.image_width = image_width
+        self.image_height = image_height
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tracker = tracker
+        self.track_kwargs = track_kwargs or {}
+        self.predict_kwargs = predict_kwargs or {}
+        self.nms_iou = nms_iou
+        self.bounds = region_bounds(region_points, image_width, image_height, margin) if mode != "full" \
+            else (0, 0, image_width, image_height)
+        self._tiles_for = {}
+        self.frames = 0
+        self.pixels = 0
+        self.frame_pixels = 0
+
+    def pixel_share(self) -> float:
+        """Pixels sent to the detector relative to the whole frame they were cut from"""
+        return self.pixels / self.frame_pixels if self.frame_pixels else 0.0
+
+    def tiles(self, native_width: int, native_height: int):
+        """(bounds, tile rectangles) in native-frame coordinates, cached per native size"""
+        key = (native_width, native_height)
+        if key not in self._tiles_for:
+            sx, sy = native_width / self.image_width, native_height / self.image_height
+            x1, y1, x2, y2 = self.bounds
+            native_bounds = (int(x1 * sx), int(y1 * sy), min(int(np.ceil(x2 * sx)), native_width),
+                             min(int(np.ceil(y2 * sy)), native_height))
+            self._tiles_for[key] = native_bounds, tile_grid(*native_bounds, self.tile_size, self.tile_overlap)
+        return self._tiles_for[key]
+
+    def __call__(self, frame: np.ndarray, native_frame: np.ndarray = None):
+        self.frames += 1
+        if self.mode == "full":
+            self.pixels += frame.shape[0] * frame.shape[1]
+            self.frame_pixels += frame.shape[0] * frame.shape[1]
+            return boxes_to_arrays(self.model.track(frame, **self.track_kwargs)[0].boxes)
+        if self.mode == "crop":
+            x1, y1, x2, y2 = self.bounds
+            self.pixels += (x2 - x1) * (y2 - y1)
+            self.frame_pixels += frame.shape[0] * frame.shape[1]
+            result = self.model.track(frame[y1:y2, x1:x2], **self.track_kwargs)[0]
+            xyxy, tracker_ids, confs = boxes_to_arrays(result.boxes)
+            return xyxy + np.array([x1, y1, x1, y1], dtype=np.int32), tracker_ids, confs
+        return self._track_tiles(frame, native_frame if native_frame is not None else frame)
+
+    def detect_tiles(self, frame: np.ndarray, native_frame: np.ndarray) -> Detections:
+        """Merged, untracked detections of the tiles and of the whole crop, in working-frame coordinates"""
+        native_height, native_width = native_frame.shape[:2]
+        (left, top, right, bottom), tiles = self.tiles(native_width, native_height)
+        x1, y1, x2, y2 = self.bounds
+        images = [native_frame[ty1:ty2, tx1:tx2] for tx1, ty1, tx2, ty2 in tiles] + [frame[y1:y2, x1:x2]]
+        self.pixels += sum(image.shape[0] * image.shape[1] for image in images)
+        self.frame_pixels += native_width * native_height
+        results = self.model.predict(images, **self.predict_kwargs)
+
+        scale = np.array([self.image_width / native_width, self.image_height / native_height] * 2, dtype=np.float32)
+        xyxy, confs, classes = [], [], []
+        for (tx1, ty1, tx2, ty2), result in zip(tiles, results):
+            boxes = result.boxes
+            if boxes is None or len(boxes) == 0:
+                continue
+            tile_xyxy = _to_numpy(boxes.xyxy).reshape(-1, 4).astype(np.float32)
+            # Drop boxes touching an edge this tile shares with a neighbour: they are cut off here,
+            # and whole in a neighbouring tile (small vehicles) or in the crop pass (large ones)
+            cut = np.zeros(len(tile_xyxy), dtype=bool)
+            if tx1 > left:
+                cut |= tile_xyxy[:, 0] <= 1
+            if ty1 > top:
+                cut |= tile_xyxy[:, 1] <= 1
+            if tx2 < right:
+                cut |= tile_xyxy[:, 2] >= tx2 - tx1 - 1
+            if ty2 < bottom:
+                cut |= tile_xyxy[:, 3] >= ty2 - ty1 - 1
+            keep = ~cut
+            xyxy.append((tile_xyxy[keep] + np.array([tx1, ty1, tx1, ty1], dtype=np.float32)) * scale)
+            confs.append(_to_numpy(boxes.conf).reshape(-1)[keep])
+            classes.append(_to_numpy(boxes.cls).reshape(-1)[keep])
+        boxes = results[-1].boxes
+        if boxes is not None and len(boxes):
+            xyxy.append(_to_numpy(boxes.xyxy).reshape(-1, 4).astype(np.float32) +
+                        np.array([x1, y1, x1, y1], dtype=np.float32))
+            confs.append(_to_numpy(boxes.conf).reshape(-1))
+            classes.append(_to_numpy(boxes.cls).reshape(-1))
+        if not xyxy:
+            return Detections(np.empty((0, 4)), np.empty(0), np.empty(0))
+        xyxy, confs, classes = np.concatenate(xyxy), np.concatenate(confs), np.concatenate(classes)
+
+        # A vehicle seen whole by two tiles, or by a tile and the crop pass, is kept once
+        if len(xyxy) > 1:
+            xywh = np.concatenate([xyxy[:, :2], xyxy[:, 2:] - xyxy[:, :2]], axis=1)
+            keep = np.array(cv2.dnn.NMSBoxes(xywh.tolist(), confs.tolist(), 0.0, self.nms_iou), dtype=np.int64)
+            keep = np.sort(keep.reshape(-1))
+            xyxy, confs, classes = xyxy[keep], confs[keep], classes[keep]
+        return Detections(xyxy, confs, classes)
+
+    def _track_tiles(self, frame: np.ndarray, native_frame: np.ndarray):
+        # The tracker also runs on empty frames, so lost tracks age out
+        return self.tracker.update(DetectionsResult(self.detect_tiles(frame, native_frame)), frame)
@@ -0,0 +1,196 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+from vehicle_class import SCALING_FACTOR
+
+
+class SpeedEstimator(ABC):
+    """
+    Batched speed estimator over VehicleStore slots.
+
+    update() takes the road-plane position of every active track in the current
+    frame and returns their speeds (0 until a track has min_samples samples).
+    Per-frame cost is bounded per track, whatever the length of the track.
+    """
+    def __init__(self, capacity: int, window: int = 25, min_samples: int = 5, scaling_factor: float = SCALING_FACTOR):
+        self.capacity = capacity
+        self.window = window
+        self.min_samples = min(min_samples, window)
+        self.scaling_factor = scaling_factor
+        self.count = np.zeros(capacity, dtype=np.int64)
+
+    def reset(self, slots):
+        """Forget everything about these slots (called when a slot gets a new track)"""
+        self.count[slots] = 0
+
+    @abstractmethod
+    def update(self, slots: np.ndarray, time_stamp, positions: np.ndarray) -> np.ndarray:
+        """Speeds (km/h) of the tracks in slots, given their positions at time_stamp"""
+
+    def _to_speed(self, velocity: np.ndarray, ready: np.ndarray) -> np.ndarray:
+        speed = np.hypot(velocity[:, 0], velocity[:, 1]) * self.scaling_factor
+        return np.where(ready, speed, 0.0).astype(np.float32)
+
+
+class _WindowedEstimator(SpeedEstimator):
+    """Keeps the last `window` (time, x, y) samples of each slot in a ring buffer"""
+    def __init__(self, capacity: int, window: int = 25, min_samples: int = 5, scaling_factor: float = SCALING_FACTOR):
+        super().__init__(capacity, window, min_samples, scaling_factor)
+        self.times = np.zeros((capacity, window), dtype=np.float64)
+        self.positions = np.zeros((capacity, window, 2), dtype=np.float64)
+        # Times are stored relative to each track's first sample to keep the sums well conditioned
+        self.origin = np.zeros(capacity, dtype=np.float64)
+
+    def _push(self, slots, time_stamp, positions):
+        time_stamp = np.broadcast_to(np.asarray(time_stamp, dtype=np.float64), slots.shape)
+        count = self.count[slots]
+        new = count == 0
+        self.origin[slots[new]] = time_stamp[new]
+        position = count % self.window
+        evicted = (self.times[slots, position], self.positions[slots, position], count >= self.window)
+        relative_time = time_stamp - self.origin[slots]
+        self.times[slots, position] = relative_time
+        self.positions[slots, position] = positions
+        self.count[slots] = count + 1
+        return relative_time, evicted
+
+
+class LeastSquaresEstimator(_WindowedEstimator):
+    """
+    Least-squares line through the last `window` positions of each track.
+    The regression sums are updated incrementally (add the new sample, subtract
+    the one leaving the window), so each frame costs O(1) per track.
+    """
+    def __init__(self, capacity: int, window: int = 25, min_samples: int = 5, scaling_factor: float = SCALING_FACTOR):
+        super().__init__(capacity, window, min_samples, scaling_factor)
+        # Columns: sum t, sum t^2, sum x, sum y, sum t*x, sum t*y
+        self.sums = np.zeros((capacity, 6), dtype=np.float64)
+
+    def reset(self, slots):
+        super().reset(slots)
+        self.sums[slots] = 0
+
+    @staticmethod
+    def _terms(t, xy):
+        return np.stack([t, t * t, xy[:, 0], xy[:, 1], t * xy[:, 0], t * xy[:, 1]], axis=1)
+
+    def update(self, slots, time_stamp, positions):
+        slots = np.asarray(slots, dtype=np.intp)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        relative_time, (old_t, old_xy, full) = self._push(slots, time_stamp, positions)
+
+        sums = self.sums[slots] + self._terms(relative_time, positions)
+        sums -= self._terms(old_t, old_xy) * full[:, None]
+        self.sums[slots] = sums
+
+        n = np.minimum(self.count[slots], self.window).astype(np.float64)
+        denominator = n * sums[:, 1] - sums[:, 0] ** 2
+        safe = np.where(denominator > 1e-9, denominator, 1.0)
+        velocity = np.stack([(n * sums[:, 4] - sums[:, 0] * sums[:, 2]) / safe,
+                             (n * sums[:, 5] - sums[:, 0] * sums[:, 3]) / safe], axis=1)
+        return self._to_speed(velocity, (n >= self.min_samples) & (denominator > 1e-9))
+
+
+class MedianSlopeEstimator(_WindowedEstimator):
+    """
+    Robust estimator: median of the velocities between samples half a window apart.
+    A single jittery box moves only a couple of the slopes, not the median.
+    Cost is O(window) per track per frame.
+    """
+    def update(self, slots, time_stamp, positions):
+        slots = np.asarray(slots, dtype=np.intp)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self._push(slots, time_stamp, positions)
+
+        count = self.count[slots]
+        n = np.minimum(count, self.window)
+        half = n // 2
+        # Chronological order of each slot's ring: oldest sample first
+        offsets = np.arange(self.window // 2)
+        first = (count - n)[:, None]
+        i = (first + offsets) % self.window
+        j = (first + offsets + half[:, None]) % self.window
+        valid = offsets[None, :] < half[:, None]
+
+        rows = slots[:, None]
+        dt = self.times[rows, j] - self.times[rows, i]
+        valid &= dt > 0
+        dt = np.where(valid, dt, 1.0)
+        slopes = (self.positions[rows, j] - self.positions[rows, i]) / dt[..., None]
+        slopes[~valid] = np.nan
+
+        ready = (n >= self.min_samples) & valid.any(axis=1)
+        velocity = np.zeros((len(slots), 2))
+        if ready.any():
+            velocity[ready] = np.nanmedian(slopes[ready], axis=1)
+        return self._to_speed(velocity, ready)
+
+
+class KalmanEstimator(SpeedEstimator):
+    """
+    Constant-velocity Kalman filter per track, run for all tracks at once.
+    Both axes share the same noise model, so one 2x2 covariance per track serves x and y.
+    `window` is unused; the filter is recursive with O(1) cost per frame.
+    """
+    def __init__(self, capacity: int, window: int = 25, min_samples: int = 5, scaling_factor: float = SCALING_FACTOR,
+                 measurement_noise: float = 0.5, acceleration_noise: float = 2.0, initial_speed_noise: float = 50.0):
+        super().__init__(capacity, window, min_samples, scaling_factor)
+        self.r = measurement_noise ** 2
+        self.q = acceleration_noise ** 2
+        self.initial_velocity_variance = initial_speed_noise ** 2
+        self.state = np.zeros((capacity, 4), dtype=np.float64)  # x, y, vx, vy
+        self.covariance = np.zeros((capacity, 3), dtype=np.float64)  # p_pos, p_pos_vel, p_vel
+        self.last_time = np.zeros(capacity, dtype=np.float64)
+
+    def update(self, slots, time_stamp, positions):
+        slots = np.asarray(slots, dtype=np.intp)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        time_stamp = np.broadcast_to(np.asarray(time_stamp, dtype=np.float64), slots.shape)
+
+        new = self.count[slots] == 0
+        if new.any():
+            new_slots = slots[new]
+            self.state[new_slots, :2] = positions[new]
+            self.state[new_slots, 2:] = 0
+            self.covariance[new_slots] = (self.r, 0.0, self.initial_velocity_variance)
+            self.last_time[new_slots] = time_stamp[new]
+
+        state = self.state[slots]
+        p00, p01, p11 = self.covariance[slots].T
+        dt = np.maximum(time_stamp - self.last_time[slots], 0.0)
+
+        # Predict
+        state[:, :2] += state[:, 2:] * dt[:, None]
+        p00 = p00 + dt * (2 * p01 + dt * p11) + self.q * dt ** 4 / 4
+        p01 = p01 + dt * p11 + self.q * dt ** 3 / 2
+        p11 = p11 + self.q * dt ** 2
+
+        # Update (skipped for brand new tracks, which were just initialised from this sample)
+        gain_position = np.where(new, 0.0, p00 / (p00 + self.r))
+        gain_velocity = np.where(new, 0.0, p01 / (p00 + self.r))
+        innovation = positions - state[:, :2]
+        state[:, :2] += gain_position[:, None] * innovation
+        state[:, 2:] += gain_velocity[:, None] * innovation
+        p11 = p11 - gain_velocity * p01
+        p01 = (1 - gain_position) * p01
+        p00 = (1 - gain_position) * p00
+
+        self.state[slots] = state
+        self.covariance[slots] = np.stack([p00, p01, p11], axis=1)
+        self.last_time[slots] = time_stamp
+        self.count[slots] += 1
+        return self._to_speed(state[:, 2:], self.count[slots] >= self.min_samples)
+
+
+ESTIMATORS = {
+    "least_squares": LeastSquaresEstimator,
+    "kalman": KalmanEstimator,
+    "median": MedianSlopeEstimator,
+}
+
+
+def make_estimator(name: str, capacity: int, **kwargs) -> SpeedEstimator:
+    """Build an estimator by name: one of ESTIMATORS"""
+    if name not in ESTIMATORS:
+        raise ValueError(f"Unknown speed estimator {name!r}, expected one of {sorted(ESTIMATORS)}")
+    return ESTIMATORS[name](capacity, **kwargs)
@@ -2,66 +2,101 @@
 """
 System startup script for the video streaming application.
 This script starts both the video stream server and opens the React app.
+With --processes the stream server decodes and detects in worker processes
+(see process_pipeline.py). Ctrl+C stops both servers and waits for them.
 """
 
+import argparse
 import subprocess
 import sys
 import os
+import urllib.request
 import webbrowser
 import time
-import threading
 
-def start_stream_server():
+STREAM_SERVER_URL = "http://localhost:5000"
+STARTUP_TIMEOUT = 60  # seconds to wait for the stream server to answer (it loads the model first)
+SHUTDOWN_TIMEOUT = 10  # seconds a server gets to stop before it is killed
+
+def start_stream_server(processes=False):
     """Start the Flask video streaming server"""
     print("Starting video stream server...")
-    try:
-        subprocess.run([sys.executable, "stream_server.py"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error starting stream server: {e}")
-    except KeyboardInterrupt:
-        print("Stream server stopped by user")
+    command = [sys.executable, "stream_server.py"]
+    if processes:
+        command.append("--processes")
+    return subprocess.Popen(command)
 
 def start_react_app():
     """Start the React development server"""
     print("Starting React application...")
     react_dir = "react_app"
     try:
-        subprocess.run(["npm", "run", "dev"], cwd=react_dir, check=True)
-    except subprocess.CalledProcessError as e:
+        # npm is a .cmd script on Windows
+        return subprocess.Popen(["npm", "run", "dev"], cwd=react_dir, shell=os.name == "nt")
+    except OSError as e:
         print(f"Error starting React app: {e}")
-    except KeyboardInterrupt:
-        print("React app stopped by user")
+        return None
+
+def wait_for_stream_server(server, timeout=STARTUP_TIMEOUT):
+    """Wait until the stream server answers; False if it exited or did not come up in time"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            return False
+        try:
+            urllib.request.urlopen(f"{STREAM_SERVER_URL}/stats", timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.5)
+    return False
 
 def open_browser():
     """Open the browser to view the application"""
-    time.sleep(3)  # Wait for servers to start
     print("Opening browser...")
     webbrowser.open("http://localhost:5173")  # Vite dev server default port
 
+def stop(name, process):
+    """Ask a server to stop (the stream server then stops its worker processes), kill it if it hangs"""
+    if process is None or process.poll() is not None:
+        return
+    print(f"Stopping {name}...")
+    process.terminate()
+    try:
+        process.wait(SHUTDOWN_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start the stream server and the React app")
+    parser.add_argument("--processes", action="store_true",
+                        help="Run decoding and detection in worker processes of the stream server")
+    args = parser.parse_args()
+
     print("🚀 Starting Video Streaming System")
     print("=" * 50)
 
-    # Start stream server in a separate thread
-    stream_thread = threading.Thread(target=start_stream_server, daemon=True)
-    stream_thread.start()
-
-    # Start React app in a separate thread
-    react_thread = threading.Thread(target=start_react_app, daemon=True)
-    react_thread.start()
+    stream_server = start_stream_server(args.processes)
+    react_app = start_react_app()
 
-    # Open browser
-    open_browser()
+    try:
+        if not wait_for_stream_server(stream_server):
+            print("Error starting stream server")
+        # Open browser
+        open_browser()
 
-    print("\n✅ System started!")
-    print("📹 Video stream: http://localhost:5000")
-    print("🖥️  React app: http://localhost:5173")
-    print("\nPress Ctrl+C to stop all servers")
+        print("\n✅ System started!")
+        print(f"📹 Video stream: {STREAM_SERVER_URL}")
+        print("🖥️  React app: http://localhost:5173")
+        print("\nPress Ctrl+C to stop all servers")
 
-    try:
-        # Keep the main thread alive
-        while True:
+        # Keep the main thread alive for as long as the stream server runs
+        while stream_server.poll() is None:
             time.sleep(1)
+        print(f"Stream server exited with code {stream_server.returncode}")
     except KeyboardInterrupt:
         print("\n🛑 Shutting down system...")
+    finally:
+        stop("stream server", stream_server)
+        stop("React app", react_app)
         print("Goodbye!")
@@ -1,117 +1,208 @@
-from flask import Flask, Response
-from ultralytics import YOLO
+from flask import Flask, Response, jsonify, request
+import argparse
 import cv2
-from draw_regions import region_class
-from vehicle_class import vehicle_class, speed_cop
-import json
-from mask import mask
+import functools
+import os
+import signal
+import sys
 import threading
 import time
+from box_batch import boxes_to_arrays
+from calibration import CameraCalibration
+from traffic_processor import TrafficProcessor
+from vehicle_store import VehicleStore
+from pipeline import DropFrame, FramePacket, Pipeline, Stage
+from frame_scheduler import CaptureClock, FrameScheduler, read_scheduled
+from detector_backend import LazyDetector, load_detector
+from video_capture import open_capture
+from process_pipeline import ProcessPipeline, TrackAndAnnotate, VideoSource
+from event_log import open_event_log, query_events
+from broadcast import DEFAULT_RENDITIONS, BroadcastProducer, RenditionBroadcaster
+from frame_delivery import rendition_response, snapshot_response, sse_response
+from metrics import STAGE_SECONDS, registry, stage_timer
+from multi_camera import (ByteTrackTracker, MultiCameraEngine, UltralyticsBatchDetector, default_processor_factory,
+                          load_camera_configs)
 
 app = Flask(__name__)
 
 # Video processing variables
 PATH_TO_VIDEO = r"demo_videos\video_1.mp4"
 MODEL_NAME = "yolov8n.pt"
+DETECTOR_BACKEND = "auto"  # auto, pytorch, onnx or openvino (see detector_backend.py)
+DETECTOR_DEVICE = None  # None: cuda:0 if PyTorch sees a GPU, else cpu
+DETECTOR_INPUT_SIZE = (384, 640)  # (height, width) the model runs at
+DETECTOR_THREADS = None  # CPU inference threads (None: all cores)
+DETECTOR_INT8 = False  # INT8-quantized ONNX/OpenVINO export
+MODEL_CACHE_DIR = "models"
 TRACKING_MODEL = "bytetrack.yaml"
 IMAGE_WIDTH = 1280
 IMAGE_HEIGHT = 720
-vehicle_tracker = {}
-SPEED_LIMIT = 100
-speed_cop = speed_cop(SPEED_LIMIT)
+CAMERA_PROFILE = "camera_profile.json"  # region, source/target points, scale and speed limits (see calibration.py)
+ANNOTATION_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 4
+TIME_NOT_DETECTED_THRESHOLD = 2  # seconds unseen after which a track is finalized and its state freed
+MAX_FRAME_LAG = 0.1  # seconds behind the source clock after which a frame is skipped, not processed
+TRACE_MAX_SECONDS = 30  # longest /trace recording
+DECODE_BACKEND = "opencv"  # opencv (decode, then resize) or ffmpeg (scaled while decoding; needs ffmpeg on PATH)
+CAMERA_CONFIG_DIR = os.path.join("react_app", "configs")
+BATCH_SIZE = 4  # camera frames per detector call
+EVENT_LOG_DIR = "events"
+EVENT_LOG_FORMATS = ("jsonl", "sqlite")  # jsonl, sqlite and/or parquet (needs pyarrow); /events queries sqlite
+# threads: /video_feed runs in this process; processes: decoding and detection/tracking/annotation run in
+# worker processes, passing frames through a shared-memory ring (see process_pipeline.py)
+PROCESS_MODE = "threads"
+FRAME_RING_SLOTS = 8  # 1280x720 frames in flight between the processes
+# Stream sizes clients can pick with ?size=: name -> (scale, JPEG quality)
+RENDITIONS = DEFAULT_RENDITIONS
 
-# Initialize the YOLO model
-model = YOLO(MODEL_NAME)
+def make_detector():
+    """The configured model on the best device available (each engine needs its own tracker state)"""
+    return load_detector(MODEL_NAME, DETECTOR_BACKEND, DETECTOR_DEVICE, DETECTOR_INPUT_SIZE, DETECTOR_THREADS,
+                         DETECTOR_INT8, MODEL_CACHE_DIR)
 
 # Global variables for streaming
-current_frame = None
-frame_lock = threading.Lock()
+model = None  # /video_feed's detector in threads mode; loaded on first use (processes mode loads it in its worker)
+model_lock = threading.Lock()
+video_producer = None
+video_feed_state = {}  # scheduler and pipeline of the running video feed, for /stats
+producer_lock = threading.Lock()
+multi_camera_engine = None
+engine_lock = threading.Lock()
+event_log = None
+event_log_lock = threading.Lock()
+trace_lock = threading.Lock()  # one /trace recording at a time
 
-def load_region_points():
-    """Load or create region points for masking"""
-    try:
-        with open("region_points.json", "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # Return a default region if no region_points.json exists
-        return [[(100, 100), (1100, 100), (1100, 600), (100, 600)]]
-
-def generate_frames():
-    """Generator function that yields video frames for streaming"""
-    global current_frame
-
-    # Initialize video capture
-    cap = cv2.VideoCapture(PATH_TO_VIDEO)
+def load_calibration():
+    """CAMERA_PROFILE compiled for IMAGE_WIDTH x IMAGE_HEIGHT: region, road-plane map, scale and speed limits"""
+    return CameraCalibration.load(CAMERA_PROFILE, IMAGE_WIDTH, IMAGE_HEIGHT)
+
+def get_model():
+    """/video_feed's detector, loading in the background from the first call on"""
+    global model
+    with model_lock:
+        if model is None:
+            model = LazyDetector(loader=make_detector)
+        return model
+
+def process_video():
+    """Generator of annotated frames of PATH_TO_VIDEO; runs once, shared by every viewer"""
+    # The weights load while the capture and calibration are set up; the first track() waits for them
+    model = get_model()
+    # Initialize video capture; frames come out at IMAGE_WIDTH x IMAGE_HEIGHT
+    cap = open_capture(PATH_TO_VIDEO, IMAGE_WIDTH, IMAGE_HEIGHT, DECODE_BACKEND)
     if not cap.isOpened():
         print("Error: Could not open video.")
         return
 
-    # Load region points
-    region_points = load_region_points()
+    # Load the camera's calibration and build the per-frame processing state
+    calibration = load_calibration()
+    traffic_processor = TrafficProcessor(calibration.region_points, calibration.source_points,
+                                         calibration.target_points, IMAGE_WIDTH, IMAGE_HEIGHT,
+                                         calibration.speed_limit, calibration.fine_speed_limit,
+                                         VehicleStore(time_not_detected_threshold=TIME_NOT_DETECTED_THRESHOLD,
+                                                      scaling_factor=calibration.scaling_factor),
+                                         event_log=get_event_log(), transformer=calibration.road_plane_map,
+                                         region_mask=calibration.region_mask)
+    detect_timer = stage_timer("detect")
+    # Frames are time-stamped from the source PTS and paced to the wall clock; late ones are skipped
+    capture_clock = CaptureClock(cap)
+    scheduler = FrameScheduler(MAX_FRAME_LAG)
 
-    # Build binary mask
-    image_w, image_h = IMAGE_WIDTH, IMAGE_HEIGHT
-    region_mask = mask(image_w, image_h, region_points)
-
-    frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+    def read_frame():
+        frame, time_stamp = read_scheduled(cap, capture_clock, scheduler)
+        if frame is None:
             # Loop the video
             cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            continue
-
-        frame = cv2.resize(frame, (IMAGE_WIDTH, IMAGE_HEIGHT))
+            capture_clock.rewind()
+            frame, time_stamp = read_scheduled(cap, capture_clock, scheduler)
+            if frame is None:
+                return None
+        return FramePacket(frame, time_stamp, capture_clock.frames)
 
+    def track_frame(packet):
+        # A frame that went stale waiting in the queue is not worth a detector call
+        if scheduler.is_stale(packet.time_stamp):
+            raise DropFrame()
         # Run YOLO tracking
-        result = model.track(frame, persist=True, tracker=TRACKING_MODEL, verbose=False)
-        if result and len(result) > 0:
-            boxes = result[0].boxes
-
-            for box in boxes:
-                # Skip boxes without a tracker id yet
-                if box.id is None:
-                    continue
+        with detect_timer.time():
+            result = model.track(packet.frame, persist=True, tracker=TRACKING_MODEL, verbose=False)[0]
+        traffic_processor.track(packet, *boxes_to_arrays(result.boxes))
 
-                conf = box.conf[0]
-                tracker_id = int(box.id[0].item()) if hasattr(box.id[0], 'item') else int(box.id[0])
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-
-                # Compute a representative point (bbox center) and test against mask
-                center_x = (x1 + x2) // 2
-                center_y = (y1 + y2) // 2
-                is_inside = region_mask.point_is_inside(center_x, center_y)
-
-                # Ensure vehicle object exists in tracker dict
-                if tracker_id not in vehicle_tracker:
-                    vehicle_tracker[tracker_id] = vehicle_class(tracker_id, region_points)
-                vehicle_object = vehicle_tracker[tracker_id]
-                vehicle_object.detected(float(conf), [x1, y1, x2, y2], bool(is_inside))
-
-                if is_inside:
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-
-        # Convert frame to JPEG
-        ret, buffer = cv2.imencode('.jpg', frame)
-        if not ret:
-            continue
-
-        frame_bytes = buffer.tobytes()
+    pipeline = Pipeline(read_frame, track_frame,
+                        [Stage("annotate", traffic_processor.annotate, workers=ANNOTATION_WORKERS)],
+                        queue_size=PIPELINE_QUEUE_SIZE).start()
+    video_feed_state.update(scheduler=scheduler, pipeline=pipeline)
+    try:
+        for packet in pipeline.results():
+            # JPEG encoding happens per rendition, once, when a viewer asks for it
+            yield packet.frame, traffic_processor.frame_metadata(packet)
+    finally:
+        # The producer was stopped (or the video ended): stop the worker threads
+        pipeline.stop()
+        pipeline.join()
+        traffic_processor.finish()
+        cap.release()
 
-        # Update the current frame for other endpoints
-        with frame_lock:
-            current_frame = frame_bytes
+def process_video_in_processes():
+    """process_video with decoding and detection, tracking and annotation in worker processes; encoding stays here"""
+    calibration = load_calibration()
+    job = TrackAndAnnotate(
+        functools.partial(load_detector, MODEL_NAME, DETECTOR_BACKEND, DETECTOR_DEVICE, DETECTOR_INPUT_SIZE,
+                          DETECTOR_THREADS, DETECTOR_INT8, MODEL_CACHE_DIR),
+        functools.partial(TrafficProcessor, calibration.region_points, calibration.source_points,
+                          calibration.target_points, IMAGE_WIDTH, IMAGE_HEIGHT, calibration.speed_limit,
+                          calibration.fine_speed_limit,
+                          VehicleStore(time_not_detected_threshold=TIME_NOT_DETECTED_THRESHOLD,
+                                       scaling_factor=calibration.scaling_factor),
+                          transformer=calibration.road_plane_map, region_mask=calibration.region_mask),
+        # The inference worker writes the events of its tracks itself
+        functools.partial(open_event_log, EVENT_LOG_DIR, EVENT_LOG_FORMATS),
+        {"persist": True, "tracker": TRACKING_MODEL, "verbose": False},
+    )
+    source = VideoSource(PATH_TO_VIDEO, IMAGE_WIDTH, IMAGE_HEIGHT, DECODE_BACKEND, MAX_FRAME_LAG)
+    pipeline = ProcessPipeline(source, job, FRAME_RING_SLOTS, IMAGE_WIDTH, IMAGE_HEIGHT).start()
+    video_feed_state.update(pipeline=pipeline)
+    try:
+        yield from pipeline.results()
+    finally:
+        pipeline.stop()
+        pipeline.join()
 
-        # Yield the frame for MJPEG streaming
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+def get_event_log():
+    """Open the event log on first use; every feed and camera writes to it"""
+    global event_log
+    with event_log_lock:
+        if event_log is None:
+            event_log = open_event_log(EVENT_LOG_DIR, EVENT_LOG_FORMATS)
+        return event_log
 
-        frame_count += 1
-        # Small delay to control frame rate
-        time.sleep(0.033)  # ~30 FPS
+def get_video_feed():
+    """Start the single video processing loop on first use; every viewer reads its broadcaster"""
+    global video_producer
+    with producer_lock:
+        if video_producer is None:
+            make_frames = process_video_in_processes if PROCESS_MODE == "processes" else process_video
+            video_producer = BroadcastProducer("video-feed", make_frames, RenditionBroadcaster(RENDITIONS))
+            video_producer.start()
+        return video_producer.broadcaster
 
-    cap.release()
+def get_multi_camera_engine():
+    """Start the multi-camera engine on first use: one decoder per configured camera, batched detection"""
+    global multi_camera_engine
+    with engine_lock:
+        if multi_camera_engine is None:
+            cameras = load_camera_configs(CAMERA_CONFIG_DIR)
+            # Cameras without a "calibration" profile of their own fall back on CAMERA_PROFILE's figures
+            calibration = load_calibration()
+            multi_camera_engine = MultiCameraEngine(
+                cameras, UltralyticsBatchDetector(LazyDetector(loader=make_detector)), ByteTrackTracker, BATCH_SIZE,
+                IMAGE_WIDTH, IMAGE_HEIGHT,
+                default_processor_factory(calibration.source_points, calibration.target_points, IMAGE_WIDTH,
+                                          IMAGE_HEIGHT, calibration.speed_limit, calibration.fine_speed_limit,
+                                          event_log=get_event_log()),
+                RENDITIONS, DECODE_BACKEND,
+            ).start()
+        return multi_camera_engine
 
 @app.route('/')
 def index():
@@ -129,23 +220,128 @@ def index():
     </html>
     '''
 
+def camera_broadcaster(cam_id):
+    """Broadcaster of one camera from react_app/configs, or None if it is not configured"""
+    camera = get_multi_camera_engine().cameras.get(cam_id)
+    return camera.broadcaster if camera is not None else None
+
 @app.route('/video_feed')
 def video_feed():
     """Video streaming route"""
-    return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+    return rendition_response(get_video_feed())
+
+@app.route('/video_feed/<int:cam_id>')
+def camera_feed(cam_id):
+    """Video stream of one camera from react_app/configs"""
+    broadcaster = camera_broadcaster(cam_id)
+    if broadcaster is None:
+        return f"Camera {cam_id} is not configured", 404
+    return rendition_response(broadcaster)
 
 @app.route('/current_frame.jpg')
+@app.route('/video_feed/snapshot.jpg')
 def current_frame_endpoint():
-    """Get current frame as JPEG"""
-    with frame_lock:
-        if current_frame is not None:
-            return Response(current_frame, mimetype='image/jpeg')
-        else:
-            return "No frame available", 404
+    """Get current frame as JPEG (conditional and long-polling, see snapshot_response)"""
+    return snapshot_response(get_video_feed())
+
+@app.route('/video_feed/<int:cam_id>/snapshot.jpg')
+def camera_snapshot(cam_id):
+    """Current frame of one camera as JPEG"""
+    broadcaster = camera_broadcaster(cam_id)
+    if broadcaster is None:
+        return f"Camera {cam_id} is not configured", 404
+    return snapshot_response(broadcaster)
+
+@app.route('/video_feed/sse')
+def video_feed_sse():
+    """Frames and their metadata pushed as server-sent events"""
+    return sse_response(get_video_feed())
+
+@app.route('/video_feed/<int:cam_id>/sse')
+def camera_sse(cam_id):
+    """Frames and metadata of one camera pushed as server-sent events"""
+    broadcaster = camera_broadcaster(cam_id)
+    if broadcaster is None:
+        return f"Camera {cam_id} is not configured", 404
+    return sse_response(broadcaster)
+
+@app.route('/stats')
+def stats():
+    """Encoder time and bytes sent per rendition, plus lag and dropped frames, of every running feed"""
+    feeds = {}
+    if video_producer is not None:
+        feeds['video_feed'] = {'renditions': video_producer.broadcaster.stats()}
+        if 'scheduler' in video_feed_state:
+            feeds['video_feed']['schedule'] = video_feed_state['scheduler'].stats()
+        if 'pipeline' in video_feed_state:
+            feeds['video_feed']['pipeline'] = video_feed_state['pipeline'].stats()
+    if multi_camera_engine is not None:
+        for cam_id, camera in multi_camera_engine.cameras.items():
+            feeds[f'video_feed/{cam_id}'] = {'renditions': camera.broadcaster.stats(),
+                                             'schedule': camera.decoder.scheduler.stats()}
+    if event_log is not None:
+        feeds['events'] = event_log.stats()
+    feeds['stages'] = registry.stats().get(STAGE_SECONDS, {})
+    return jsonify(feeds)
+
+@app.route('/metrics')
+def metrics():
+    """Stage timings and per-camera counters in the Prometheus text format"""
+    return Response(registry.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/trace')
+def trace():
+    """Chrome trace (chrome://tracing, Perfetto) of ?seconds= of processing, at most TRACE_MAX_SECONDS"""
+    seconds = min(request.args.get('seconds', 5.0, type=float), TRACE_MAX_SECONDS)
+    with trace_lock:
+        registry.start_trace()
+        time.sleep(seconds)
+        recorder = registry.stop_trace()
+    return jsonify(recorder.trace())
+
+@app.route('/events')
+def events():
+    """Logged events, e.g. /events?type=violation&min_speed=130&start=<unix time>&end=<unix time>"""
+    database = os.path.join(EVENT_LOG_DIR, "events.sqlite")
+    if not os.path.exists(database):
+        return jsonify([])
+    args = request.args
+    by = args.get('by', 'wall_time')
+    if by not in ('wall_time', 'time_stamp'):
+        return jsonify({'error': "by must be wall_time or time_stamp"}), 400
+    return jsonify(query_events(database, args.get('type'), args.get('min_speed', type=float),
+                                args.get('start', type=float), args.get('end', type=float),
+                                args.get('camera', type=int), by, args.get('limit', 1000, type=int)))
+
+def shutdown():
+    """Stop every running feed, letting worker processes finalize their tracks and event logs"""
+    if video_producer is not None:
+        video_producer.stop()
+        if 'pipeline' in video_feed_state:
+            video_feed_state['pipeline'].stop()
+            video_feed_state['pipeline'].join()
+    if multi_camera_engine is not None:
+        multi_camera_engine.stop()
+        multi_camera_engine.join(2)
+    if event_log is not None:
+        event_log.close()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Video stream server")
+    parser.add_argument('--processes', action='store_true',
+                        help="Decode and detect in worker processes (PROCESS_MODE = \"processes\")")
+    if parser.parse_args().processes:
+        PROCESS_MODE = "processes"
+    # start_system.py stops the server with SIGTERM: shut down as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     print("Starting video stream server...")
     print("Access the stream at: http://localhost:5000/video_feed")
     print("Or view in browser at: http://localhost:5000")
-    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+    try:
+        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # A second stop request (start_system.py after a Ctrl+C) must not cut the shutdown short
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        shutdown()
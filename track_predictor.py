@@ -0,0 +1,109 @@
+import numpy as np
+
+from box_batch import empty_arrays
+
+
+class TrackPredictor:
+    """
+    Carries tracked boxes forward between detector runs so the detector can skip frames.
+
+    Each track keeps its last box and a box velocity (pixels per second, for all four
+    corners, so boxes also grow as vehicles approach) smoothed by an alpha-beta filter,
+    the steady-state form of a constant-velocity Kalman filter. predict() moves every box
+    to the requested time. should_detect() asks for the real detector at least every
+    `interval` frames, and sooner when a box has moved more than motion_threshold of its
+    own height since the last detection, when the prediction error seen at the last
+    detection was over residual_threshold box heights, or when a new track has no
+    velocity yet. interval=1 runs the detector on every frame.
+    """
+    def __init__(self, interval: int = 1, motion_threshold: float = None, residual_threshold: float = None,
+                 beta: float = 0.5):
+        self.interval = interval
+        self.motion_threshold = motion_threshold
+        self.residual_threshold = residual_threshold
+        self.beta = beta
+        self.tracker_ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float64)
+        self.velocity = np.empty((0, 4), dtype=np.float64)
+        self.confs = np.empty(0, dtype=np.float32)
+        self.observations = np.empty(0, dtype=np.int64)
+        self.last_detection = None
+        self.frames_since_detection = 0
+        self.last_residual = 0.0  # largest prediction error at the last detection, in box heights
+        self.detections = 0
+        self.predictions = 0
+
+    def should_detect(self, time_stamp: float) -> bool:
+        """Whether the frame at time_stamp needs the real detector"""
+        if self.last_detection is None or self.frames_since_detection + 1 >= self.interval:
+            return True
+        if len(self.tracker_ids) == 0:
+            return False
+        if (self.observations < 2).any():
+            return True
+        if self.residual_threshold is not None and self.last_residual > self.residual_threshold:
+            return True
+        if self.motion_threshold is not None:
+            # Measured in box heights: once boxes move by a good part of their own size, IoU
+            # association in the tracker starts to fail, whatever the size in pixels
+            elapsed = time_stamp - self.last_detection
+            motion = np.abs(self.velocity).max(axis=1) * elapsed
+            heights = np.maximum(self.boxes[:, 3] - self.boxes[:, 1], 1.0)
+            if (motion / heights).max() > self.motion_threshold:
+                return True
+        return False
+
+    def update(self, xyxy: np.ndarray, tracker_ids: np.ndarray, confs: np.ndarray, time_stamp: float):
+        """Correct the tracks with a detector frame; returns the detector's arrays unchanged"""
+        boxes = xyxy.astype(np.float64)
+        velocity = np.zeros_like(boxes)
+        observations = np.ones(len(tracker_ids), dtype=np.int64)
+        self.last_residual = 0.0
+        if len(self.tracker_ids) and len(tracker_ids) and self.last_detection is not None:
+            elapsed = time_stamp - self.last_detection
+            order = np.argsort(self.tracker_ids)
+            position = np.searchsorted(self.tracker_ids, tracker_ids, sorter=order)
+            position = order[np.minimum(position, len(order) - 1)]
+            known = self.tracker_ids[position] == tracker_ids
+            if known.any() and elapsed > 0:
+                previous = position[known]
+                predicted = self.boxes[previous] + self.velocity[previous] * elapsed
+                residual = boxes[known] - predicted
+                seen_before = self.observations[previous]
+                # A track's second observation gives its first velocity; later ones correct it
+                velocity[known] = np.where((seen_before >= 2)[:, None],
+                                           self.velocity[previous] + self.beta * residual / elapsed,
+                                           (boxes[known] - self.boxes[previous]) / elapsed)
+                observations[known] = seen_before + 1
+                settled = seen_before >= 2
+                if settled.any():
+                    heights = np.maximum(boxes[known][settled, 3] - boxes[known][settled, 1], 1.0)
+                    self.last_residual = float((np.abs(residual[settled]).max(axis=1) / heights).max())
+        self.tracker_ids = np.asarray(tracker_ids, dtype=np.int64)
+        self.boxes = boxes
+        self.velocity = velocity
+        self.confs = np.asarray(confs, dtype=np.float32)
+        self.observations = observations
+        self.last_detection = time_stamp
+        self.frames_since_detection = 0
+        self.detections += 1
+        return xyxy, tracker_ids, confs
+
+    def predict(self, time_stamp: float):
+        """(xyxy int32, tracker ids, confs) of every track moved forward to time_stamp"""
+        self.frames_since_detection += 1
+        self.predictions += 1
+        if self.last_detection is None or len(self.tracker_ids) == 0:
+            return empty_arrays()
+        boxes = self.boxes + self.velocity * (time_stamp - self.last_detection)
+        return np.round(boxes).astype(np.int32), self.tracker_ids, self.confs
+
+    def stats(self) -> dict:
+        frames = self.detections + self.predictions
+        return {
+            "frames": frames,
+            "detections": self.detections,
+            "predictions": self.predictions,
+            "detector_share": self.detections / frames if frames else 0.0,
+            "last_residual": self.last_residual,
+        }
@@ -0,0 +1,204 @@
+import cv2
+import numpy as np
+
+from box_batch import bottom_centres, speed_classes, SPEED_CLASS_COLOURS
+from event_log import make_event
+from mask import mask
+from metrics import registry, stage_timer
+from region_overlay import RegionOverlay
+from vehicle_class import ViewTransformer
+from vehicle_store import VehicleStore
+
+
+class TrafficProcessor:
+    """
+    What the speed camera does with one camera's frames once the detector has run.
+
+    track() turns the frame's tracked boxes into speeds and must see frames in order;
+    annotate() only draws on the packet's own frame, so it can run on several threads;
+    record() keeps the evidence ring in frame order and hands violations to the
+    evidence writer. process() does all three in sequence.
+
+    With an event_log (see event_log.py), track() also emits track_start, per-interval
+    speed, violation and track_end events for camera_id.
+
+    frame_metadata() is what the frame's viewers get alongside it (see broadcast.sse_stream).
+
+    Each step is timed into traffic_stage_seconds and frames, detections, violations,
+    active tracks and dropped frames are counted per camera_id (see metrics.py). A frame
+    is counted as dropped when the frame numbers reaching track() skip it: it was grabbed
+    but never tracked (late, stale, or replaced by a newer frame).
+
+    When a track expires (or finish() ends them all) its VehicleStore.summary is the
+    track_end event's data and is passed to on_summary, if set, before the slot is freed.
+
+    With a verifier (see violation_verifier.py), track() hands it the tracks inside the
+    region over its suspect_speed, with the frame they are in before anything is drawn on it.
+    Violations then go to the verifier instead of straight to the evidence writer, so only
+    the ones its heavy model confirms are written.
+    """
+    def __init__(self, region_points: list, source_points: np.ndarray, target_points: np.ndarray,
+                 image_width: int = 1280, image_height: int = 720, speed_limit: float = 120,
+                 fine_speed_limit: float = 130, vehicle_store: VehicleStore = None, evidence_buffer=None,
+                 evidence_writer=None, event_log=None, camera_id: int = None, transformer=None, region_mask=None,
+                 verifier=None):
+        self.region_points = region_points
+        # region_mask and transformer can come precompiled, e.g. from a calibration.CameraCalibration
+        self.region_mask = region_mask if region_mask is not None else mask(image_width, image_height, region_points)
+        self.region_overlay = RegionOverlay(self.region_mask, region_points)
+        self.transformer = transformer if transformer is not None else ViewTransformer(source_points, target_points)
+        self.vehicle_store = vehicle_store if vehicle_store is not None else VehicleStore()
+        self.evidence_buffer = evidence_buffer
+        self.evidence_writer = evidence_writer
+        self.speed_limit = speed_limit
+        self.fine_speed_limit = fine_speed_limit
+        self.event_log = event_log
+        self.verifier = verifier
+        self.camera_id = camera_id
+        self.on_summary = None
+        self.vehicle_store.on_release = self._track_ended
+        self._last_frame_number = None
+        self._track_timer = stage_timer("track", camera=camera_id)
+        self._boxes_timer = stage_timer("annotate_boxes", camera=camera_id)
+        self._overlay_timer = stage_timer("region_overlay", camera=camera_id)
+        self._record_timer = stage_timer("evidence_buffer", camera=camera_id)
+        self._frames = registry.counter("traffic_frames_total", "Frames tracked", camera=camera_id)
+        self._detections = registry.counter("traffic_detections_total", "Tracked boxes over all frames",
+                                            camera=camera_id)
+        self._violations = registry.counter("traffic_violations_total", "Speed measurements over the fine limit",
+                                            camera=camera_id)
+        self._dropped = registry.counter("traffic_dropped_frames_total", "Frames grabbed but never tracked",
+                                         camera=camera_id)
+        self._active_tracks = registry.gauge("traffic_active_tracks", "Tracks held by the vehicle store",
+                                             camera=camera_id)
+
+    def track(self, packet, xyxy: np.ndarray, tracker_ids: np.ndarray, confs: np.ndarray):
+        """Update the vehicle store from one frame of tracked boxes (see box_batch.boxes_to_arrays)"""
+        if registry.trace is not None:
+            registry.trace.frame(self.camera_id, packet.frame_number, packet.time_stamp)
+        with self._track_timer.time():
+            self._track(packet, xyxy, tracker_ids, confs)
+        self._count_frame(packet.frame_number, len(tracker_ids), len(packet.data["violations"]))
+
+    def _count_frame(self, frame_number: int, detections: int, violations: int):
+        self._frames.inc()
+        self._detections.inc(detections)
+        self._violations.inc(violations)
+        self._active_tracks.set(len(self.vehicle_store))
+        # A looped file restarts its frame numbers; only a forward gap is a drop
+        if self._last_frame_number is not None and frame_number is not None \
+                and frame_number > self._last_frame_number + 1:
+            self._dropped.inc(frame_number - self._last_frame_number - 1)
+        self._last_frame_number = frame_number
+
+    def _track(self, packet, xyxy: np.ndarray, tracker_ids: np.ndarray, confs: np.ndarray):
+        time_stamp = packet.time_stamp
+        bottom_points = bottom_centres(xyxy)
+        is_inside = self.region_mask.points_are_inside(bottom_points[:, 0], bottom_points[:, 1])
+        actual_points = self.transformer.transform_points(bottom_points)
+
+        # Free the slots of vehicles that left, then record this frame for every track
+        self.vehicle_store.expire(time_stamp)
+        if self.event_log is not None:
+            new = np.array([tracker_id not in self.vehicle_store for tracker_id in tracker_ids.tolist()], dtype=bool)
+        speeds, updates = self.vehicle_store.detected_batch(tracker_ids, confs, xyxy, is_inside, actual_points,
+                                                            time_stamp)
+
+        violating = is_inside & updates & (speeds > self.fine_speed_limit)
+        if self.event_log is not None:
+            self._log_events(time_stamp, tracker_ids, xyxy, is_inside, actual_points, speeds, updates, new, violating)
+        packet.data.update(
+            xyxy=xyxy,
+            tracker_ids=tracker_ids,
+            confs=confs,
+            is_inside=is_inside,
+            speeds=speeds,
+            updates=updates,
+            colour_classes=speed_classes(speeds, self.speed_limit, self.fine_speed_limit),
+            violations=list(zip(tracker_ids[violating].tolist(), speeds[violating].tolist())),
+        )
+        if self.verifier is not None:
+            suspect = is_inside & (speeds > self.verifier.suspect_speed)
+            self.verifier.observe(packet.frame, packet.frame_number, time_stamp, tracker_ids[suspect], xyxy[suspect])
+
+    def _log_events(self, time_stamp, tracker_ids, xyxy, is_inside, actual_points, speeds, updates, new, violating):
+        """Events of one frame; only tracks with something to report are visited"""
+        camera = self.camera_id
+        for i in np.flatnonzero(new).tolist():
+            self.event_log.emit(make_event("track_start", time_stamp, tracker_ids[i], camera=camera,
+                                           box=xyxy[i].tolist(), is_inside=bool(is_inside[i])))
+        for i in np.flatnonzero(updates & (speeds > 0)).tolist():
+            self.event_log.emit(make_event("speed", time_stamp, tracker_ids[i], speeds[i], camera,
+                                           position=actual_points[i].tolist(), is_inside=bool(is_inside[i])))
+        for i in np.flatnonzero(violating).tolist():
+            self.event_log.emit(make_event("violation", time_stamp, tracker_ids[i], speeds[i], camera,
+                                           box=xyxy[i].tolist(), speed_limit=self.speed_limit,
+                                           fine_speed_limit=self.fine_speed_limit))
+
+    def _track_ended(self, slot: int, reason: str):
+        if self.verifier is not None:
+            self.verifier.forget(int(self.vehicle_store.tracker_ids[slot]))
+        if self.event_log is None and self.on_summary is None:
+            return
+        summary = self.vehicle_store.summary(slot)
+        summary["reason"] = reason
+        if self.event_log is not None:
+            data = dict(summary)
+            tracker_id = data.pop("tracker_id")
+            self.event_log.emit(make_event("track_end", summary["last_seen"], tracker_id, summary["final_speed"],
+                                           self.camera_id, **data))
+        if self.on_summary is not None:
+            self.on_summary(summary)
+
+    def finish(self):
+        """The stream ended: finalize every track still in the store"""
+        self.vehicle_store.release_all("shutdown")
+
+    def annotate(self, packet):
+        """Draw the boxes of vehicles inside the region and the region overlay onto packet.frame"""
+        frame = packet.frame
+        data = packet.data
+        with self._boxes_timer.time():
+            for i in np.flatnonzero(data["is_inside"]).tolist():
+                x1, y1, x2, y2 = data["xyxy"][i].tolist()
+                color = SPEED_CLASS_COLOURS[data["colour_classes"][i]]
+                label = f"id: {int(data['tracker_ids'][i])}, speed: {float(data['speeds'][i]):.1f} km/h"
+                cv2.putText(frame, label, (x1, y1), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        with self._overlay_timer.time():
+            self.region_overlay.apply(frame)
+
+    def frame_metadata(self, packet) -> dict:
+        """JSON-able summary of a tracked frame: the vehicles inside the region, as annotate() draws them"""
+        data = packet.data
+        inside = np.flatnonzero(data["is_inside"])
+        return {
+            "frame_number": packet.frame_number,
+            "time_stamp": packet.time_stamp,
+            "vehicles": [{"id": tracker_id, "box": box, "speed": round(speed, 1)}
+                         for tracker_id, box, speed in zip(data["tracker_ids"][inside].tolist(),
+                                                            data["xyxy"][inside].tolist(),
+                                                            data["speeds"][inside].tolist())],
+            "violations": [tracker_id for tracker_id, _ in data["violations"]],
+        }
+
+    def record(self, packet):
+        """Keep the annotated frame in the evidence ring and submit this frame's violations"""
+        if self.evidence_buffer is None:
+            return
+        with self._record_timer.time():
+            self.evidence_buffer.write(packet.frame, packet.time_stamp, packet.frame_number)
+        if self.evidence_writer is None and self.verifier is None:
+            return
+        extra = {"speed_limit": self.speed_limit, "fine_speed_limit": self.fine_speed_limit}
+        for tracker_id, speed in packet.data["violations"]:
+            if self.verifier is not None:
+                self.verifier.submit(tracker_id, speed, packet.time_stamp, extra)
+            else:
+                self.evidence_writer.submit(tracker_id, speed, packet.time_stamp, self.evidence_buffer, extra=extra)
+
+    def process(self, packet, xyxy: np.ndarray, tracker_ids: np.ndarray, confs: np.ndarray):
+        """track, annotate and record one frame on the calling thread"""
+        self.track(packet, xyxy, tracker_ids, confs)
+        self.annotate(packet)
+        self.record(packet)
@@ -5,9 +5,9 @@ SCALING_FACTOR = 3.4
 
 def scale_coordinates(coords, original_width=3840, original_height=2160, target_width=1280, target_height=720):
     """Scale coordinates from original image dimensions to target dimensions"""
-    scale_x = target_width / original_width
-    scale_y = target_height / original_height
-    return np.array([[int(x * scale_x), int(y * scale_y)] for x, y in coords])
+    scale = np.array([target_width / original_width, target_height / original_height])
+    # astype truncates toward zero, as int() did
+    return (np.asarray(coords) * scale).astype(np.int64)
 
 
 
@@ -59,21 +59,14 @@ class vehicle_class():
     def calculate_speed(self):
         if len(self.actual_coordinates_and_time) < 2:
             return
+        # actual_coordinates is the road-plane position of the box bottom centre
         most_recent_entry = self.actual_coordinates_and_time[-1]
-        most_recent_coordinate = most_recent_entry[1]
         most_recent_time = most_recent_entry[0]
-        x1, y1 = most_recent_coordinate[0]
-        x2, y2 = most_recent_coordinate[1]
-        x_m1 = (x1 + x2) / 2
-        y_m1 = (y1 + y2) / 2
+        x_m1, y_m1 = most_recent_entry[1]
 
         second_most_recent_entry = self.actual_coordinates_and_time[-2]
-        second_most_recent_coordinate = second_most_recent_entry[1]
         second_most_recent_time = second_most_recent_entry[0]
-        x3, y3 = second_most_recent_coordinate[0]
-        x4, y4 = second_most_recent_coordinate[1]
-        x_m2 = (x3 + x4) / 2
-        y_m2 = (y3 + y4) / 2
+        x_m2, y_m2 = second_most_recent_entry[1]
 
         hyptenuse = np.linalg.norm(np.array([x_m1, y_m1]) - np.array([x_m2, y_m2]))
         time_difference = most_recent_time - second_most_recent_time
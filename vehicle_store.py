@@ -0,0 +1,238 @@
+from collections import OrderedDict
+
+import numpy as np
+from vehicle_class import SCALING_FACTOR
+
+
+class VehicleStore:
+    """
+    Struct-of-arrays replacement for a dict of vehicle_class objects.
+
+    Every tracker id gets a slot in preallocated NumPy columns and its per-frame
+    history lives in fixed-size ring buffers, so memory does not grow with the
+    number of ids ByteTrack hands out. Slots are reused once a track has not been
+    seen for time_not_detected_threshold seconds (see expire), or, if the store
+    is full, the least recently seen track is evicted. Tracks are kept in the
+    order they were last seen, so expire() and eviction only look at the tracks
+    they free, not at every slot.
+
+    Alongside the ring buffers each slot keeps running totals for summary(): when
+    the vehicle entered and left the region, the time it spent inside and its
+    mean and maximum speed there.
+
+    With a speed_estimator (see speed_estimator.py) speeds are refreshed on every
+    frame; without one the vehicle_class two-point calculation is used.
+
+    on_release(slot, reason), if set, is called just before a track's slot is freed
+    ("expired", "evicted" or release_all's reason), while its columns still hold the track.
+    """
+    def __init__(self, capacity: int = 256, history: int = 64, INTERVAL_BETWEEN_SPEED_CALCULATION: int = 25,
+                 time_not_detected_threshold: float = 2.0, speed_estimator=None,
+                 scaling_factor: float = SCALING_FACTOR):
+        self.capacity = capacity
+        self.scaling_factor = scaling_factor
+        self.speed_estimator = speed_estimator
+        self.INTERVAL_BETWEEN_SPEED_CALCULATION = INTERVAL_BETWEEN_SPEED_CALCULATION
+        # The ring must reach back one full interval for the speed calculation
+        self.history = max(history, INTERVAL_BETWEEN_SPEED_CALCULATION + 1)
+        self.time_not_detected_threshold = time_not_detected_threshold
+
+        # Per-slot columns (-1 marks a free slot)
+        self.tracker_ids = np.full(capacity, -1, dtype=np.int64)
+        self.first_seen = np.zeros(capacity, dtype=np.float64)
+        self.last_seen = np.zeros(capacity, dtype=np.float64)
+        self.detections = np.zeros(capacity, dtype=np.int64)
+        self.speed = np.zeros(capacity, dtype=np.float32)
+
+        # Per-slot running totals over the detections inside the region (NaN: never inside)
+        self.entry_time = np.full(capacity, np.nan, dtype=np.float64)
+        self.exit_time = np.full(capacity, np.nan, dtype=np.float64)
+        self.time_inside = np.zeros(capacity, dtype=np.float64)
+        self.speed_sum = np.zeros(capacity, dtype=np.float64)
+        self.speed_samples = np.zeros(capacity, dtype=np.int64)
+        self.max_speed = np.zeros(capacity, dtype=np.float32)
+
+        # Per-slot ring buffers, written at detections % history
+        self.times = np.zeros((capacity, self.history), dtype=np.float64)
+        self.confs = np.zeros((capacity, self.history), dtype=np.float32)
+        self.boxes = np.zeros((capacity, self.history, 4), dtype=np.int32)
+        self.is_inside = np.zeros((capacity, self.history), dtype=bool)
+        self.actual_coordinates = np.zeros((capacity, self.history, 2), dtype=np.float32)
+
+        # tracker id -> slot, least recently seen first
+        self._slots = OrderedDict()
+        self._free = list(range(capacity - 1, -1, -1))
+        self.on_release = None
+        self._released = {"expired": 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, tracker_id):
+        return tracker_id in self._slots
+
+    def slot_of(self, tracker_id):
+        """Slot index of a tracker id, or None if it is not tracked"""
+        return self._slots.get(tracker_id)
+
+    def stats(self) -> dict:
+        stats = {"active": len(self._slots), "capacity": self.capacity}
+        stats.update(self._released)
+        return stats
+
+    def _allocate(self, tracker_id: int, time_stamp: float) -> int:
+        if not self._free:
+            # Store is full: drop the track that has gone unseen the longest
+            self._release(next(iter(self._slots.values())), "evicted")
+        slot = self._free.pop()
+        self.tracker_ids[slot] = tracker_id
+        self.first_seen[slot] = time_stamp
+        self.last_seen[slot] = time_stamp
+        self.detections[slot] = 0
+        self.speed[slot] = 0
+        self.entry_time[slot] = np.nan
+        self.exit_time[slot] = np.nan
+        self.time_inside[slot] = 0
+        self.speed_sum[slot] = 0
+        self.speed_samples[slot] = 0
+        self.max_speed[slot] = 0
+        if self.speed_estimator is not None:
+            self.speed_estimator.reset(slot)
+        self._slots[tracker_id] = slot
+        return slot
+
+    def _release(self, slot: int, reason: str = "expired"):
+        if self.on_release is not None:
+            self.on_release(slot, reason)
+        del self._slots[int(self.tracker_ids[slot])]
+        self.tracker_ids[slot] = -1
+        self._free.append(slot)
+        self._released[reason] = self._released.get(reason, 0) + 1
+
+    def _lookup(self, tracker_ids, time_stamp: float) -> np.ndarray:
+        slots = np.empty(len(tracker_ids), dtype=np.intp)
+        for i, tracker_id in enumerate(tracker_ids):
+            slot = self._slots.get(tracker_id)
+            if slot is None:
+                slot = self._allocate(tracker_id, time_stamp)
+            else:
+                # Seen again: now the most recently seen track
+                self._slots.move_to_end(tracker_id)
+            slots[i] = slot
+        return slots
+
+    def expire(self, time_stamp: float) -> np.ndarray:
+        """Free the slots of tracks not seen for time_not_detected_threshold; returns their tracker ids"""
+        expired = []
+        for tracker_id, slot in self._slots.items():
+            if time_stamp - self.last_seen[slot] <= self.time_not_detected_threshold:
+                break  # every later track was seen more recently
+            expired.append(tracker_id)
+        for tracker_id in expired:
+            self._release(self._slots[tracker_id])
+        return np.array(expired, dtype=np.int64)
+
+    def release_all(self, reason: str = "shutdown") -> np.ndarray:
+        """Free every track (e.g. when the stream ends), so each still gets its on_release; returns their ids"""
+        released = list(self._slots)
+        for tracker_id in released:
+            self._release(self._slots[tracker_id], reason)
+        return np.array(released, dtype=np.int64)
+
+    def summary(self, slot: int) -> dict:
+        """
+        Final figures of the track in a slot: first/last seen, region entry/exit (None if it was
+        never inside), seconds between detections inside the region, and mean/max speed there.
+        """
+        inside = self.speed_samples[slot] > 0
+        entered = not np.isnan(self.entry_time[slot])
+        return {
+            "tracker_id": int(self.tracker_ids[slot]),
+            "first_seen": float(self.first_seen[slot]),
+            "last_seen": float(self.last_seen[slot]),
+            "detections": int(self.detections[slot]),
+            "entry_time": float(self.entry_time[slot]) if entered else None,
+            "exit_time": float(self.exit_time[slot]) if entered else None,
+            "time_in_region": float(self.time_inside[slot]),
+            "mean_speed": float(self.speed_sum[slot] / self.speed_samples[slot]) if inside else None,
+            "max_speed": float(self.max_speed[slot]) if inside else None,
+            "final_speed": float(self.speed[slot]),
+        }
+
+    def detected_batch(self, tracker_ids: np.ndarray, confs: np.ndarray, boxes: np.ndarray,
+                       is_inside: np.ndarray, actual_coordinates: np.ndarray, time_stamp: float):
+        """
+        Record one frame of detections for many tracks at once.
+        Returns (speeds, updates) arrays, the batched form of vehicle_class.detected.
+        """
+        if len(tracker_ids) == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=bool)
+
+        slots = self._lookup(np.asarray(tracker_ids).tolist(), time_stamp)
+        count = self.detections[slots]
+        position = count % self.history
+
+        # Time inside the region: the gap since the previous detection, when both were inside
+        is_inside = np.asarray(is_inside, dtype=bool)
+        previous_position = (count - 1) % self.history
+        stayed = is_inside & (count > 0) & self.is_inside[slots, previous_position]
+        self.time_inside[slots[stayed]] += time_stamp - self.times[slots[stayed], previous_position[stayed]]
+        inside_slots = slots[is_inside]
+        entering = inside_slots[np.isnan(self.entry_time[inside_slots])]
+        self.entry_time[entering] = time_stamp
+        self.exit_time[inside_slots] = time_stamp
+
+        self.times[slots, position] = time_stamp
+        self.confs[slots, position] = confs
+        self.boxes[slots, position] = boxes
+        self.is_inside[slots, position] = is_inside
+        self.actual_coordinates[slots, position] = actual_coordinates
+
+        count += 1
+        self.detections[slots] = count
+        self.last_seen[slots] = time_stamp
+
+        # Same cadence as vehicle_class: an update every INTERVAL detections
+        interval = self.INTERVAL_BETWEEN_SPEED_CALCULATION
+        updates = count % interval == 0
+        if self.speed_estimator is not None:
+            self.speed[slots] = self.speed_estimator.update(slots, time_stamp, actual_coordinates)
+            self._accumulate_speeds(inside_slots)
+            return self.speed[slots], updates
+
+        # Without an estimator, measure against the sample taken one interval earlier
+        ready = updates & (count >= 2 * interval)
+        if ready.any():
+            ready_slots = slots[ready]
+            current = position[ready]
+            previous = (current - interval) % self.history
+            distance = np.linalg.norm(self.actual_coordinates[ready_slots, current] -
+                                      self.actual_coordinates[ready_slots, previous], axis=1)
+            time_difference = self.times[ready_slots, current] - self.times[ready_slots, previous]
+            valid = time_difference > 0
+            self.speed[ready_slots[valid]] = distance[valid] / time_difference[valid] * self.scaling_factor
+
+        self._accumulate_speeds(inside_slots)
+        return self.speed[slots], updates
+
+    def _accumulate_speeds(self, inside_slots: np.ndarray):
+        """Add this frame's speeds of the tracks inside the region to their mean and maximum"""
+        measured = inside_slots[self.speed[inside_slots] > 0]
+        self.speed_sum[measured] += self.speed[measured]
+        self.speed_samples[measured] += 1
+        self.max_speed[measured] = np.maximum(self.max_speed[measured], self.speed[measured])
+
+    def detected(self, tracker_id: int, conf: float, box: list, is_inside: bool, actual_coordinates: tuple,
+                 time_stamp: float):
+        """Single-track form with the vehicle_class.detected contract: returns (speed, update)"""
+        speeds, updates = self.detected_batch([tracker_id], np.array([conf]), np.array([box]),
+                                              np.array([is_inside]), np.array([actual_coordinates]), time_stamp)
+        return float(speeds[0]), bool(updates[0])
+
+    def history_of(self, tracker_id: int):
+        """Ordered (oldest first) ring-buffer view of a track: (times, actual_coordinates)"""
+        slot = self._slots[tracker_id]
+        count = int(self.detections[slot])
+        length = min(count, self.history)
+        order = (np.arange(count - length, count)) % self.history
+        return self.times[slot, order], self.actual_coordinates[slot, order]
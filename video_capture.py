@@ -0,0 +1,178 @@
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+
+from metrics import stage_timer
+
+DECODE_BACKENDS = ("opencv", "ffmpeg")
+
+
+class ScaledCapture:
+    """
+    A cv2.VideoCapture whose frames come out at (width, height).
+
+    Asks the source for that size first (CAP_PROP_FRAME_WIDTH/HEIGHT, which cameras
+    honour and files ignore) and resizes what it gets otherwise, decoding into the same
+    native-size buffer every frame. grab() and retrieve() stay separate, so frames that
+    are skipped are never colour-converted or resized. width=None keeps the source size.
+    grab, retrieve and resize are timed into traffic_stage_seconds (see metrics.py).
+    """
+    def __init__(self, source, width: int = None, height: int = None, threads: int = None, camera=None):
+        params = [cv2.CAP_PROP_N_THREADS, threads] if threads else []
+        self.cap = cv2.VideoCapture(source, cv2.CAP_ANY, params)
+        self.size = (width, height) if width and height else None
+        if self.size is not None and self.cap.isOpened():
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self._native = None
+        self.frames = 0
+        self.resized = 0
+        self._grab_timer = stage_timer("grab", camera=camera)
+        self._retrieve_timer = stage_timer("retrieve", camera=camera)
+        self._resize_timer = stage_timer("resize", camera=camera)
+
+    def isOpened(self) -> bool:
+        return self.cap.isOpened()
+
+    def grab(self) -> bool:
+        with self._grab_timer.time():
+            return self.cap.grab()
+
+    def retrieve(self):
+        with self._retrieve_timer.time():
+            ret, self._native = self.cap.retrieve(self._native)
+        if not ret:
+            return False, None
+        self.frames += 1
+        if self.size is None or self._native.shape[1::-1] == self.size:
+            # The frame leaves this object, so the buffer is decoded into afresh next time
+            frame, self._native = self._native, None
+            return True, frame
+        self.resized += 1
+        with self._resize_timer.time():
+            return True, cv2.resize(self._native, self.size)
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop: int) -> float:
+        return self.cap.get(prop)
+
+    def set(self, prop: int, value) -> bool:
+        return self.cap.set(prop, value)
+
+    def release(self):
+        self.cap.release()
+
+
+class FfmpegCapture:
+    """
+    Decodes with an ffmpeg process whose scale filter outputs (width, height) BGR frames,
+    so the full-resolution frame is never colour-converted or copied into Python.
+
+    Same calls as a cv2.VideoCapture. ffmpeg decodes every frame, so grab() reads the
+    scaled frame from the pipe and retrieve() only wraps it. The frame rate comes from
+    opening the source once with OpenCV, and CAP_PROP_POS_MSEC counts frames at that rate.
+    set(CAP_PROP_POS_FRAMES, 0) restarts the file from its first frame. Reading a frame
+    from the pipe is timed as "grab" in traffic_stage_seconds.
+    """
+    def __init__(self, source, width: int, height: int, threads: int = None, camera=None):
+        probe = cv2.VideoCapture(source)
+        self.fps = probe.get(cv2.CAP_PROP_FPS)
+        self.frame_count = probe.get(cv2.CAP_PROP_FRAME_COUNT)
+        probe.release()
+        self.source = source
+        self.size = (width, height)
+        self.threads = threads
+        self.frame_bytes = width * height * 3
+        self.frames = 0
+        self.resized = 0
+        self._buffer = None
+        self._process = None
+        self._grab_timer = stage_timer("grab", camera=camera)
+        self._start()
+
+    def _start(self):
+        width, height = self.size
+        command = ["ffmpeg", "-loglevel", "error", "-nostdin"]
+        if self.threads:
+            command += ["-threads", str(self.threads)]
+        command += ["-i", str(self.source), "-an", "-vf", f"scale={width}:{height}:flags=bilinear",
+                    "-f", "rawvideo", "-pix_fmt", "bgr24", "-"]
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=self.frame_bytes)
+        self.position = 0
+
+    def isOpened(self) -> bool:
+        return self._process is not None and (self._process.poll() is None or self.position > 0)
+
+    def grab(self) -> bool:
+        if self._process is None:
+            return False
+        with self._grab_timer.time():
+            data = self._process.stdout.read(self.frame_bytes)
+        if len(data) < self.frame_bytes:
+            return False
+        self._buffer = data
+        self.position += 1
+        return True
+
+    def retrieve(self):
+        if self._buffer is None:
+            return False, None
+        self.frames += 1
+        self.resized += 1
+        frame = np.frombuffer(self._buffer, dtype=np.uint8).reshape(self.size[1], self.size[0], 3).copy()
+        self._buffer = None
+        return True, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return (self.position - 1) * 1000.0 / self.fps if self.fps > 0 and self.position else -1.0
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.frame_count
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.size[0])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.size[1])
+        return 0.0
+
+    def set(self, prop: int, value) -> bool:
+        if prop == cv2.CAP_PROP_POS_FRAMES and value == 0:
+            self.release()
+            self._start()
+            return True
+        return False
+
+    def release(self):
+        if self._process is not None:
+            self._process.stdout.close()
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+
+def open_capture(source, width: int = None, height: int = None, backend: str = "opencv", threads: int = None,
+                 camera=None):
+    """
+    A capture whose frames come out at (width, height) (None: the source size).
+    backend "ffmpeg" needs the ffmpeg binary on PATH and falls back to "opencv" without it.
+    camera labels its decode timings.
+    """
+    if backend not in DECODE_BACKENDS:
+        raise ValueError(f"Unknown decode backend {backend!r}, expected one of {DECODE_BACKENDS}")
+    if backend == "ffmpeg" and width and height and shutil.which("ffmpeg") is not None:
+        return FfmpegCapture(source, width, height, threads, camera)
+    return ScaledCapture(source, width, height, threads, camera)
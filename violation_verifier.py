@@ -0,0 +1,243 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+from box_batch import _to_numpy, bottom_centres, box_iou
+from metrics import stage_timer
+from vehicle_class import SCALING_FACTOR
+
+VEHICLE_CLASSES = {2: "car", 3: "motorcycle", 5: "bus", 7: "truck"}  # COCO classes a violation can be confirmed as
+CROP_MARGIN = 0.5  # box widths/heights of context around a vehicle's crop
+MIN_CROP_MARGIN = 16  # pixels
+
+
+class ViolationVerifier:
+    """
+    Second tier of a detector cascade: a heavy model re-checks only the vehicles the light
+    model's tracks make suspect, on crops of their frames.
+
+    A track inside the region whose speed passes suspect_speed is a suspect. observe() sees
+    every tracked frame before it is annotated. Every crop_every frames it copies a crop
+    around each suspect's box, up to crops of them. The frames in the evidence ring have boxes,
+    labels and the region overlay drawn in, which would hide the vehicle from the heavy model.
+    Once a suspect has its crops (or its track ends first), one verification job is queued. A
+    worker thread runs model.predict on the crops as one batch and looks for a vehicle-class
+    box overlapping the tracked one by min_iou. The suspect is confirmed when most of its crops
+    match. Its class is the one most matches agree on. The heavy model's boxes are its refined
+    boxes, and with a transformer they also give a refined speed.
+
+    Violations go through submit(), which pins their clip: the ring's frames up to the
+    violation, as the evidence writer would take them without a verifier. Those of a confirmed
+    track go to the evidence writer with that clip and the verdict in their sidecar. Those of a rejected track are
+    dropped. Those of a track still being verified wait for its verdict. The heavy model
+    therefore runs once per suspect vehicle, however many frames it is seen in. When
+    max_pending jobs are already waiting, a new suspect is not verified and its violations are
+    dropped, counted as overflow: a fine needs a verdict.
+
+    on_verdict(tracker_id, verdict), if set, is called on a worker thread with every verdict.
+
+    model is anything with predict(list of images) returning results with .boxes (xyxy, conf,
+    cls), such as a detector_backend model or bench/synthetic.StubModel.
+    """
+    def __init__(self, model, evidence_buffer=None, evidence_writer=None, suspect_speed: float = 120, crops: int = 3,
+                 crop_every: int = 5, min_iou: float = 0.5, workers: int = 1, max_pending: int = 8, transformer=None,
+                 scaling_factor: float = SCALING_FACTOR, predict_kwargs: dict = None):
+        self.model = model
+        self.evidence_buffer = evidence_buffer
+        self.evidence_writer = evidence_writer
+        self.suspect_speed = suspect_speed
+        self.crops = crops
+        self.crop_every = crop_every
+        self.min_iou = min_iou
+        self.transformer = transformer
+        self.scaling_factor = scaling_factor
+        self.predict_kwargs = predict_kwargs or {}
+        self.on_verdict = None
+        # tracker id -> {"observations", "last_frame", "queued", "verdict", "held"}, for suspects only
+        self._suspects = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._timer = stage_timer("verify")
+        self._stats = {"suspects": 0, "verified": 0, "confirmed": 0, "rejected": 0, "overflow": 0, "crops": 0,
+                       "violations_issued": 0, "violations_dropped": 0, "verify_seconds": 0.0}
+        self._workers = [threading.Thread(target=self._run, name=f"violation-verifier-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _count(self, **increments):
+        for key, value in increments.items():
+            self._stats[key] += value
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tracked"] = len(self._suspects)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    def observe(self, frame: np.ndarray, frame_number: int, time_stamp: float, tracker_ids: np.ndarray,
+                xyxy: np.ndarray):
+        """The suspects of a tracked frame, with their boxes, before anything is drawn on it"""
+        with self._lock:
+            for tracker_id, box in zip(tracker_ids.tolist(), xyxy.tolist()):
+                suspect = self._suspects.get(tracker_id)
+                if suspect is None:
+                    suspect = self._suspects[tracker_id] = {"observations": [], "last_frame": None, "queued": False,
+                                                            "verdict": None, "held": []}
+                    self._count(suspects=1)
+                if suspect["queued"] or (suspect["last_frame"] is not None and
+                                         frame_number - suspect["last_frame"] < self.crop_every):
+                    continue
+                suspect["observations"].append((frame_number, time_stamp, box) + self._crop(frame, box))
+                suspect["last_frame"] = frame_number
+                if len(suspect["observations"]) >= self.crops:
+                    self._enqueue(tracker_id, suspect)
+
+    def _enqueue(self, tracker_id: int, suspect: dict):
+        suspect["queued"] = True
+        try:
+            self._queue.put_nowait((tracker_id, suspect["observations"]))
+        except queue.Full:
+            suspect["verdict"] = {"confirmed": False, "reason": "overflow"}
+            # Violations held for this verdict are dropped with it (the caller holds the lock)
+            self._count(overflow=1, violations_dropped=len(suspect["held"]))
+            suspect["held"] = []
+
+    def submit(self, tracker_id: int, speed: float, time_stamp: float, extra: dict = None):
+        """A violation of tracker_id: issued, dropped or held according to its verdict"""
+        # The clip ends at the violation's frame, however long its verdict takes
+        clip = self.evidence_buffer.clip(end_time=time_stamp) if self.evidence_buffer is not None else None
+        violation = (int(tracker_id), float(speed), float(time_stamp), extra or {}, clip)
+        with self._lock:
+            suspect = self._suspects.get(violation[0])
+            if suspect is None or not suspect["observations"]:
+                # Over the fine limit before any frame of it was observed: nothing to verify on
+                self._count(violations_dropped=1)
+                return
+            if suspect["verdict"] is None:
+                suspect["held"].append(violation)
+                return
+            verdict = suspect["verdict"]
+        self._issue([violation], verdict)
+
+    def forget(self, tracker_id: int):
+        """The track ended: it is dropped, once the verdict its held violations wait for is in"""
+        with self._lock:
+            suspect = self._suspects.get(tracker_id)
+            if suspect is None:
+                return
+            if suspect["held"] and not suspect["queued"]:
+                # Violations are waiting on a track that ended before all its crops were taken
+                self._enqueue(tracker_id, suspect)
+            if suspect["queued"] and suspect["verdict"] is None:
+                suspect["ended"] = True
+            else:
+                del self._suspects[tracker_id]
+
+    def _issue(self, violations: list, verdict: dict):
+        if not verdict["confirmed"]:
+            with self._lock:
+                self._count(violations_dropped=len(violations))
+            return
+        for tracker_id, speed, time_stamp, extra, clip in violations:
+            if self.evidence_writer is not None:
+                self.evidence_writer.submit(tracker_id, speed, time_stamp, self.evidence_buffer,
+                                            extra=dict(extra, verification=verdict), clip=clip)
+        with self._lock:
+            self._count(violations_issued=len(violations))
+
+    @staticmethod
+    def _crop(frame: np.ndarray, box: list):
+        """(copy of the frame around box, (x1, y1) of the copy in the frame)"""
+        height, width = frame.shape[:2]
+        x1, y1, x2, y2 = box
+        margin_x = max(int((x2 - x1) * CROP_MARGIN), MIN_CROP_MARGIN)
+        margin_y = max(int((y2 - y1) * CROP_MARGIN), MIN_CROP_MARGIN)
+        cx1, cy1 = min(max(x1 - margin_x, 0), width - 1), min(max(y1 - margin_y, 0), height - 1)
+        cx2, cy2 = max(min(x2 + margin_x, width), cx1 + 1), max(min(y2 + margin_y, height), cy1 + 1)
+        return frame[cy1:cy2, cx1:cx2].copy(), (cx1, cy1)
+
+    def verify(self, observations: list) -> dict:
+        """Run the heavy model on a suspect's crops; the verdict"""
+        start = time.perf_counter()
+        matches = []
+        results = self.model.predict([crop for *_, crop, _ in observations], **self.predict_kwargs)
+        for (frame_number, time_stamp, box, _, offset), result in zip(observations, results):
+            offset = np.tile(offset, 2)
+            match = self._match(result.boxes, np.array(box, dtype=np.float32) - offset)
+            if match is not None:
+                refined, class_id, conf = match
+                matches.append((frame_number, time_stamp, (refined + offset).round().astype(int), class_id, conf))
+        classes = [class_id for _, _, _, class_id, _ in matches]
+        class_id = max(set(classes), key=classes.count) if classes else None
+        verdict = {
+            "confirmed": len(matches) * 2 > len(observations),
+            "class": VEHICLE_CLASSES.get(class_id),
+            "crops": len(observations),
+            "matches": len(matches),
+            "confidence": float(np.mean([conf for *_, conf in matches])) if matches else 0.0,
+            "refined_boxes": {frame_number: box.tolist() for frame_number, _, box, _, _ in matches},
+            "refined_speed": self._refined_speed(matches),
+        }
+        with self._lock:
+            self._count(verified=1, crops=len(observations), verify_seconds=time.perf_counter() - start,
+                        **{"confirmed" if verdict["confirmed"] else "rejected": 1})
+        return verdict
+
+    def _match(self, boxes, box: np.ndarray):
+        """(box, class id, conf) of the vehicle-class detection overlapping box the most, if by min_iou"""
+        if boxes is None or len(boxes) == 0:
+            return None
+        xyxy = _to_numpy(boxes.xyxy).reshape(-1, 4).astype(np.float32)
+        classes = _to_numpy(boxes.cls).reshape(-1).astype(np.int64)
+        confs = _to_numpy(boxes.conf).reshape(-1)
+        overlap = box_iou(box, xyxy)[0] * np.isin(classes, list(VEHICLE_CLASSES))
+        best = int(np.argmax(overlap))
+        if overlap[best] < self.min_iou:
+            return None
+        return xyxy[best], int(classes[best]), float(confs[best])
+
+    def _refined_speed(self, matches: list):
+        """km/h from the refined boxes' road-plane positions (least squares), with a transformer and 2+ matches"""
+        if self.transformer is None or len(matches) < 2:
+            return None
+        times = np.array([time_stamp for _, time_stamp, *_ in matches])
+        if np.ptp(times) <= 0:
+            return None
+        positions = self.transformer.transform_points(bottom_centres(np.array([box for _, _, box, _, _ in matches])))
+        velocity = np.polyfit(times - times[0], positions, 1)[0]
+        return float(np.hypot(velocity[0], velocity[1]) * self.scaling_factor)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            tracker_id, observations = job
+            try:
+                with self._timer.time():
+                    verdict = self.verify(observations)
+            except Exception as e:
+                print(f"Error verifying tracker {tracker_id}: {e}")
+                verdict = {"confirmed": False, "reason": "error"}
+            with self._lock:
+                suspect = self._suspects.get(tracker_id)
+                held = suspect["held"] if suspect is not None else []
+                if suspect is not None:
+                    suspect["verdict"] = verdict
+                    suspect["held"] = []
+                    if suspect.get("ended"):
+                        del self._suspects[tracker_id]
+            if self.on_verdict is not None:
+                self.on_verdict(tracker_id, verdict)
+            self._issue(held, verdict)
+
+    def close(self, timeout: float = None):
+        """Verify the queued suspects and stop the workers"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)